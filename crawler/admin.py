@@ -29,5 +29,6 @@ class LogEntryAdmin(admin.ModelAdmin):
 admin.site.register(models.CrawlRun, CrawlRunAdmin)
 # this would be a nice inline if it were paginated
 admin.site.register(models.DeckCrawlResult, DeckCrawlResultAdmin)
+admin.site.register(models.LegalityRecheck)
 admin.site.register(models.LogStart, LogStartAdmin)
 admin.site.register(models.LogEntry, LogEntryAdmin)
@@ -0,0 +1,67 @@
+import sys
+
+from decklist.models import Printing
+
+
+class CardNotFound(Exception): ...
+
+
+class CardIndex:
+    """Resolves the printings and names deck sites give us into card IDs.
+
+    Built once per run from every printing we know about, so resolving a
+    decklist never needs a trip to the database. Card IDs are stored once
+    and referred to by position; names are interned since each one is
+    shared by all of its card's printings."""
+
+    # HACK:
+    # cards with set_code `j21` often don't resolve
+    # so we relax the restriction and try again
+    # likewise, the `rex` lands don't resolve, so also
+    # relax and try again.
+    RELAXED_SETS = ('j21', 'rex')
+
+    def __init__(self):
+        self._card_ids = []
+        card_positions = {}
+        self._by_printing = {}
+        self._by_name_and_set = {}
+        self._by_name = {}
+
+        printings = (
+            Printing.objects
+            .values_list('id', 'card_id', 'set_code', 'card__name')
+            .iterator(chunk_size=10000)
+        )
+        for printing_id, card_id, set_code, name in printings:
+            position = card_positions.get(card_id)
+            if position is None:
+                position = card_positions[card_id] = len(self._card_ids)
+                self._card_ids.append(card_id)
+
+            name = sys.intern(name.lower())
+            self._by_printing[str(printing_id)] = position
+            # first one wins, like `.first()` did when this was a query
+            self._by_name_and_set.setdefault((name, sys.intern(set_code.lower())), position)
+            self._by_name.setdefault(name, position)
+
+    def __len__(self):
+        return len(self._by_printing)
+
+    def card_for_printing(self, printing_id):
+        "Card ID for a Scryfall printing ID, or None if we don't know it"
+        position = self._by_printing.get(printing_id.lower())
+        return None if position is None else self._card_ids[position]
+
+    def lookup(self, name, set_code):
+        "Card ID for a card name as printed in a set"
+        key = name.lower()
+        position = self._by_name_and_set.get((key, set_code.lower()))
+
+        if position is None and set_code in self.RELAXED_SETS:
+            position = self._by_name.get(key)
+
+        if position is None:
+            raise CardNotFound(f'"{name}" ({set_code})')
+
+        return self._card_ids[position]
@@ -0,0 +1,330 @@
+import collections
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import connection, connections, transaction
+from django.db.utils import DataError, IntegrityError
+
+from decklist.models import Card, CardTheme, Printing
+from crawler.models import LegalityRecheck
+from crawler.card_parsing import (
+    CARD_FIELDS, PRINTING_FIELDS,
+    parse_card_and_printing, want_card, FailedToParseCard,
+)
+
+
+# fields we own when a card or printing already exists; notably, we
+# leave `editorial_printing` alone since that's set by hand
+CARD_UPDATE_FIELDS = [f for f in CARD_FIELDS if f != 'id']
+PRINTING_UPDATE_FIELDS = (
+    ['card']
+    + [f for f in PRINTING_FIELDS if f != 'id']
+    + ['fingerprint']
+)
+
+# if any of these change for a card, decks containing it may have
+# become legal (or illegal)
+LEGALITY_FIELDS = (
+    'ever_common',
+    'ever_uncommon',
+    'partner_type',
+    'is_creature',
+    'is_banned',
+    'identity_mask',
+)
+
+
+def legality_facts(cards):
+    "{card_id: [facts...]} of the LEGALITY_FIELDS for a Card queryset"
+    return {
+        id: facts
+        for id, *facts in cards.values_list('id', *LEGALITY_FIELDS)
+    }
+
+
+def queue_rechecks(before, after):
+    "Queue a legality recheck for each card whose facts changed, returning how many."
+    changed = [id for id, facts in before.items() if after.get(id) != facts]
+    LegalityRecheck.objects.bulk_create(
+        [LegalityRecheck(card_id=id) for id in changed],
+        ignore_conflicts=True,
+    )
+    return len(changed)
+
+
+def refresh_all_facts():
+    """Recompute every card's stored facts and queue rechecks for the ones
+    which changed, returning how many. Ingest only refreshes cards whose
+    printings changed, so this catches the rest, like a card newly added
+    to `BANNED_CARDS`."""
+    before = legality_facts(Card.objects.all())
+    Card.objects.refresh_facts()
+    return queue_rechecks(before, legality_facts(Card.objects.all()))
+
+
+class CardBatchWriter:
+    """Collects parsed cards and printings and upserts them in batches.
+
+    Each batch is written as one multi-row upsert for cards and one for
+    printings, instead of two round trips per printing. Printings whose
+    fingerprint matches what's already stored are skipped entirely."""
+
+    def __init__(self, batch_size, log):
+        self.batch_size = batch_size
+        self._log = log
+        self._cards = {}
+        self._printings = {}
+        self._fingerprints = {
+            str(id): fingerprint
+            for id, fingerprint
+            in Printing.objects.values_list('id', 'fingerprint')
+        }
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.rows_written = 0
+        self.write_time = 0.0
+        self.legality_changed = 0
+
+    def add(self, card: Card, printing: Printing):
+        old_fingerprint = self._fingerprints.get(str(printing.id))
+        if old_fingerprint is None:
+            self.inserted += 1
+        elif old_fingerprint == printing.fingerprint:
+            self.unchanged += 1
+            return
+        else:
+            self.updated += 1
+
+        if len(card.name) > 100:
+            # Market Research Elemental 🙄
+            card.name = card.name[:47] + '...'
+
+        # a card shows up once per printing; Postgres won't let a single
+        # upsert touch the same row twice, so the last one in wins
+        self._cards[card.id] = card
+        self._printings[printing.id] = printing
+
+        if len(self._printings) >= self.batch_size:
+            self.flush()
+
+    def add_row(self, card_row, printing_row):
+        card = Card(**dict(zip(CARD_FIELDS, card_row)))
+        printing = Printing(
+            card=card,
+            **dict(zip(PRINTING_FIELDS + ('fingerprint',), printing_row)),
+        )
+        self.add(card, printing)
+
+    def flush(self):
+        if not self._printings:
+            return
+
+        cards = list(self._cards.values())
+        printings = list(self._printings.values())
+        self._cards = {}
+        self._printings = {}
+
+        start = time.monotonic()
+        before = legality_facts(Card.objects.filter(id__in=[c.id for c in cards]))
+        try:
+            with transaction.atomic():
+                self._upsert(cards, printings)
+                self._refresh_facts(cards)
+        except DataError:
+            # something in this batch is bad; go row-by-row so we can
+            # report exactly which card it was and keep the rest
+            self._write_individually(cards, printings)
+            self._refresh_facts(cards)
+        self._queue_rechecks(before)
+        self.write_time += time.monotonic() - start
+        self.rows_written += len(printings)
+
+    @property
+    def rows_per_second(self):
+        if self.write_time == 0:
+            return 0.0
+        return self.rows_written / self.write_time
+
+    def _upsert(self, cards, printings):
+        Card.objects.bulk_create(
+            cards,
+            update_conflicts=True,
+            unique_fields=['id'],
+            update_fields=CARD_UPDATE_FIELDS,
+        )
+        Printing.objects.bulk_create(
+            printings,
+            update_conflicts=True,
+            unique_fields=['id'],
+            update_fields=PRINTING_UPDATE_FIELDS,
+        )
+
+    def _refresh_facts(self, cards):
+        # a new printing can change what we know about its card (a
+        # first printing at common, say)
+        Card.objects.filter(id__in=[c.id for c in cards]).refresh_facts()
+        # and a changed type line or keywords can move it between themes
+        CardTheme.objects.refresh_cards(c.id for c in cards)
+
+    def _queue_rechecks(self, before):
+        # brand-new cards can't be in any decks yet, so only cards we
+        # already had are worth comparing
+        if not before:
+            return
+        after = legality_facts(Card.objects.filter(id__in=before.keys()))
+        self.legality_changed += queue_rechecks(before, after)
+
+    def _write_individually(self, cards, printings):
+        for c in cards:
+            try:
+                with transaction.atomic():
+                    self._upsert([c], [])
+            except DataError as e:
+                self._log(f"Card {c.name} threw {e}")
+
+        for p in printings:
+            try:
+                with transaction.atomic():
+                    self._upsert([], [p])
+            except (DataError, IntegrityError) as e:
+                # IntegrityError: its card didn't make it in
+                self._log(f"Printing {p} threw {e}")
+
+
+# Rows are how parsed cards travel between processes: plain tuples
+# pickle much more cheaply than model instances.
+def card_to_row(card: Card):
+    return tuple(getattr(card, f) for f in CARD_FIELDS)
+
+
+def printing_to_row(printing: Printing):
+    return tuple(getattr(printing, f) for f in PRINTING_FIELDS) + (printing.fingerprint,)
+
+
+def parse_chunk(json_cards):
+    """Runs in a worker process: parse a chunk of plain card dicts into
+    rows, and report any which couldn't be parsed."""
+    start = time.monotonic()
+    rows = []
+    failures = []
+    for json_card in json_cards:
+        if not want_card(json_card):
+            continue
+        try:
+            c, p = parse_card_and_printing(json_card)
+        except FailedToParseCard as e:
+            failures.append((json_card.get('name'), e.args[0]))
+            continue
+        rows.append((card_to_row(c), printing_to_row(p)))
+
+    return rows, failures, time.monotonic() - start
+
+
+class CardPipeline:
+    """Tokenize, parse, and write cards with each stage running at once.
+
+    The caller's thread pulls cards off the tokenizer in chunks and hands
+    them to a pool of worker processes for parsing. Parsed rows go to a
+    single writer thread which feeds a CardBatchWriter. Only a few chunks
+    are allowed in flight between each stage, so memory stays flat no
+    matter how big the bulk file is."""
+
+    CHUNK_SIZE = 500
+
+    def __init__(self, writer: CardBatchWriter, workers, err):
+        self.writer = writer
+        self.workers = workers
+        self._err = err
+        self._writer_error = None
+
+        self.tokenized = 0
+        self.tokenize_time = 0.0
+        self.parsed = 0
+        self.parse_time = 0.0
+
+    def run(self, json_cards):
+        # forked workers must not inherit our database sockets
+        connections.close_all()
+
+        write_queue = queue.Queue(maxsize=self.workers * 2)
+        writer_thread = threading.Thread(
+            target=self._write_rows,
+            args=(write_queue,),
+        )
+
+        in_flight = collections.deque()
+        with ProcessPoolExecutor(
+            self.workers,
+            mp_context=multiprocessing.get_context('fork'),
+        ) as pool:
+            # start the workers before there's a second thread to fork
+            pool.submit(int).result()
+            writer_thread.start()
+            try:
+                for chunk in self._chunks(json_cards):
+                    in_flight.append(pool.submit(parse_chunk, chunk))
+                    if len(in_flight) >= self.workers * 2:
+                        self._collect(in_flight.popleft(), write_queue)
+                while in_flight:
+                    self._collect(in_flight.popleft(), write_queue)
+            finally:
+                write_queue.put(None)
+                writer_thread.join()
+
+        if self._writer_error:
+            raise self._writer_error
+
+    def _chunks(self, json_cards):
+        chunk = []
+        cards = iter(json_cards)
+        while True:
+            start = time.monotonic()
+            json_card = next(cards, None)
+            self.tokenize_time += time.monotonic() - start
+            if json_card is None:
+                break
+
+            self.tokenized += 1
+            chunk.append(json_card)
+            if len(chunk) >= self.CHUNK_SIZE:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
+    def _collect(self, future, write_queue):
+        rows, failures, elapsed = future.result()
+        self.parsed += len(rows) + len(failures)
+        self.parse_time += elapsed
+
+        for name, reasons in failures:
+            self._err(f"failed to parse {name}")
+            for k, v in reasons.items():
+                self._err(f".. {k}: {v}")
+
+        write_queue.put(rows)
+
+    def _write_rows(self, write_queue):
+        # runs on its own thread, and therefore its own DB connection
+        try:
+            while (rows := write_queue.get()) is not None:
+                if self._writer_error:
+                    # keep draining so the parse stage never blocks on us
+                    continue
+                try:
+                    for card_row, printing_row in rows:
+                        self.writer.add_row(card_row, printing_row)
+                except Exception as e:
+                    self._writer_error = e
+
+            if not self._writer_error:
+                self.writer.flush()
+        except Exception as e:
+            self._writer_error = e
+        finally:
+            connection.close()
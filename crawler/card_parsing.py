@@ -1,8 +1,32 @@
+import hashlib
+import json
+
 from django.utils.dateparse import parse_date
 
 from decklist.models import Card, Printing, PartnerType, Rarity
 
 
+# everything the extractors below fill in from Scryfall data
+CARD_FIELDS = (
+    'id',
+    'name',
+    'identity_w', 'identity_u', 'identity_b', 'identity_r', 'identity_g',
+    'type_line',
+    'keywords',
+    'scryfall_uri',
+    'partner_type',
+)
+PRINTING_FIELDS = (
+    'id',
+    'set_code',
+    'rarity',
+    'image_uri',
+    'is_highres',
+    'is_paper',
+    'release_date',
+)
+
+
 class ParseFailure(Exception): ...
 class FailedToParseCard(Exception): ...
 
@@ -17,11 +41,35 @@ def parse_card_and_printing(json_card):
             # try the next method
             c, p = None, None
         
-        if c and p: return c, p
+        if c and p:
+            p.fingerprint = fingerprint(c, p)
+            return c, p
 
     raise FailedToParseCard(parse_failures)
 
 
+def want_card(json_card):
+    # we want to exclude some non-playable cards but aren't entirely
+    # beholden to upstream's record of format legalities
+    if 'layout' in json_card and json_card['layout'] in (
+        'planar', 'scheme', 'vanguard', 'token', 'double_faced_token',
+        'emblem', 'art_series', 'reversible_card',
+    ):
+        return False
+
+    return True
+
+
+def fingerprint(card, printing):
+    """Hash of everything we parsed for this printing (and its card), so
+    an unchanged printing can be recognized without comparing fields."""
+    values = (
+        [getattr(card, f) for f in CARD_FIELDS]
+        + [getattr(printing, f) for f in PRINTING_FIELDS]
+    )
+    return hashlib.sha1(json.dumps(values, default=str).encode()).hexdigest()
+
+
 def _extract_card_and_printing(json_card):
     try:
         c = Card(
@@ -1,14 +1,29 @@
+import queue
+import threading
+from typing import NamedTuple
 import httpx
 from smallformats import __version__
 from decklist.models import DataSource, Deck
 from crawler.models import DeckCrawlResult
 from django.utils.dateparse import parse_datetime
-from django.db import transaction
+from django.db import connections, transaction
 
 ARCHIDEKT_API_BASE = "https://archidekt.com/api/"
 MOXFIELD_API_BASE = "https://api2.moxfield.com/v2/"
 SCRYFALL_API_BASE = "https://api.scryfall.com/"
 
+# how hard we're willing to hit each deck site: requests per second,
+# and how many requests may be outstanding at once
+HOST_LIMITS = {
+    'archidekt.com': (0.5, 1),
+    'api2.moxfield.com': (0.5, 1),
+}
+DEFAULT_HOST_LIMIT = (0.5, 1)
+
+# crawls start at the rate above and speed up while the site keeps
+# answering happily, but never past this
+MAX_CRAWL_RATE = 2.0
+
 HEADERS = {
     'User-agent': f'SmallFormats/{__version__}',
     # Scryfall requires an Accept header
@@ -31,6 +46,12 @@ class CrawlerExit(Exception):
         self.response = response
 
 
+class Page(NamedTuple):
+    url: str
+    next_url: str | None
+    envelope: dict
+
+
 class _BaseCrawler:
     API_BASE = None
     INITIAL_PAGE_ROUTE = None
@@ -45,10 +66,18 @@ class _BaseCrawler:
     CREATOR_DISPLAY_KEY_1 = None
     CREATOR_DISPLAY_KEY_2 = None
 
-    def __init__(self, client: httpx.Client, initial_url, stop_after, write):
+    DECK_UPDATE_FIELDS = (
+        'name',
+        'source_link',
+        'creator_display_name',
+        'updated_time',
+    )
+
+    def __init__(self, client: httpx.Client, initial_url, stop_after, write, pacer=None):
         self.stop_after = stop_after
         self._client = client
         self._write = write or print
+        self._pacer = pacer
         self.url = initial_url or self._build_initial_url()
         self._keep_going = True
     
@@ -64,20 +93,108 @@ class _BaseCrawler:
         if not self._keep_going:
             raise CrawlerExit("this crawler cannot proceed")
 
-        response = self._client.get(self.url)
+        try:
+            page = self.fetch_page()
+        except CrawlerExit:
+            self._keep_going = False
+            raise
+
+        return self.process_page(page)
+
+    def fetch_page(self):
+        """Fetch the page at `self.url` and move `self.url` on to the
+        page after it. Doesn't touch the database, so it's safe to run
+        ahead of `process_page` on another thread."""
+        url = self.url
+        response = self._fetch(url)
 
         # check errors
         if response.status_code < 200 or response.status_code >= 300:
             # report error and bail
+            raise CrawlerExit(f"got {response.status_code} from client", response=response)
+
+        envelope = response.json()
+        self.url = self._next_url(response, envelope)
+        return Page(url, self.url, envelope)
+
+    def process_page(self, page):
+        "Write a fetched page to the database; returns whether to keep going."
+        oldest_seen = self._process_page(self._page_results(page.envelope), self.stop_after)
+        if page.next_url is None:
+            # reached the end!
+            self._keep_going = False
+        elif self.stop_after and oldest_seen and oldest_seen < self.stop_after:
+            # we're done!
             self._keep_going = False
-            raise CrawlerExit(f"got {response.status_code} from client", response)
-        
-        else:
-            self._process_response(response)
 
         return self._keep_going
 
-    def _process_response(self, response: httpx.Response):
+    def prefetched_pages(self):
+        """Yield pages one at a time while the next one is already being
+        fetched in the background. Stop iterating (or break out) whenever
+        `process_page` says to; the page fetched ahead is thrown away."""
+        pages = queue.Queue(maxsize=1)
+        stop = threading.Event()
+
+        def offer(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def fetch_ahead():
+            try:
+                while not stop.is_set():
+                    page = self.fetch_page()
+                    if not offer(page) or page.next_url is None:
+                        break
+                offer(None)
+            except Exception as e:
+                offer(e)
+            finally:
+                # retry messages may have been logged from this thread
+                connections.close_all()
+
+        fetcher = threading.Thread(target=fetch_ahead, name="crawl-prefetch", daemon=True)
+        fetcher.start()
+        try:
+            while (page := pages.get()) is not None:
+                if isinstance(page, Exception):
+                    self._keep_going = False
+                    raise page
+                yield page
+        finally:
+            stop.set()
+            fetcher.join()
+
+    def _fetch(self, url):
+        if not self._pacer:
+            return self._client.get(url)
+
+        while True:
+            self._pacer.wait()
+            response = self._client.get(url)
+            if not self._pacer.should_retry(response):
+                self._pacer.succeeded(response)
+                return response
+
+            delay = self._pacer.failed(response)
+            if delay is None:
+                # out of patience
+                return response
+            self._write(
+                f"Got {response.status_code}; slowing to "
+                f"{self._pacer.rate:.2f} req/s and retrying in {delay:.0f}s"
+            )
+
+    def _next_url(self, response: httpx.Response, envelope):
+        "URL of the page after this one, or None at the end of the listing"
+        raise NotImplementedError
+
+    def _page_results(self, envelope):
         raise NotImplementedError
     
     def _process_page(self, results, stop_after):
@@ -90,19 +207,28 @@ class _BaseCrawler:
         ).filter(source_id__in=ids)
         existing_decks = { d.source_id: d for d in qs }
 
+        new_decks = {}
+        updated_decks = {}
+        oldest_seen = None
         for deck_data in results:
             deck_updated_at = parse_datetime(deck_data[self.LAST_UPDATE_KEY])
+            oldest_seen = deck_updated_at
             if stop_after and deck_updated_at < stop_after:
                 # break if we've seen everything back to the right time
-                return deck_updated_at
+                break
 
             this_id = str(deck_data[self.ID_KEY])
+            if this_id in new_decks or this_id in updated_decks:
+                # listings can shift under us mid-crawl; the first
+                # (newest) copy wins
+                continue
             if this_id in existing_decks.keys():
                 deck = existing_decks[this_id]
-                deck.commander = None # reset commander in case it changed
+                updated_decks[this_id] = deck
             else:
                 deck = Deck()
                 deck.pdh_legal = False # until proven otherwise!
+                new_decks[this_id] = deck
             deck.name = deck_data[self.NAME_KEY]
             deck.source = self.DATASOURCE
             deck.source_id = this_id
@@ -111,18 +237,31 @@ class _BaseCrawler:
             deck.creator_display_name = deck_data[self.CREATOR_DISPLAY_KEY_1][self.CREATOR_DISPLAY_KEY_2]
             deck.updated_time = deck_updated_at
 
-            crawl_result = DeckCrawlResult(
-                url=self.DECK_FETCH_LINK.format(this_id),
-                deck=deck,
-                updated_time=deck_updated_at,
-                got_cards=False,
+        with transaction.atomic():
+            # another crawl may have created some of these since we
+            # looked, so fold those into updates
+            Deck.objects.bulk_create(
+                new_decks.values(),
+                update_conflicts=True,
+                unique_fields=('source', 'source_id'),
+                update_fields=self.DECK_UPDATE_FIELDS,
+            )
+            Deck.objects.bulk_update(
+                updated_decks.values(),
+                fields=self.DECK_UPDATE_FIELDS,
+            )
+            DeckCrawlResult.objects.bulk_create(
+                DeckCrawlResult(
+                    url=self.DECK_FETCH_LINK.format(deck.source_id),
+                    deck=deck,
+                    updated_time=deck.updated_time,
+                    got_cards=False,
+                )
+                for deck in (*new_decks.values(), *updated_decks.values())
             )
-            with transaction.atomic():
-                deck.save()
-                crawl_result.save()
         
         # the last deck we processed will have the oldest date
-        return deck_updated_at
+        return oldest_seen
 
 
 class ArchidektCrawler(_BaseCrawler):
@@ -143,29 +282,22 @@ class ArchidektCrawler(_BaseCrawler):
     CREATOR_DISPLAY_KEY_1 = 'owner'
     CREATOR_DISPLAY_KEY_2 = 'username'
 
-    def _process_response(self, response):
-        envelope = response.json()
+    def _next_url(self, response, envelope):
         count, next = envelope['count'], envelope['next']
 
         # Archidekt seems to send "count = -1" under some conditions
         if count <= 0:
-            self._keep_going = False
-            raise CrawlerExit(f"Archidekt client got: {response.text}", response)
-
-        if next:
-            # Archidekt "next" comes back as http:// so fix that up
-            if next[0:5] == 'http:':
-                next = 'https:' + next[5:]
-            self.url = next
-        else:
-            # reached the end!
-            self.url = None
-            self._keep_going = False
+            raise CrawlerExit(f"Archidekt client got: {response.text}", response=response)
 
-        oldest_seen = self._process_page(envelope['results'], self.stop_after)
-        if self.stop_after and oldest_seen < self.stop_after:
-            # we're done!
-            self._keep_going = False
+        if not next:
+            return None
+        # Archidekt "next" comes back as http:// so fix that up
+        if next[0:5] == 'http:':
+            next = 'https:' + next[5:]
+        return next
+
+    def _page_results(self, envelope):
+        return envelope['results']
 
 
 class MoxfieldCrawler(_BaseCrawler):
@@ -188,23 +320,17 @@ class MoxfieldCrawler(_BaseCrawler):
     CREATOR_DISPLAY_KEY_1 = 'createdByUser'
     CREATOR_DISPLAY_KEY_2 = 'userName'
 
-    def _process_response(self, response):
-        envelope = response.json()
+    def _next_url(self, response, envelope):
         count = envelope['totalResults']
         page = envelope['pageNumber']
         totalPages = envelope['totalPages']
-        if page < totalPages:
-            self.url = response.url.copy_set_param('pageNumber', page + 1)
-        else:
-            # reached the end!
-            self._keep_going = False
-            self.url = None
 
         if count <= 0:
-            self._keep_going = False
-            raise CrawlerExit(f"Moxfield client got: {response.text}", response)
+            raise CrawlerExit(f"Moxfield client got: {response.text}", response=response)
 
-        oldest_seen = self._process_page(envelope['data'], self.stop_after)
-        if self.stop_after and oldest_seen < self.stop_after:
-            # we're done!
-            self._keep_going = False
+        if page < totalPages:
+            return response.url.copy_set_param('pageNumber', page + 1)
+        return None
+
+    def _page_results(self, envelope):
+        return envelope['data']
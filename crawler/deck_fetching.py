@@ -0,0 +1,75 @@
+import asyncio
+from collections import defaultdict, deque
+
+import httpx
+
+from crawler.crawlers import HOST_LIMITS, DEFAULT_HOST_LIMIT
+from crawler.pacing import TokenBucket, retry_after
+
+
+# if a server says "slow down" without saying for how long
+DEFAULT_RETRY_AFTER = 30
+MAX_RETRIES = 5
+
+
+class ConcurrentFetcher:
+    """Fetches many URLs across several hosts at once.
+
+    Every host gets its own token bucket and its own pool of workers, so
+    one slow or rate-limiting site never holds up another. Responses are
+    handed off through `results`, a bounded queue, so whoever processes
+    them can fall behind without the fetcher getting far ahead."""
+
+    def __init__(self, client: httpx.AsyncClient, results: asyncio.Queue, log, rate=None, concurrency=None):
+        self._client = client
+        self._results = results
+        self._log = log
+        self._rate = rate
+        self._concurrency = concurrency
+
+    def _limits_for(self, host):
+        rate, concurrency = HOST_LIMITS.get(host, DEFAULT_HOST_LIMIT)
+        return self._rate or rate, self._concurrency or concurrency
+
+    async def run(self, requests):
+        """`requests` are (item, url, headers) triples; each one ends up
+        on the results queue as (item, response)."""
+        by_host = defaultdict(deque)
+        for item, url, headers in requests:
+            by_host[httpx.URL(url).host].append((item, url, headers))
+
+        workers = []
+        for host, pending in by_host.items():
+            rate, concurrency = self._limits_for(host)
+            bucket = TokenBucket(rate)
+            await self._log(f"{host}: {len(pending)} requests, {rate}/s, {concurrency} at a time")
+            workers.extend(
+                self._work(host, bucket, pending)
+                for _ in range(concurrency)
+            )
+
+        await asyncio.gather(*workers)
+
+    async def _work(self, host, bucket, pending):
+        while pending:
+            item, url, headers = pending.popleft()
+            try:
+                response = await self._get(host, bucket, url, headers)
+            except httpx.TransportError as e:
+                # leave it for the next run
+                await self._log(f"Couldn't fetch {url}: {e!r}")
+                continue
+            await self._results.put((item, response))
+
+    async def _get(self, host, bucket, url, headers):
+        for _ in range(MAX_RETRIES):
+            await bucket.acquire()
+            response = await self._client.get(url, headers=headers)
+            if response.status_code != 429:
+                return response
+
+            wait = retry_after(response, DEFAULT_RETRY_AFTER)
+            await self._log(f"{host} asked us to slow down; waiting {wait:.0f}s")
+            bucket.pause(wait)
+
+        return response
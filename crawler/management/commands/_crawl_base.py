@@ -1,13 +1,17 @@
 """
 See https://archidekt.com/forum/thread/3476605/1 for more on crawling Archidekt.
 """
+from contextlib import closing
 from django.core.management.base import CommandError
 import httpx
 from decklist.models import Deck
 from crawler.models import CrawlRun
 from django.utils import timezone
-import time
-from crawler.crawlers import CrawlerExit, HEADERS, format_response_error
+from crawler.crawlers import (
+    CrawlerExit, HEADERS, HOST_LIMITS, DEFAULT_HOST_LIMIT, MAX_CRAWL_RATE,
+    format_response_error,
+)
+from crawler.pacing import AdaptivePacer
 from ._command_base import LoggingBaseCommand
 
 
@@ -18,37 +22,50 @@ class CrawlCommand(LoggingBaseCommand):
     def handle(self, *args, **options):
         super().handle(*args, **options)
 
-        sleep_time = 2
-
         stop_after = self._compute_stop_after()
         run = self._get_or_create_run(stop_after)
 
         self._log(f"Starting run {run}")
 
         client: httpx.Client = self._create_client()
+        pacer = self._create_pacer(client, run)
         crawler = self.Crawler(
             client,
             run.next_fetch,
             stop_after,
             self._log,
+            pacer,
         )
         
         run.state = CrawlRun.State.FETCHING_DECKS
         run.save()
         
+        if options['sequential']:
+            pages = self._pages_in_turn(crawler)
+        else:
+            # page N+1 downloads while page N is written
+            pages = crawler.prefetched_pages()
+
         try:
-            while crawler.get_next_page():
-                run.next_fetch = crawler.url
-                run.save()
-                time.sleep(sleep_time)
+            # closing() stops any fetching-ahead as soon as we're done
+            with closing(pages):
+                for page in pages:
+                    if not crawler.process_page(page):
+                        break
+                    # only ever point at a page that hasn't been written
+                    # yet, even if it has already been fetched
+                    run.next_fetch = page.next_url
+                    run.request_rate = pacer.rate
+                    run.save()
 
         except CrawlerExit as e:
-            # TODO: check for 429. that's not fatal, it means we need
-            # to slow down.
+            # 429s and 5xxs have already been retried by the pacer, so
+            # whatever made it here really is fatal
             err_text = (
-                format_response_error(e.respose) if e.response
+                format_response_error(e.response) if e.response
                 else str(e)
             )
+            run.request_rate = pacer.rate
             run.state = CrawlRun.State.ERROR
             run.note = err_text
             run.save()
@@ -60,6 +77,22 @@ class CrawlCommand(LoggingBaseCommand):
         run.state = CrawlRun.State.COMPLETE
         run.save()
 
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--sequential',
+            action='store_true',
+            help="Don't fetch the next page while the current one is being saved",
+        )
+
+    @staticmethod
+    def _pages_in_turn(crawler):
+        while True:
+            page = crawler.fetch_page()
+            yield page
+            if page.next_url is None:
+                return
+
     def _create_client(self):
         return httpx.Client(
             headers=self.HEADERS,
@@ -69,6 +102,10 @@ class CrawlCommand(LoggingBaseCommand):
                 'response': [self._response_log],
             })
     
+    def _create_pacer(self, client, run):
+        rate, _ = HOST_LIMITS.get(client.base_url.host, DEFAULT_HOST_LIMIT)
+        return AdaptivePacer(run.request_rate or rate, max_rate=MAX_CRAWL_RATE)
+
     def _compute_stop_after(self):
         try:
             latest_deck_update = (
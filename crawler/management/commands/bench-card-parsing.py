@@ -0,0 +1,43 @@
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand
+from crawler.card_parsing import parse_card_and_printing, want_card, FailedToParseCard
+from crawler.scryfall import TOKENIZERS, load_bulk_cards
+
+
+SAMPLE_BULK_FILE = Path(__file__).resolve().parents[2] / 'tests' / 'default-cards-sample.json'
+
+
+class Command(BaseCommand):
+    help = 'Compare how fast each tokenizer reads and parses a Scryfall bulk file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', type=Path, default=SAMPLE_BULK_FILE)
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=1,
+            help='Read the file this many times per tokenizer (useful for small files)',
+        )
+
+    def handle(self, *args, **options):
+        bulk_file = options['file']
+        repeat = options['repeat']
+        self.stdout.write(f"Reading {bulk_file} {repeat} time(s) per tokenizer")
+
+        for tokenizer in TOKENIZERS:
+            cards = 0
+            start = time.monotonic()
+            for _ in range(repeat):
+                with open(bulk_file, encoding='utf-8') as f:
+                    for json_card in load_bulk_cards(f, tokenizer):
+                        cards += 1
+                        if not want_card(json_card):
+                            continue
+                        try:
+                            parse_card_and_printing(json_card)
+                        except FailedToParseCard:
+                            pass
+            elapsed = time.monotonic() - start
+
+            self.stdout.write(f"{tokenizer:>8}: {cards} cards in {elapsed:.2f}s ({cards / elapsed:.0f} cards/s)")
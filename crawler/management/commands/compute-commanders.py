@@ -1,5 +1,11 @@
+from collections import defaultdict
+from django.db import transaction
 from ._command_base import LoggingBaseCommand
-from decklist.models import Deck, Commander
+from decklist.models import CardInDeck, Deck, Commander
+from decklist.deck_counts import recount_all, track_legal_decks
+
+
+BATCH_SIZE = 1000
 
 
 class Command(LoggingBaseCommand):
@@ -15,37 +21,84 @@ class Command(LoggingBaseCommand):
         query = Deck.objects.filter(pdh_legal=True)
         if options['all']:
             self._log('Re-computing all commanders for PDH-legal decks')
+            self._compute(query)
+            # in case any cards' color identities changed
+            Commander.objects.refresh_identity()
+            # decks may have moved between any commanders; this reranks, too
+            recount_all()
         else:
             self._log('Computing new commanders for PDH-legal decks')
             query = query.filter(commander__isnull=True)
+            with track_legal_decks(query.values_list('id', flat=True)):
+                self._compute(query)
+            # the counts were reranked as they moved, so only a card's
+            # changed color identity calls for another pass
+            if Commander.objects.refresh_identity():
+                Commander.objects.rerank()
+
+        self._log("Done!")
+
+    def _compute(self, query):
+        decks = list(query.values_list('id', 'name', 'commander_id'))
+
+        commander_cards = defaultdict(list)
+        for deck_id, card_id in (
+            CardInDeck.objects
+            .filter(deck__in=query, is_pdh_commander=True)
+            .values_list('deck_id', 'card_id')
+        ):
+            commander_cards[deck_id].append(card_id)
 
-        for deck in query:
-            match list(deck.commander_cards()):
+        # (commander1, commander2) for each deck, with commander1's ID
+        # sorting first, just as the Commander constraints want
+        deck_keys = {}
+        for deck_id, name, _ in decks:
+            match sorted(commander_cards[deck_id]):
                 case [commander1]:
-                    cmdr, created = Commander.objects.get_or_create(
-                        commander1=commander1.card,
-                        commander2=None,
-                    )
+                    deck_keys[deck_id] = (commander1, None)
                 case [commander1, commander2]:
-                    # commander1 should have an ID <= commander2's
-                    if commander1.card.id > commander2.card.id:
-                        commander1, commander2 = commander2, commander1
-                    cmdr, created = Commander.objects.get_or_create(
-                        commander1=commander1.card,
-                        commander2=commander2.card,
-                    )
+                    deck_keys[deck_id] = (commander1, commander2)
                 case _:
-                    self._err(f"{deck} ({deck.id}) has illegal number of commanders")
-                    continue
-
-            # reminder: if a value was bound in a previous iteration, it will
-            # remain bound here even if not set in the most recent iteration.
-            # make sure to `continue` out of any match branch that shouldn't
-            # save the deck, and make sure `cmdr`/`deck`/`created` are properly
-            # set before getting here.
-            if created:
-                self._log(f"created commander {cmdr}")
-            deck.commander = cmdr
-            deck.save()
-        
-        self._log("Done!")
+                    self._err(f"{name} ({deck_id}) has illegal number of commanders")
+
+        keys = set(deck_keys.values())
+        commanders = {
+            (commander1, commander2): cmdr_id
+            for cmdr_id, commander1, commander2 in (
+                Commander.objects
+                .filter(commander1__in={commander1 for commander1, _ in keys})
+                .values_list('id', 'commander1_id', 'commander2_id')
+            )
+        }
+
+        # identity masks get filled in below, before any ranking
+        new_commanders = [
+            Commander(
+                commander1_id=commander1,
+                commander2_id=commander2,
+                sfid=Commander.sfid_for(commander1, commander2),
+            )
+            for commander1, commander2 in keys - commanders.keys()
+        ]
+
+        with transaction.atomic():
+            Commander.objects.bulk_create(new_commanders, batch_size=BATCH_SIZE)
+            for cmdr in new_commanders:
+                commanders[(cmdr.commander1_id, cmdr.commander2_id)] = cmdr.id
+            Commander.objects.filter(id__in=[cmdr.id for cmdr in new_commanders]).refresh_identity()
+
+            changed_decks = [
+                Deck(id=deck_id, commander_id=commanders[deck_keys[deck_id]])
+                for deck_id, _, commander_id in decks
+                if deck_id in deck_keys
+                and commanders[deck_keys[deck_id]] != commander_id
+            ]
+            Deck.objects.bulk_update(changed_decks, ['commander'], batch_size=BATCH_SIZE)
+
+        for cmdr in (
+            Commander.objects
+            .filter(id__in=[cmdr.id for cmdr in new_commanders])
+            .select_related('commander1', 'commander2')
+        ):
+            self._log(f"created commander {cmdr}")
+        self._log(f"Assigned commanders to {len(changed_decks)} decks")
@@ -1,8 +1,17 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from ._command_base import LoggingBaseCommand
+from django.conf import settings
 from django.core.management.base import CommandError
-from decklist.models import Card, Rarity, SynergyScore
-from decklist.synergy import compute_synergy_bulk
-import math
+from django.db import connections
+from django.db.models import Exists, OuterRef
+from decklist.models import Card, CommanderCardCount, SynergyScore
+from decklist.deck_counts import recount_all
+from decklist.synergy import compute_synergy_all
+from crawler.synergy_scores import PackedScoreWriter, ScoreBatchWriter, shard_cards, write_shard
+
+
+BATCH_SIZE = 200
 
 
 class Command(LoggingBaseCommand):
@@ -12,6 +21,23 @@ class Command(LoggingBaseCommand):
         super().add_arguments(parser)
         parser.add_argument('--log-all', action='store_true')
         parser.add_argument('--card', type=str)
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Cards whose scores are diffed and written together',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=0,
+            help='Split cards across this many worker processes (0 works inline)',
+        )
+        parser.add_argument(
+            '--changed',
+            action='store_true',
+            help='Only refresh cards whose commander/card counts changed',
+        )
 
     def handle(self, *args, **options):
         super().handle(*args, **options)
@@ -39,12 +65,25 @@ class Command(LoggingBaseCommand):
                 self._err(f'{target_card} matches no cards')
                 raise CommandError(f'{target_card} matches no cards')
         
+        elif options['changed']:
+            cards = (
+                Card.objects
+                .filter(
+                    ever_common=True,
+                    commander_counts__changed=True,
+                )
+                .distinct()
+            )
+            self._log(f"Refreshing {cards.count()} cards with changed counts")
+
         else:
+            # start from scratch, in case the maintained counts drifted
+            recount_all()
             cards = (
                 Card.objects
                 .filter(
                     # skip cards never printed at common
-                    printings__rarity=Rarity.COMMON,
+                    ever_common=True,
                     deck_list__deck__pdh_legal=True,
                 )
                 .distinct()
@@ -60,48 +99,103 @@ class Command(LoggingBaseCommand):
             if deleted > 0:
                 self._log(f"Deleted {deleted} irrelevant scores")
 
-        for card in cards:
-            if log_all:
-                self._log(f"Working on {card}")
+        if settings.SYNERGY_STORAGE == 'packed':
+            if options['workers'] > 0:
+                self._log("Packed scores are written by one process; ignoring --workers")
+            if target_card or options['changed']:
+                refreshed = list(cards.values_list('id', flat=True))
+            else:
+                # a full run replaces every commander's scores
+                refreshed = None
+            self._write_packed(cards, refreshed)
+        elif options['workers'] > 0:
+            self._write_parallel(cards, options['workers'], options['batch_size'], log_all)
+        else:
+            self._write_serial(cards, options['batch_size'], log_all)
 
-            existing_scores = (
-                SynergyScore.objects
-                .filter(card=card)
-            )
+        if not target_card:
+            self._settle_counts()
 
-            new_records = []
-            update_records = []
-            skipped_records = 0
+        self._log("Done!")
+
+    def _write_serial(self, cards, batch_size, log_all):
+        writer = ScoreBatchWriter(
+            batch_size,
+            self._log,
+            dict(cards.values_list('id', 'name')),
+            log_all,
+        )
+        for card_id, scores in compute_synergy_all(cards):
+            writer.add(card_id, scores)
+        writer.flush()
+        self._log(f"{writer.created} new scores, {writer.updated} updated, {writer.skipped} skipped, {writer.deleted} deleted")
+
+    def _write_packed(self, cards, refreshed):
+        writer = PackedScoreWriter(refreshed)
+        if refreshed is None:
+            # only one batch of commanders' scores is held at a time
+            for commander_ids in writer.commander_batches():
+                for card_id, scores in compute_synergy_all(cards, commander_ids):
+                    writer.add(card_id, scores)
+                writer.flush(commander_ids)
+        else:
+            for card_id, scores in compute_synergy_all(cards):
+                writer.add(card_id, scores)
+            writer.flush()
+        self._log(f"{writer.created} new scores, {writer.updated} updated, {writer.skipped} skipped, {writer.deleted} deleted")
+
+    def _write_parallel(self, cards, workers, batch_size, log_all):
+        shards = shard_cards(cards.values_list('id', flat=True), workers)
+        self._log(f"Splitting {sum(len(s) for s in shards)} cards across {workers} workers")
+
+        # forked workers must not inherit our database sockets
+        connections.close_all()
 
-            scores = compute_synergy_bulk(card)
-            for commander, score in scores:
+        totals = [0, 0, 0, 0]
+        failed = []
+        with ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context('fork'),
+        ) as pool:
+            futures = {
+                pool.submit(write_shard, shard, batch_size, log_all): n
+                for n, shard in enumerate(shards)
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                n = futures[future]
                 try:
-                    score_record = existing_scores.get(commander=commander)
-                    # if the score has changed, record it
-
-                    # treat NaN and NULL as 0
-                    old_score = score_record.score or 0.0
-                    if math.isnan(old_score):
-                        old_score = 0.0
-
-                    if abs(score - old_score) >= 0.005:
-                        score_record.score = score
-                        update_records.append(score_record)
-                    else:
-                        skipped_records += 1
-                except SynergyScore.DoesNotExist:
-                    score_record = SynergyScore(commander=commander, card=card)
-                    score_record.score = score
-                    new_records.append(score_record)
-                
-            if len(new_records) > 0:
-                SynergyScore.objects.bulk_create(new_records)
-            if len(update_records) > 0:
-                SynergyScore.objects.bulk_update(update_records, ['score',])
-            
-            if log_all:
-                self._log(f"{len(new_records)} new scores, {len(update_records)} updated scores, {skipped_records} skipped")
-            elif len(new_records) > 0 or len(update_records) > 0:
-                self._log(f"{card}: {len(new_records)} new scores, {len(update_records)} updated scores, {skipped_records} skipped")
+                    messages, counts = future.result()
+                except Exception as e:
+                    self._err(f"Shard {n} of {workers} failed: {e!r}")
+                    failed.append(n)
+                    continue
 
-        self._log("Done!")
+                for message in messages:
+                    self._log(message)
+                totals = [t + c for t, c in zip(totals, counts)]
+                self._log(f"Shard {n} finished ({done} of {workers} done)")
+
+        created, updated, skipped, deleted = totals
+        self._log(f"{created} new scores, {updated} updated, {skipped} skipped, {deleted} deleted")
+        if failed:
+            # leave the changed flags set so the next run tries again
+            raise CommandError(f"{len(failed)} of {workers} shards failed")
+
+    def _settle_counts(self):
+        changed = CommanderCardCount.objects.changed()
+
+        # these commanders and cards no longer appear together
+        gone = changed.filter(count=0)
+        deleted, _ = (
+            SynergyScore.objects
+            .filter(Exists(gone.filter(
+                commander=OuterRef('commander'),
+                card=OuterRef('card'),
+            )))
+            .delete()
+        )
+        if deleted > 0:
+            self._log(f"Deleted {deleted} scores for pairs no longer seen together")
+        gone.delete()
+
+        changed.update(changed=False)
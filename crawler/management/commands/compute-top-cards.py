@@ -1,23 +1,16 @@
 from ._command_base import LoggingBaseCommand
-from django.core.management.base import CommandError
-from django.db import transaction, connection
-from decklist.models.card import TopCardView, TopLandCardView, TopNonLandCardView
+from decklist.models import Card
 
 
 class Command(LoggingBaseCommand):
-    help = 'Compute top cards results'
+    help = 'Recount how many legal decks each card is in'
 
     def handle(self, *args, **options):
         super().handle(*args, **options)
 
-        self._log("Computing top cards")
-
-        with (
-            transaction.atomic(),
-            connection.cursor() as cursor,
-        ):
-            for model in (TopCardView, TopLandCardView, TopNonLandCardView):
-                self._log(f"Refreshing {model._meta.db_table}")
-                cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {model._meta.db_table};")
+        # decklist.deck_counts keeps these current as decks change; this
+        # is only needed if they've drifted
+        self._log("Recounting top cards")
+        Card.objects.recount()
 
         self._log("Done!")
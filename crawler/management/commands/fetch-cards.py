@@ -1,76 +1,138 @@
 """
 See https://scryfall.com/docs/api/bulk-data for more on Scryfall data.
 """
-from django.db.utils import DataError
-from django.utils.dateparse import parse_date
+from pathlib import Path
+from django.conf import settings
 import httpx
-import json_stream.httpx
-# don't use Rust-based tokenizer
-# it throws an OSError about incomplete utf-8 sequences
-from json_stream.tokenizer import tokenize
-from decklist.models import Card, Printing, PartnerType, Rarity
+from decklist.models import Card, Printing
 from crawler.crawlers import HEADERS, SCRYFALL_API_BASE
-from crawler.card_parsing import parse_card_and_printing, FailedToParseCard
+from crawler.card_parsing import parse_card_and_printing, want_card, FailedToParseCard
+from crawler.card_ingest import CardBatchWriter, CardPipeline, refresh_all_facts
+from crawler.scryfall import BulkFileCache, LINES_FALLBACK, TOKENIZERS, load_bulk_cards
 from ._command_base import LoggingBaseCommand
 
 
 PROGRESS_EVERY_N_CARDS = 100
+DEFAULT_BATCH_SIZE = 1000
 
 class Command(LoggingBaseCommand):
     help = 'Ask Scryfall for card data'
 
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=0,
+            help='Parse cards in this many worker processes (0 parses inline)',
+        )
+        parser.add_argument(
+            '--tokenizer',
+            choices=TOKENIZERS,
+            default=TOKENIZERS[0],
+            help=f'How to read cards out of the bulk file (lines falls back to {LINES_FALLBACK} if it must)',
+        )
+        parser.add_argument(
+            '--from-file',
+            type=Path,
+            help='Ingest a local bulk file instead of asking Scryfall',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help="Ingest even if Scryfall's bulk file hasn't changed since the last run",
+        )
+
     def handle(self, *args, **options):
         super().handle(*args, **options)
 
         self._log(f"Fetch cards begin: {Card.objects.all().count()} cards, {Printing.objects.all().count()} printings")
-        with httpx.Client(base_url=SCRYFALL_API_BASE, headers=HEADERS) as client:
-            result = client.get("bulk-data/default-cards", timeout=httpx.Timeout(10.0))
-            if result.is_error:
-                self._err(f"{result.status_code}: {result.reason_phrase}")
-            result.raise_for_status()
-            download_target = result.json()["download_uri"]
-            self._log(f"Fetching {download_target}")
-
-            card_count = PROGRESS_EVERY_N_CARDS
-            with client.stream('GET', download_target) as f:
-                for json_card in json_stream.httpx.load(f, tokenizer=tokenize).persistent():
-                    card_count -= 1
-                    if card_count <= 0:
-                        self.stdout.write('.', ending='')
-                        self.stdout.flush()
-                        card_count = PROGRESS_EVERY_N_CARDS
-                    
-                    if not self._want_card(json_card):
-                        continue
-
-                    try:
-                        c, p = parse_card_and_printing(json_card)
-
-                    except FailedToParseCard as e:                    
-                        self._err(f"failed to parse {json_card['name']}")
-                        for k, v in e.args[0].items():
-                            self._err(f".. {k}: {v}")
-                        continue
-
-                    try:
-                        if len(c.name) > 100:
-                            # Market Research Elemental 🙄
-                            c.name = c.name[:47] + '...'
-                        c.save()
-                        p.save()
-                    except DataError as e:
-                        self._log(f"Card {c.name} or printing {p} threw {e}")
 
-        self.stdout.write('')
+        if options['from_file']:
+            self._ingest(options['from_file'], options)
+        else:
+            cache = BulkFileCache(settings.SCRYFALL_CACHE_DIR)
+            with httpx.Client(base_url=SCRYFALL_API_BASE, headers=HEADERS) as client:
+                result = client.get("bulk-data/default-cards", timeout=httpx.Timeout(10.0))
+                if result.is_error:
+                    self._err(f"{result.status_code}: {result.reason_phrase}")
+                result.raise_for_status()
+                bulk_info = result.json()
+                updated_at = bulk_info['updated_at']
+
+                if cache.is_ingested(updated_at) and not options['force']:
+                    self._log(f"Bulk file unchanged since {updated_at}; nothing to ingest")
+                    self._refresh_facts()
+                    return
+
+                self._log(f"Fetching {bulk_info['download_uri']} ({updated_at})")
+                bulk_file = cache.download(client, bulk_info, self._log)
+
+            self._ingest(bulk_file, options)
+            cache.mark_ingested(updated_at)
+
+        self._refresh_facts()
         self._log(f"end: {Card.objects.all().count()} cards, {Printing.objects.all().count()} printings")
 
-    def _want_card(self, json_card):
-        # we want to exclude some non-playable cards but aren't entirely
-        # beholden to upstream's record of format legalities
-        if 'layout' in json_card and json_card['layout'] in (
-            'planar', 'scheme', 'vanguard', 'token', 'double_faced_token',
-            'emblem', 'art_series', 'reversible_card',
-        ):
-            return False
+    def _ingest(self, bulk_file, options):
+        writer = CardBatchWriter(options['batch_size'], self._log)
+        workers = options['workers']
+        tokenizer = options['tokenizer']
+
+        self._log(f"Reading {bulk_file} with the {tokenizer} tokenizer")
+        if workers > 0:
+            self._ingest_parallel(bulk_file, tokenizer, writer, workers)
+        else:
+            self._ingest_serial(bulk_file, tokenizer, writer)
+
+        self.stdout.write('')
+        self._log(f"{writer.inserted} inserted, {writer.updated} updated, {writer.unchanged} unchanged")
+        self._log(f"Wrote {writer.rows_written} printings in {writer.write_time:.1f}s ({writer.rows_per_second:.0f} rows/s)")
+        if writer.legality_changed:
+            self._log(f"{writer.legality_changed} cards changed in ways that affect deck legality; queued for recheck-deck-legality --changed")
+
+    def _refresh_facts(self):
+        # some facts don't come from Scryfall at all (the ban list), so
+        # they can change without any printing changing
+        changed = refresh_all_facts()
+        if changed:
+            self._log(f"{changed} more cards changed in ways that affect deck legality; queued for recheck-deck-legality --changed")
+
+    def _ingest_parallel(self, bulk_file, tokenizer, writer, workers):
+        pipeline = CardPipeline(writer, workers, self._err)
+        with open(bulk_file, encoding='utf-8') as f:
+            pipeline.run(load_bulk_cards(f, tokenizer, plain=True, fallback=LINES_FALLBACK))
+
+        self._log(f"tokenize: {pipeline.tokenized} cards in {pipeline.tokenize_time:.1f}s ({_rate(pipeline.tokenized, pipeline.tokenize_time)} cards/s)")
+        self._log(f"parse: {pipeline.parsed} cards in {pipeline.parse_time:.1f}s across {workers} workers ({_rate(pipeline.parsed, pipeline.parse_time)} cards/s per worker)")
+
+    def _ingest_serial(self, bulk_file, tokenizer, writer):
+        card_count = PROGRESS_EVERY_N_CARDS
+        with open(bulk_file, encoding='utf-8') as f:
+            for json_card in load_bulk_cards(f, tokenizer, fallback=LINES_FALLBACK):
+                card_count -= 1
+                if card_count <= 0:
+                    self.stdout.write('.', ending='')
+                    self.stdout.flush()
+                    card_count = PROGRESS_EVERY_N_CARDS
+
+                if not want_card(json_card):
+                    continue
+
+                try:
+                    c, p = parse_card_and_printing(json_card)
+
+                except FailedToParseCard as e:
+                    self._err(f"failed to parse {json_card['name']}")
+                    for k, v in e.args[0].items():
+                        self._err(f".. {k}: {v}")
+                    continue
+
+                writer.add(c, p)
+
+        writer.flush()
+
 
-        return True
+def _rate(count, seconds):
+    return f"{count / seconds:.0f}" if seconds else "-"
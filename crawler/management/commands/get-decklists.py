@@ -1,11 +1,15 @@
+import asyncio
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.db import transaction
 import httpx
-from decklist.models import DataSource, Printing, Card, CardInDeck
+from decklist.models import DataSource, CardInDeck
+from decklist.legality import check_decks
+from decklist.deck_counts import track_legal_decks
 from crawler.models import DeckCrawlResult
+from crawler.card_index import CardIndex, CardNotFound
+from crawler.deck_fetching import ConcurrentFetcher
 from ._command_base import LoggingBaseCommand
-import time
-from itertools import chain
 from crawler.crawlers import HEADERS
 
 if settings.MOXFIELD_API_KEY:
@@ -18,111 +22,129 @@ else:
     print("Moxfield API key missing; will not fetch decklists from Moxfield")
     MOXFIELD_HEADERS = None
 
+# how many fetched decks may wait for the database before fetching pauses
+RESPONSE_QUEUE_SIZE = 20
 
-def get_known_printings(cards, get_printing_id):
-    lookup_printings = set()
-    for card_json in cards:
-        printing_id = get_printing_id(card_json)
-        lookup_printings.add(printing_id)
-    return {
-        str(p.id): p.card
-        for p in Printing.objects.filter(id__in=lookup_printings)
-    }
 
+class Command(LoggingBaseCommand):
+    help = 'Populate any decks retrieved by the crawlers'
 
-def lookup_card(name, set_code):
-    p = (
-        Printing.objects
-        .filter(
-            card__name__iexact=name,
-            set_code__iexact=set_code,
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--rate',
+            type=float,
+            help='Requests per second per host (overrides the per-host defaults)',
         )
-        .first()
-    )
-    if p:
-        return p.card
-
-    # HACK:
-    # cards with set_code `j21` often don't resolve
-    # so we relax the restriction and try again
-    # likewise, the `rex` lands don't resolve, so also
-    # relax and try again.
-    if set_code in ('j21', 'rex'):
-        c = (
-            Card.objects
-            .filter(name__iexact=name)
-            .first()
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            help='Simultaneous requests per host (overrides the per-host defaults)',
         )
-        if c:
-            return c
-    # /HACK
-
-    raise CardNotFound(f'"{name}" ({set_code})')
-
-
-class CardNotFound(Exception): ...
-
-
-class Command(LoggingBaseCommand):
-    help = 'Populate any decks retrieved by the crawlers'
 
     def handle(self, *args, **options):
         super().handle(*args, **options)
 
-        sleep_time = 2
-
         updatable_decks = (
             DeckCrawlResult.objects
             .filter(fetchable=True, got_cards=False)
+            .select_related('deck')
         )
 
         self._log(f"Fetching up to {len(updatable_decks)} decks")
 
-        with httpx.Client(headers=HEADERS) as client:
-            for updatable_deck in updatable_decks:
-                if 'moxfield.com' in updatable_deck.url:
-                    if not MOXFIELD_HEADERS:
-                        self._log(f"Skipping {updatable_deck.url} due to missing Moxfield API key")
-                        continue
-                    response = client.get(updatable_deck.url, headers=MOXFIELD_HEADERS)
-                else:
-                    response = client.get(updatable_deck.url)
-                if 200 <= response.status_code < 300:
-                    deck_name = updatable_deck.deck.name
-                    new_deck = True if updatable_deck.deck.card_list.count() == 0 else False
-                    verb = "Creating" if new_deck else "Updating"
-                    envelope = response.json()
-                    if updatable_deck.deck.source == DataSource.ARCHIDEKT:
-                        self._log(f"{verb} \"{deck_name}\" (Archidekt)")
-                        self._process_archidekt_deck(updatable_deck, envelope)
-                    elif updatable_deck.deck.source == DataSource.MOXFIELD:
-                        self._log(f"{verb} \"{deck_name}\" (Moxfield)")
-                        self._process_moxfield_deck(updatable_deck, envelope)
-                    else:
-                        self._err(f"Can't update \"{deck_name}\", unimplemented source")
-                        updatable_deck.fetchable = False
-                        updatable_deck.save()
-                elif response.status_code in (400, 404):
-                    # mark deck as unfetchable and carry on
-                    self._log(f"Got error {response.status_code} for \"{updatable_deck.deck.name}\" ({updatable_deck.url}).")
-                    updatable_deck.fetchable = False
-                    updatable_deck.save()
-                else:
-                    self._err(f"Got {response.status_code} from server. ({response.url})")
-                    updatable_deck.fetchable = False
-                    updatable_deck.save()
+        self.card_index = CardIndex()
+        self._log(f"Indexed {len(self.card_index)} printings")
+
+        requests = []
+        for updatable_deck in updatable_decks:
+            if 'moxfield.com' in updatable_deck.url:
+                if not MOXFIELD_HEADERS:
+                    self._log(f"Skipping {updatable_deck.url} due to missing Moxfield API key")
+                    continue
+                requests.append((updatable_deck, updatable_deck.url, MOXFIELD_HEADERS))
+            else:
+                requests.append((updatable_deck, updatable_deck.url, None))
+
+        # legality changes move decks in and out of their commanders' counts
+        with track_legal_decks(deck.deck_id for deck, _, _ in requests):
+            asyncio.run(self._fetch_all(requests, options['rate'], options['concurrency']))
 
-                if updatable_deck.got_cards:
-                    updatable_deck.deck.deckcrawlresult_set.all().delete()
-                
-                time.sleep(sleep_time)
-        
         self._log("Done!")
 
+    async def _fetch_all(self, requests, rate, concurrency):
+        # fetching happens here on the event loop; everything touching the
+        # database happens over in sync-land, one deck at a time
+        responses = asyncio.Queue(maxsize=RESPONSE_QUEUE_SIZE)
+        log = sync_to_async(self._log)
+
+        async with httpx.AsyncClient(headers=HEADERS) as client:
+            fetcher = ConcurrentFetcher(client, responses, log, rate, concurrency)
+            fetching = asyncio.create_task(fetcher.run(requests))
+            processor = asyncio.create_task(self._process_responses(responses))
+            try:
+                await asyncio.wait((fetching, processor), return_when=asyncio.FIRST_COMPLETED)
+                if processor.done():
+                    # it only stops before the end if it failed, and then
+                    # nothing is left to drain the queue
+                    fetching.cancel()
+                    await asyncio.gather(fetching, return_exceptions=True)
+                    processor.result()
+                await fetching
+            finally:
+                if not processor.done():
+                    await responses.put(None)
+                    await processor
+
+    async def _process_responses(self, responses):
+        process = sync_to_async(self._process_response_safely)
+        while (item := await responses.get()) is not None:
+            await process(*item)
+
+    def _process_response_safely(self, updatable_deck, response):
+        try:
+            self._process_response(updatable_deck, response)
+        except Exception as e:
+            # one bad deck shouldn't stop the rest
+            self._err(f"Couldn't process \"{updatable_deck.deck.name}\" ({updatable_deck.url}): {e!r}")
+            DeckCrawlResult.objects.filter(id=updatable_deck.id).update(fetchable=False)
+
+    def _process_response(self, updatable_deck, response):
+        if 200 <= response.status_code < 300:
+            deck_name = updatable_deck.deck.name
+            new_deck = True if updatable_deck.deck.card_list.count() == 0 else False
+            verb = "Creating" if new_deck else "Updating"
+            envelope = response.json()
+            if updatable_deck.deck.source == DataSource.ARCHIDEKT:
+                self._log(f"{verb} \"{deck_name}\" (Archidekt)")
+                self._process_archidekt_deck(updatable_deck, envelope)
+            elif updatable_deck.deck.source == DataSource.MOXFIELD:
+                self._log(f"{verb} \"{deck_name}\" (Moxfield)")
+                self._process_moxfield_deck(updatable_deck, envelope)
+            else:
+                self._err(f"Can't update \"{deck_name}\", unimplemented source")
+                updatable_deck.fetchable = False
+                updatable_deck.save()
+        elif response.status_code in (400, 404):
+            # mark deck as unfetchable and carry on
+            self._log(f"Got error {response.status_code} for \"{updatable_deck.deck.name}\" ({updatable_deck.url}).")
+            updatable_deck.fetchable = False
+            updatable_deck.save()
+        elif response.status_code == 429:
+            # still being told to slow down after several tries; leave
+            # this one for the next run
+            self._err(f"Still rate-limited, skipping for now. ({response.url})")
+        else:
+            self._err(f"Got {response.status_code} from server. ({response.url})")
+            updatable_deck.fetchable = False
+            updatable_deck.save()
+
+        if updatable_deck.got_cards:
+            updatable_deck.deck.deckcrawlresult_set.all().delete()
+
     def _process_archidekt_deck(self, crawl_result, envelope):
         # resolve printings to cards
         cards = envelope['cards']
-        print_id_to_card = get_known_printings(cards, lambda j: j['card']['uid'])
 
         # determine categories to skip, categories which are commander
         skip_categories = frozenset([
@@ -137,7 +159,7 @@ class Command(LoggingBaseCommand):
         # reuse cards where we can
         # TODO: handle multiple printings of the same card?
         current_cards = {
-            c.card.id: c for c in CardInDeck.objects.filter(deck=crawl_result.deck)
+            c.card_id: c for c in CardInDeck.objects.filter(deck=crawl_result.deck)
         }
         update_cards = []
         new_cards = []
@@ -152,26 +174,25 @@ class Command(LoggingBaseCommand):
             is_commander = not card_categories.isdisjoint(premier_categories)
 
             printing_id = card_json['card']['uid']
-            if printing_id in print_id_to_card.keys():
-                card = print_id_to_card[printing_id]
-            else:
+            card_id = self.card_index.card_for_printing(printing_id)
+            if card_id is None:
                 name = card_json['card']['oracleCard']['name']
                 edition = card_json['card']['edition']['editioncode']
                 try:
-                    card = lookup_card(name, edition)
+                    card_id = self.card_index.lookup(name, edition)
                     self._log(f'Had to look up "{name}" ({edition})')
                 except CardNotFound:
                     self._err(f'Could not resolve printing {printing_id}; should be "{name}" ({edition})')
                     continue
             
-            if card.id in current_cards.keys():
-                reuse_card = current_cards.pop(card.id)
+            if card_id in current_cards.keys():
+                reuse_card = current_cards.pop(card_id)
                 reuse_card.is_pdh_commander = is_commander
                 update_cards.append(reuse_card)
             else:
                 new_cards.append(CardInDeck(
                     deck=crawl_result.deck,
-                    card=card,
+                    card_id=card_id,
                     is_pdh_commander=is_commander,
                 ))
         
@@ -186,9 +207,12 @@ class Command(LoggingBaseCommand):
             CardInDeck.objects.bulk_update(update_cards, ['is_pdh_commander'])
 
         # now see if the deck is legal before completing processing
-        crawl_result.deck.pdh_legal, _ = crawl_result.deck.check_deck_legality()
+        [(_, crawl_result.deck.pdh_legal, _)] = check_decks([crawl_result.deck.id])
 
         with transaction.atomic():
+            # its commanders may have changed along with its cards;
+            # compute-commanders will assign it again
+            crawl_result.deck.commander = None
             crawl_result.deck.save()
             crawl_result.got_cards = True
             crawl_result.save()
@@ -199,14 +223,9 @@ class Command(LoggingBaseCommand):
         cards = envelope['mainboard']
         cmdrs = envelope['commanders']
 
-        print_id_to_card = get_known_printings(
-            [c for _, c in chain(cards.items(), cmdrs.items())],
-            lambda j: j['card']['scryfall_id'],
-        )
-
         # reuse cards where we can
         current_cards = {
-            c.card.id: c for c in CardInDeck.objects.filter(deck=crawl_result.deck)
+            c.card_id: c for c in CardInDeck.objects.filter(deck=crawl_result.deck)
         }
         update_cards = []
         new_cards = []
@@ -214,26 +233,25 @@ class Command(LoggingBaseCommand):
         for card_set, is_commander in ((cards, False), (cmdrs, True)):
             for _, card_json in card_set.items():
                 printing_id = card_json['card']['scryfall_id']
-                if printing_id in print_id_to_card.keys():
-                    card = print_id_to_card[printing_id]
-                else:
+                card_id = self.card_index.card_for_printing(printing_id)
+                if card_id is None:
                     name = card_json['card']['name']
                     edition = card_json['card']['set']
                     try:
-                        card = lookup_card(name, edition)
+                        card_id = self.card_index.lookup(name, edition)
                         self._log(f'Had to look up "{name}" ({edition})')
                     except CardNotFound:
                         self._err(f'Could not resolve printing {printing_id}; should be "{name}" ({edition})')
                         continue
                 
-                if card.id in current_cards.keys():
-                    reuse_card = current_cards.pop(card.id)
+                if card_id in current_cards.keys():
+                    reuse_card = current_cards.pop(card_id)
                     reuse_card.is_pdh_commander = is_commander
                     update_cards.append(reuse_card)
                 else:
                     new_cards.append(CardInDeck(
                         deck=crawl_result.deck,
-                        card=card,
+                        card_id=card_id,
                         is_pdh_commander=is_commander,
                     ))
         
@@ -248,9 +266,12 @@ class Command(LoggingBaseCommand):
             CardInDeck.objects.bulk_update(update_cards, ['is_pdh_commander'])
 
         # now see if the deck is legal before completing processing
-        crawl_result.deck.pdh_legal, _ = crawl_result.deck.check_deck_legality()
+        [(_, crawl_result.deck.pdh_legal, _)] = check_decks([crawl_result.deck.id])
 
         with transaction.atomic():
+            # its commanders may have changed along with its cards;
+            # compute-commanders will assign it again
+            crawl_result.deck.commander = None
             crawl_result.deck.save()
             crawl_result.got_cards = True
             crawl_result.save()
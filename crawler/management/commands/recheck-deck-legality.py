@@ -1,20 +1,67 @@
 from django.core.management.base import BaseCommand, CommandError
 from decklist.models import Deck
+from decklist.deck_counts import recount_all, track_legal_decks
+from decklist.legality import check_decks, BATCH_SIZE
+from crawler.card_ingest import refresh_all_facts
+from crawler.models import LegalityRecheck
 
 
 class Command(BaseCommand):
     help = 'Revalidate legality of decks'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument(
+            '--changed',
+            action='store_true',
+            help='Only recheck decks containing cards queued by fetch-cards',
+        )
+
     def handle(self, *args, **options):
         pre_check = Deck.objects.filter(pdh_legal=True).count()
         self.stdout.write(f"Pre-check: {pre_check} legal decks")
 
-        for deck in Deck.objects.all():
-            is_legal, reason = deck.check_deck_legality()
-            if is_legal != deck.pdh_legal:
-                self.stdout.write(f"{deck} {is_legal=} {reason=}")
-                deck.pdh_legal = is_legal
-                deck.save()
+        if not options['changed']:
+            # in case a card's facts went stale, say with an edit to the
+            # ban list; a full recheck covers whatever this queues
+            refresh_all_facts()
+
+        # a full recheck covers these too
+        queued = list(LegalityRecheck.objects.values_list('card_id', flat=True))
+
+        decks = Deck.objects.order_by('id')
+        if options['changed']:
+            decks = decks.filter(card_list__card__in=queued).distinct()
+            self.stdout.write(f"{len(queued)} cards changed since the last recheck")
+
+        decks = list(decks.values_list('id', 'name', 'pdh_legal'))
+        self.stdout.write(f"Checking {len(decks)} decks")
+        batch_size = options['batch_size']
+        if options['changed']:
+            with track_legal_decks(deck_id for deck_id, _, _ in decks):
+                self._recheck_all(decks, batch_size)
+        else:
+            self._recheck_all(decks, batch_size)
+            recount_all()
+
+        LegalityRecheck.objects.filter(card__in=queued).delete()
 
         post_check = Deck.objects.filter(pdh_legal=True).count()
         self.stdout.write(f"Post-check: {post_check} legal decks")
+
+    def _recheck_all(self, decks, batch_size):
+        for start in range(0, len(decks), batch_size):
+            batch = decks[start:start + batch_size]
+            self._recheck(batch)
+
+    def _recheck(self, batch):
+        was_legal = {deck_id: (name, pdh_legal) for deck_id, name, pdh_legal in batch}
+
+        changed = []
+        for deck_id, is_legal, reason in check_decks(list(was_legal.keys())):
+            name, pdh_legal = was_legal[deck_id]
+            if is_legal != pdh_legal:
+                self.stdout.write(f"{name} {is_legal=} {reason=}")
+                changed.append(Deck(id=deck_id, pdh_legal=is_legal))
+
+        Deck.objects.bulk_update(changed, ['pdh_legal'])
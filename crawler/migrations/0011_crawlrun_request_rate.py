@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-17 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0010_drop_follows'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawlrun',
+            name='request_rate',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.15 on 2026-10-17 17:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crawler', '0011_crawlrun_request_rate'),
+        ('decklist', '0027_card_facts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LegalityRecheck',
+            fields=[
+                ('card', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='decklist.card')),
+                ('queued', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
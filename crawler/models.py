@@ -1,5 +1,5 @@
 from django.db import models
-from decklist.models import Deck, DataSource
+from decklist.models import Card, Deck, DataSource
 
 
 class CrawlRun(models.Model):
@@ -21,6 +21,9 @@ class CrawlRun(models.Model):
     state = models.IntegerField(choices=State.choices)
     note = models.TextField(blank=True)
     next_fetch = models.URLField(blank=True)
+    # requests per second the crawler had settled on, so a resumed
+    # run can pick up where it left off
+    request_rate = models.FloatField(null=True, blank=True)
 
     def __str__(self):
         return f"Run {self.id} [{self.get_target_display()}] ({self.crawl_start_time})"
@@ -41,6 +44,20 @@ class DeckCrawlResult(models.Model):
         return f"{self.url}"
 
 
+class LegalityRecheck(models.Model):
+    """A card whose legality-relevant facts changed during a card import.
+    Decks containing it get rechecked by `recheck-deck-legality --changed`."""
+    card = models.OneToOneField(
+        Card,
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    queued = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.card} (queued {self.queued})"
+
+
 class LogStart(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     text = models.TextField(blank=True)
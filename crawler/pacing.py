@@ -0,0 +1,155 @@
+import asyncio
+import datetime
+import email.utils
+import random
+import time
+from django.utils import timezone
+
+
+class TokenBucket:
+    """Hands out permission to make `rate` requests per second, letting
+    up to `burst` of them go back-to-back after a quiet spell."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        "Take a token; returns how many seconds to wait before using it."
+        self._refill()
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+    def pause(self, seconds):
+        "Hand out nothing else for at least `seconds`."
+        self._refill()
+        self._tokens = min(self._tokens, -seconds * self.rate)
+
+    def wait(self):
+        time.sleep(self.reserve())
+
+    async def acquire(self):
+        await asyncio.sleep(self.reserve())
+
+
+def retry_after(response, default):
+    "Seconds the server asked us to wait, per its Retry-After header."
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return default
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    # it can also be an HTTP date
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (when - timezone.now()).total_seconds())
+
+
+def rate_limit_delay(response):
+    """Seconds to leave between requests so we don't run out of quota,
+    going by the server's RateLimit-* headers, or None if it sent none."""
+    headers = response.headers
+    remaining = headers.get('RateLimit-Remaining', headers.get('X-RateLimit-Remaining'))
+    reset = headers.get('RateLimit-Reset', headers.get('X-RateLimit-Reset'))
+    if remaining is None or reset is None:
+        return None
+
+    try:
+        remaining, reset = int(remaining), float(reset)
+    except ValueError:
+        return None
+    # some servers send a timestamp rather than a number of seconds
+    if reset > 1_000_000_000:
+        reset -= time.time()
+    reset = max(0.0, reset)
+
+    if remaining <= 0:
+        return reset
+    return reset / remaining
+
+
+class AdaptivePacer:
+    """Paces a stream of requests to one server, feeling out how fast it
+    is willing to go.
+
+    Additive increase, multiplicative decrease: every `patience` successes
+    in a row buy a little more speed, up to `max_rate`; every 429 or 5xx
+    halves the rate and waits (exponential backoff with jitter, or longer
+    if the server says so) before the request is tried again."""
+
+    def __init__(self, rate, max_rate, min_rate=1/60, patience=10, step=0.1,
+                 backoff_base=2.0, backoff_cap=300.0, max_retries=6):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.patience = patience
+        self.step = step
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_retries = max_retries
+        self._bucket = TokenBucket(min(max(rate, min_rate), max_rate))
+        self._successes = 0
+        self._failures = 0
+
+    @property
+    def rate(self):
+        return self._bucket.rate
+
+    def _set_rate(self, rate):
+        self._bucket.rate = min(max(rate, self.min_rate), self.max_rate)
+
+    def wait(self):
+        self._bucket.wait()
+
+    @staticmethod
+    def should_retry(response):
+        return response.status_code == 429 or response.status_code >= 500
+
+    def succeeded(self, response):
+        self._failures = 0
+        self._successes += 1
+        if self._successes >= self.patience:
+            self._successes = 0
+            self._set_rate(self.rate + self.step)
+
+        # stay within whatever quota the server told us about
+        delay = rate_limit_delay(response)
+        if delay:
+            if delay * self.rate > 1:
+                self._set_rate(1 / delay)
+            if delay > 1 / self.rate:
+                self._bucket.pause(delay)
+
+    def failed(self, response):
+        """Slow down after a 429 or 5xx. Returns how long we'll wait
+        before the next request, or None if we've already retried as
+        many times as we're willing to."""
+        self._successes = 0
+        self._failures += 1
+        if self._failures > self.max_retries:
+            return None
+
+        self._set_rate(self.rate / 2)
+        backoff = min(self.backoff_cap, self.backoff_base * 2 ** (self._failures - 1))
+        delay = max(
+            random.uniform(backoff / 2, backoff),
+            retry_after(response, 0),
+        )
+        self._bucket.pause(delay)
+        return delay
@@ -0,0 +1,175 @@
+"""
+Local cache for Scryfall's bulk card file.
+
+The bulk-data endpoint tells us when the file was last regenerated
+(`updated_at`). We keep the last download on disk along with that
+timestamp and the ETag it was served with, so an unchanged file is never
+fetched twice and an interrupted transfer picks up where it left off.
+"""
+import itertools
+import json
+from pathlib import Path
+
+import httpx
+import json_stream
+from json_stream.tokenizer import tokenize
+from json_stream_rs_tokenizer import rust_tokenizer_or_raise
+
+
+BULK_FILE_NAME = 'default-cards.json'
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Ways to read cards out of a bulk file, fastest first.
+#  - lines: Scryfall writes one card per line, so each line is a
+#    complete JSON object which the stdlib can decode in one go
+#  - rust: json_stream's Rust tokenizer. This used to choke on UTF-8
+#    sequences split across network chunks, but we read from a local
+#    file in text mode now, so it only ever sees whole characters.
+#  - python: json_stream's pure-Python tokenizer
+TOKENIZERS = ('lines', 'rust', 'python')
+# what `lines` gives way to if a file turns out not to be one card per line
+LINES_FALLBACK = 'rust'
+
+
+class BulkFileCache:
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.path = self.directory / BULK_FILE_NAME
+        self.partial_path = self.directory / (BULK_FILE_NAME + '.part')
+        self._meta_path = self.directory / (BULK_FILE_NAME + '.meta')
+
+    def _read_meta(self):
+        try:
+            with open(self._meta_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_meta(self, meta):
+        with open(self._meta_path, 'w') as f:
+            json.dump(meta, f)
+
+    def is_ingested(self, updated_at):
+        meta = self._read_meta()
+        return meta.get('updated_at') == updated_at and meta.get('ingested', False)
+
+    def mark_ingested(self, updated_at):
+        meta = self._read_meta()
+        if meta.get('updated_at') == updated_at:
+            meta['ingested'] = True
+            self._write_meta(meta)
+
+    def download(self, client: httpx.Client, bulk_info, log):
+        """Make sure the file described by `bulk_info` (the bulk-data
+        endpoint's response) is on disk, and return its path."""
+        updated_at = bulk_info['updated_at']
+        meta = self._read_meta()
+
+        if meta.get('updated_at') == updated_at and meta.get('complete') and self.path.exists():
+            log(f"Using cached bulk file from {updated_at}")
+            return self.path
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        headers = {}
+        offset = 0
+        if (
+            meta.get('updated_at') == updated_at
+            and meta.get('etag')
+            and self.partial_path.exists()
+        ):
+            offset = self.partial_path.stat().st_size
+            headers['Range'] = f'bytes={offset}-'
+            # if the file changed under us, the server sends all of it
+            headers['If-Range'] = meta['etag']
+            log(f"Resuming download at byte {offset}")
+        else:
+            self.partial_path.unlink(missing_ok=True)
+
+        with client.stream('GET', bulk_info['download_uri'], headers=headers) as response:
+            if response.status_code == 206:
+                mode = 'ab'
+            else:
+                if response.status_code == 416:
+                    # our partial file is no good; start over next time
+                    self.partial_path.unlink(missing_ok=True)
+                response.raise_for_status()
+                mode = 'wb'
+
+            self._write_meta({
+                'updated_at': updated_at,
+                'etag': response.headers.get('ETag', ''),
+                'complete': False,
+            })
+
+            with open(self.partial_path, mode) as f:
+                for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+
+        self.partial_path.replace(self.path)
+        meta = self._read_meta()
+        meta['complete'] = True
+        self._write_meta(meta)
+        log(f"Downloaded {self.path.stat().st_size} bytes")
+
+        return self.path
+
+
+class NotLineOriented(ValueError): ...
+
+
+def load_bulk_cards(f, tokenizer, plain=False, fallback=None):
+    """Iterate over the cards in bulk file `f`, opened in text mode.
+
+    With `plain`, every card is a regular dict (which can be pickled and
+    sent to another process); otherwise json_stream's lazy objects may be
+    handed back instead. With `fallback`, a file the `lines` tokenizer
+    can't read is picked up by that tokenizer where `lines` left off,
+    rather than raising `NotLineOriented`."""
+    if tokenizer == 'lines':
+        if fallback:
+            return _load_lines_or(f, fallback, plain)
+        return _load_lines(f)
+
+    if tokenizer == 'rust':
+        cards = json_stream.load(f, tokenizer=rust_tokenizer_or_raise())
+    elif tokenizer == 'python':
+        cards = json_stream.load(f, tokenizer=tokenize)
+    else:
+        raise ValueError(f"unknown tokenizer {tokenizer}")
+
+    if plain:
+        return (json_stream.to_standard_types(c) for c in cards)
+    return cards.persistent()
+
+
+def _load_lines_or(f, fallback, plain):
+    read = 0
+    try:
+        for card in _load_lines(f):
+            yield card
+            read += 1
+    except NotLineOriented:
+        f.seek(0)
+        yield from itertools.islice(load_bulk_cards(f, fallback, plain), read, None)
+
+
+def _load_lines(f):
+    for line_number, line in enumerate(f, start=1):
+        line = line.strip()
+        if line in ('[', ']', ''):
+            continue
+        if line.endswith(','):
+            line = line[:-1]
+
+        try:
+            card = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise NotLineOriented(
+                f"line {line_number} isn't a whole card; try another tokenizer"
+            ) from e
+        if not isinstance(card, dict):
+            raise NotLineOriented(
+                f"line {line_number} isn't a whole card; try another tokenizer"
+            )
+        yield card
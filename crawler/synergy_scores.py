@@ -0,0 +1,245 @@
+import math
+from collections import defaultdict
+
+from django.db import connection, transaction
+
+from decklist.models import Card, Commander, CommanderCardCount, PackedSynergy, SynergyScore
+from decklist.models.packedsynergy import encode_score, pack_scores
+from decklist.synergy import compute_synergy_all
+
+
+# a stored score closer than this to the new one isn't worth rewriting
+SCORE_TOLERANCE = 0.005
+
+
+def _comparable(score):
+    # treat NaN and NULL as 0
+    if score is None or math.isnan(score):
+        return 0.0
+    return score
+
+
+def _changed(score, stored):
+    if math.isnan(score):
+        # nothing is within tolerance of NaN; only a stored NaN or NULL
+        # already says the same thing
+        return stored is not None and not math.isnan(stored)
+    return abs(score - _comparable(stored)) >= SCORE_TOLERANCE
+
+
+class ScoreBatchWriter:
+    """Collects freshly computed synergy scores and writes them in batches.
+
+    The stored scores for a whole batch of cards are read in one query and
+    diffed in memory. Then new, changed and vanished scores are written
+    with one bulk create, update and delete each, instead of a lookup per
+    (card, commander) pair."""
+
+    def __init__(self, batch_size, log, card_names, log_all=False):
+        self.batch_size = batch_size
+        self._log = log
+        self._card_names = card_names
+        self._log_all = log_all
+        self._pending = {}
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+        self.deleted = 0
+
+    def add(self, card_id, scores):
+        self._pending[card_id] = scores
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+
+        pending = self._pending
+        self._pending = {}
+
+        existing = {
+            (score.card_id, score.commander_id): score
+            for score in SynergyScore.objects.filter(card__in=pending.keys())
+        }
+
+        new_records = []
+        update_records = []
+        # per card: new, updated, skipped
+        tallies = {card_id: [0, 0, 0] for card_id in pending}
+        for card_id, scores in pending.items():
+            tally = tallies[card_id]
+            for commander_id, score in scores:
+                score_record = existing.pop((card_id, commander_id), None)
+                if score_record is None:
+                    new_records.append(SynergyScore(
+                        commander_id=commander_id,
+                        card_id=card_id,
+                        score=score,
+                    ))
+                    tally[0] += 1
+                elif _changed(score, score_record.score):
+                    score_record.score = score
+                    update_records.append(score_record)
+                    tally[1] += 1
+                else:
+                    tally[2] += 1
+
+        # whatever's left no longer goes with these cards at all
+        stale_ids = [score.id for score in existing.values()]
+
+        with transaction.atomic():
+            SynergyScore.objects.bulk_create(new_records)
+            SynergyScore.objects.bulk_update(update_records, ['score'])
+            SynergyScore.objects.filter(id__in=stale_ids).delete()
+
+        self.created += len(new_records)
+        self.updated += len(update_records)
+        self.deleted += len(stale_ids)
+
+        for card_id, (created, updated, skipped) in tallies.items():
+            self.skipped += skipped
+            card = self._card_names[card_id]
+            if self._log_all:
+                self._log(f"{card}: {created} new scores, {updated} updated scores, {skipped} skipped")
+            elif created > 0 or updated > 0:
+                self._log(f"{card}: {created} new scores, {updated} updated scores, {skipped} skipped")
+
+
+class PackedScoreWriter:
+    """Collects synergy scores and folds them into each commander's
+    `PackedSynergy` row.
+
+    Scores arrive a card at a time but are stored a commander at a time,
+    so they're gathered (as one-byte codes) and each affected commander's
+    row is rewritten once, in `flush`. With `card_ids`, only those cards'
+    scores are replaced and the rest of each row is kept; without, every
+    row is replaced outright, and the scores should be computed and flushed
+    one of `commander_batches` at a time so they needn't all be held at
+    once."""
+
+    COMMANDER_BATCH_SIZE = 500
+    # each pass of a full run reads every count again, so these are bigger
+    COMMANDERS_PER_PASS = 5000
+
+    def __init__(self, card_ids=None):
+        self._card_ids = set(card_ids) if card_ids is not None else None
+        self._fresh = defaultdict(dict)
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+        self.deleted = 0
+
+    def add(self, card_id, scores):
+        for commander_id, score in scores:
+            self._fresh[commander_id][card_id] = encode_score(score)
+
+    def commander_batches(self):
+        """For a full run: every commander which may have scores now or had
+        some before, in batches of `COMMANDERS_PER_PASS`."""
+        commander_ids = sorted(
+            set(Commander.objects.filter(legal_deck_count__gt=0).values_list('id', flat=True))
+            | set(PackedSynergy.objects.values_list('commander_id', flat=True))
+        )
+        for start in range(0, len(commander_ids), self.COMMANDERS_PER_PASS):
+            yield commander_ids[start:start + self.COMMANDERS_PER_PASS]
+
+    def flush(self, commander_ids=None):
+        "Write `commander_ids`' rows, or every affected commander's."
+        if commander_ids is not None:
+            affected = commander_ids
+        elif self._card_ids is None:
+            affected = set(self._fresh) | set(
+                PackedSynergy.objects.values_list('commander_id', flat=True)
+            )
+        else:
+            # a refreshed card can only have had a score where it had a count
+            affected = set(self._fresh) | set(
+                CommanderCardCount.objects
+                .filter(card__in=self._card_ids)
+                .values_list('commander_id', flat=True)
+            )
+
+        affected = sorted(affected)
+        for start in range(0, len(affected), self.COMMANDER_BATCH_SIZE):
+            self._write(affected[start:start + self.COMMANDER_BATCH_SIZE])
+        self._fresh = defaultdict(dict)
+
+    def _write(self, commander_ids):
+        stored = {
+            row.commander_id: dict(row.unpack())
+            for row in PackedSynergy.objects.filter(commander__in=commander_ids)
+        }
+
+        rows = []
+        emptied = []
+        for commander_id in commander_ids:
+            old = stored.get(commander_id, {})
+            fresh = self._fresh.pop(commander_id, {})
+            if self._card_ids is None:
+                kept = {}
+                replaced = old
+            else:
+                kept = {c: code for c, code in old.items() if c not in self._card_ids}
+                replaced = {c: code for c, code in old.items() if c in self._card_ids}
+
+            for card_id, code in fresh.items():
+                old_code = replaced.pop(card_id, None)
+                if old_code is None:
+                    self.created += 1
+                elif old_code != code:
+                    self.updated += 1
+                else:
+                    self.skipped += 1
+            # whatever's left no longer goes with this commander at all
+            self.deleted += len(replaced)
+
+            codes = kept | fresh
+            if codes:
+                card_ids, scores = pack_scores(codes)
+                rows.append(PackedSynergy(
+                    commander_id=commander_id,
+                    card_ids=card_ids,
+                    scores=scores,
+                ))
+            elif commander_id in stored:
+                emptied.append(commander_id)
+
+        with transaction.atomic():
+            PackedSynergy.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=['commander'],
+                update_fields=['card_ids', 'scores'],
+            )
+            PackedSynergy.objects.filter(commander__in=emptied).delete()
+
+
+def shard_cards(card_ids, shards):
+    "Split card IDs into `shards` lists by hashing each ID."
+    split = [[] for _ in range(shards)]
+    for card_id in card_ids:
+        split[card_id.int % shards].append(card_id)
+    return split
+
+
+def write_shard(card_ids, batch_size, log_all):
+    """Runs in a worker process: compute and write the scores for one shard
+    of cards over the worker's own database connection. Log lines come
+    back to the caller along with the writer's totals."""
+    messages = []
+    try:
+        cards = Card.objects.filter(id__in=card_ids)
+        writer = ScoreBatchWriter(
+            batch_size,
+            messages.append,
+            dict(cards.values_list('id', 'name')),
+            log_all,
+        )
+        for card_id, scores in compute_synergy_all(cards):
+            writer.add(card_id, scores)
+        writer.flush()
+    finally:
+        connection.close()
+
+    return messages, (writer.created, writer.updated, writer.skipped, writer.deleted)
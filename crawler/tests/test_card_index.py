@@ -0,0 +1,40 @@
+import json
+from uuid import UUID
+
+from django.test import TestCase
+
+from crawler.card_index import CardIndex, CardNotFound
+from crawler.card_parsing import parse_card_and_printing
+
+
+class CardIndexTestCase(TestCase):
+    STATIC_ORB = UUID('0004ebd0-dfd6-4276-b4a6-de0003e94237')
+
+    @classmethod
+    def setUpTestData(cls):
+        with open('crawler/tests/static-orb.json') as f:
+            c, p = parse_card_and_printing(json.load(f))
+        c.save()
+        p.save()
+
+    def setUp(self):
+        self.index = CardIndex()
+
+    def test_printing(self):
+        self.assertEqual(
+            self.index.card_for_printing('86bf43b1-8d4e-4759-bb2d-0b2e03ba7012'),
+            self.STATIC_ORB,
+        )
+        self.assertIsNone(
+            self.index.card_for_printing('00000000-0000-0000-0000-000000000000')
+        )
+
+    def test_name_and_set(self):
+        self.assertEqual(self.index.lookup('static orb', '7ED'), self.STATIC_ORB)
+        with self.assertRaises(CardNotFound):
+            self.index.lookup('Static Orb', 'lea')
+
+    def test_relaxed_sets(self):
+        self.assertEqual(self.index.lookup('Static Orb', 'j21'), self.STATIC_ORB)
+        with self.assertRaises(CardNotFound):
+            self.index.lookup('Dynamic Orb', 'j21')
@@ -0,0 +1,199 @@
+import io
+import json
+from unittest import mock
+from uuid import uuid4
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from crawler.card_parsing import parse_card_and_printing
+from crawler.card_ingest import CardBatchWriter, parse_chunk, refresh_all_facts
+from crawler.models import LegalityRecheck
+from decklist.models import Card, CardInDeck, Deck, Printing, Rarity, Theme
+from decklist.models import card as card_module
+from decklist.test_helpers import make_card
+
+
+FIXTURES = [
+    'crawler/tests/static-orb.json',
+    'crawler/tests/propaganda-propaganda.json',
+    'crawler/tests/ley-weaver.json',
+]
+
+
+def _load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+class CardBatchWriterTestCase(TestCase):
+    def test_writes_in_batches(self):
+        writer = CardBatchWriter(2, print)
+        for path in FIXTURES:
+            writer.add(*parse_card_and_printing(_load(path)))
+        # two printings fill the first batch
+        self.assertEqual(Printing.objects.count(), 2)
+
+        writer.flush()
+        self.assertEqual(writer.rows_written, 3)
+        self.assertEqual(Card.objects.count(), 3)
+        self.assertEqual(Printing.objects.count(), 3)
+
+    def test_refreshes_card_facts(self):
+        writer = CardBatchWriter(10, print)
+        for path in FIXTURES:
+            writer.add(*parse_card_and_printing(_load(path)))
+        writer.flush()
+
+        weaver = Card.objects.get(name='Ley Weaver')
+        self.assertTrue(weaver.ever_uncommon)
+        self.assertFalse(weaver.ever_common)
+        self.assertTrue(weaver.is_creature)
+        self.assertEqual(weaver.identity_mask, 16)
+
+        orb = Card.objects.get(name='Static Orb')
+        self.assertFalse(orb.ever_uncommon)
+        self.assertFalse(orb.is_creature)
+
+    def test_refreshes_card_themes(self):
+        Theme.objects.create(
+            display_name='Partner', filter_text='Partner',
+            filter_type=Theme.Type.KEYWORD, slug='partner',
+        )
+        writer = CardBatchWriter(10, print)
+        for path in FIXTURES:
+            writer.add(*parse_card_and_printing(_load(path)))
+        writer.flush()
+
+        weaver = Card.objects.get(name='Ley Weaver')
+        self.assertEqual(
+            set(weaver.theme_memberships.values_list('theme__slug', flat=True)),
+            {'human', 'druid', 'partner'},
+        )
+        orb = Card.objects.get(name='Static Orb')
+        self.assertFalse(orb.theme_memberships.exists())
+
+    def test_upsert_keeps_editorial_printing(self):
+        writer = CardBatchWriter(10, print)
+        writer.add(*parse_card_and_printing(_load(FIXTURES[0])))
+        writer.flush()
+
+        card = Card.objects.get()
+        card.editorial_printing = card.printings.get()
+        card.save()
+
+        json_card = _load(FIXTURES[0])
+        json_card['type_line'] = 'Artifact — Orb'
+        writer.add(*parse_card_and_printing(json_card))
+        writer.flush()
+
+        card = Card.objects.get()
+        self.assertEqual(card.type_line, 'Artifact — Orb')
+        self.assertIsNotNone(card.editorial_printing)
+        self.assertEqual(Printing.objects.count(), 1)
+
+    def test_skips_unchanged_printings(self):
+        writer = CardBatchWriter(10, print)
+        for path in FIXTURES:
+            writer.add(*parse_card_and_printing(_load(path)))
+        writer.flush()
+        self.assertEqual(writer.inserted, 3)
+
+        # a later run only writes what changed
+        writer = CardBatchWriter(10, print)
+        for path in FIXTURES[:2]:
+            writer.add(*parse_card_and_printing(_load(path)))
+        json_card = _load(FIXTURES[2])
+        json_card['highres_image'] = not json_card['highres_image']
+        writer.add(*parse_card_and_printing(json_card))
+        writer.flush()
+
+        self.assertEqual(writer.inserted, 0)
+        self.assertEqual(writer.updated, 1)
+        self.assertEqual(writer.unchanged, 2)
+        self.assertEqual(writer.rows_written, 1)
+
+    def test_rows_from_worker(self):
+        rows, failures, _ = parse_chunk([_load(path) for path in FIXTURES])
+        # propaganda-propaganda is a reversible card, which we skip
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(failures, [])
+
+        writer = CardBatchWriter(10, print)
+        for card_row, printing_row in rows:
+            writer.add_row(card_row, printing_row)
+        writer.flush()
+
+        p = Printing.objects.get(id='2c7e9d68-d419-4ec5-97e9-2478ecb7007f')
+        self.assertEqual(p.card.name, 'Ley Weaver')
+        self.assertEqual(p.fingerprint, parse_card_and_printing(_load(FIXTURES[2]))[1].fingerprint)
+
+
+class LegalityRecheckTestCase(TestCase):
+    def setUp(self):
+        writer = CardBatchWriter(10, print)
+        writer.add(*parse_card_and_printing(_load(FIXTURES[2])))
+        writer.flush()
+        self.assertEqual(writer.legality_changed, 0)
+
+        commander = make_card('Elf Lord', 'g', rarities=[Rarity.UNCOMMON])
+
+        self.deck = Deck.objects.create(name='Weavers', source=0)
+        CardInDeck.objects.create(deck=self.deck, card=commander, is_pdh_commander=True)
+        CardInDeck.objects.create(deck=self.deck, card=Card.objects.get(name='Ley Weaver'))
+
+    def test_common_reprint(self):
+        # Ley Weaver has only been printed at uncommon
+        call_command('recheck-deck-legality', stdout=io.StringIO())
+        self.deck.refresh_from_db()
+        self.assertFalse(self.deck.pdh_legal)
+
+        # ...until now
+        json_card = _load(FIXTURES[2])
+        json_card['id'] = str(uuid4())
+        json_card['rarity'] = 'common'
+        writer = CardBatchWriter(10, print)
+        writer.add(*parse_card_and_printing(json_card))
+        writer.flush()
+        self.assertEqual(writer.legality_changed, 1)
+        self.assertEqual(LegalityRecheck.objects.get().card.name, 'Ley Weaver')
+
+        out = io.StringIO()
+        call_command('recheck-deck-legality', '--changed', stdout=out)
+        self.assertIn('Checking 1 decks', out.getvalue())
+        self.deck.refresh_from_db()
+        self.assertTrue(self.deck.pdh_legal)
+        self.assertFalse(LegalityRecheck.objects.exists())
+
+
+class BanListTestCase(TestCase):
+    def setUp(self):
+        commander = make_card('Elf Lord', 'g', rarities=[Rarity.UNCOMMON])
+        self.elf = make_card('Elf', 'g', 'Creature', rarities=[Rarity.COMMON])
+
+        self.deck = Deck.objects.create(name='Elves', source=0)
+        CardInDeck.objects.create(deck=self.deck, card=commander, is_pdh_commander=True)
+        CardInDeck.objects.create(deck=self.deck, card=self.elf)
+        call_command('recheck-deck-legality', stdout=io.StringIO())
+        self.deck.refresh_from_db()
+        self.assertTrue(self.deck.pdh_legal)
+
+    def _banned(self):
+        return mock.patch.object(card_module, 'BANNED_CARDS', card_module.BANNED_CARDS + ('Elf',))
+
+    def test_queues_newly_banned_cards(self):
+        with self._banned():
+            self.assertEqual(refresh_all_facts(), 1)
+            self.assertEqual(refresh_all_facts(), 0)
+        self.assertEqual(LegalityRecheck.objects.get().card, self.elf)
+
+        call_command('recheck-deck-legality', '--changed', stdout=io.StringIO())
+        self.deck.refresh_from_db()
+        self.assertFalse(self.deck.pdh_legal)
+
+    def test_full_recheck_refreshes_facts(self):
+        with self._banned():
+            call_command('recheck-deck-legality', stdout=io.StringIO())
+        self.deck.refresh_from_db()
+        self.assertFalse(self.deck.pdh_legal)
+        self.assertFalse(LegalityRecheck.objects.exists())
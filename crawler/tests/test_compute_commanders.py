@@ -0,0 +1,77 @@
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from decklist.models import CardInDeck, Commander, Deck, PartnerType
+from decklist.models.commander import CommanderQuerySet
+from decklist.test_helpers import make_card
+
+
+class ComputeCommandersTestCase(TestCase):
+    def setUp(self):
+        self.solo = make_card('Solo', 'g', partner_type=PartnerType.PARTNER)
+        self.first = make_card('First', 'w', partner_type=PartnerType.PARTNER)
+        self.second = make_card('Second', 'b', partner_type=PartnerType.PARTNER)
+
+        self.decks = []
+        for i, cards in enumerate([
+            (self.solo,),
+            (self.solo,),
+            (self.first, self.second),
+            (self.second, self.first),
+            (),
+        ]):
+            deck = Deck.objects.create(name=f'Deck {i}', source=0, source_id=str(i), pdh_legal=True)
+            for card in cards:
+                CardInDeck.objects.create(deck=deck, card=card, is_pdh_commander=True)
+            self.decks.append(deck)
+
+    def _run(self, *args):
+        call_command('compute-commanders', '--no-db', '--no-stdout', *args)
+
+    def test_assigns_commanders(self):
+        with mock.patch.object(CommanderQuerySet, 'rerank', autospec=True, side_effect=CommanderQuerySet.rerank) as rerank:
+            self._run()
+        self.assertEqual(rerank.call_count, 1)
+
+        self.assertEqual(Commander.objects.count(), 2)
+        pair = Commander.objects.get(commander2__isnull=False)
+        self.assertLessEqual(pair.commander1_id, pair.commander2_id)
+        self.assertEqual(pair.sfid, Commander.sfid_for(pair.commander1_id, pair.commander2_id))
+        self.assertEqual(pair.identity_mask, 1 | 4)
+        self.assertEqual(pair.legal_deck_count, 2)
+        # ranked once the new commanders' identities were known
+        self.assertEqual(
+            sorted(Commander.objects.values_list('identity_mask', 'deck_rank', 'color_rank')),
+            [(1 | 4, 1, 1), (16, 1, 1)],
+        )
+
+        commanders = [d.commander_id for d in Deck.objects.order_by('source_id')]
+        self.assertEqual(commanders[0], commanders[1])
+        self.assertEqual(commanders[2], pair.id)
+        self.assertEqual(commanders[3], pair.id)
+        self.assertIsNone(commanders[4])
+
+        # running again finds nothing new, and --all reuses what's there
+        self._run()
+        self._run('--all')
+        self.assertEqual(Commander.objects.count(), 2)
+        self.assertEqual(
+            sorted(Commander.objects.values_list('legal_deck_count', flat=True)),
+            [2, 2],
+        )
+
+    def test_all_moves_decks(self):
+        self._run()
+        CardInDeck.objects.filter(deck=self.decks[1]).update(card=self.first)
+
+        self._run('--all')
+        self.assertEqual(Commander.objects.count(), 3)
+        moved = Deck.objects.get(id=self.decks[1].id).commander
+        self.assertEqual(moved.commander1, self.first)
+        self.assertIsNone(moved.commander2)
+        self.assertEqual(
+            Commander.objects.get(commander1=self.solo).legal_deck_count,
+            1,
+        )
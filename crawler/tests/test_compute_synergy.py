@@ -0,0 +1,226 @@
+import math
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from crawler.synergy_scores import PackedScoreWriter, ScoreBatchWriter
+from decklist.deck_counts import recount_all, track_legal_decks
+from decklist.models.packedsynergy import decode_score
+from decklist.models import Card, CardInDeck, Commander, CommanderCardCount, Deck, PackedSynergy, Rarity, SynergyScore
+from decklist.test_helpers import make_card
+
+
+def _card(name, colors=''):
+    # synergy is only computed for cards printed at common
+    return make_card(name, colors, rarities=[Rarity.COMMON])
+
+
+class SynergyDecksMixin:
+    def setUp(self):
+        leaders = [
+            _card('Green Leader', 'g'),
+            _card('Other Green Leader', 'g'),
+            _card('Simic Leader', 'ug'),
+            _card('Blue Leader', 'u'),
+        ]
+        self.elf = _card('Elf', 'g')
+        self.fish = _card('Fish', 'u')
+
+        self.decks = []
+        for i, leader in enumerate(leaders * 2):
+            deck = Deck.objects.create(
+                name=f'Deck {i}',
+                source=0,
+                source_id=str(i),
+                pdh_legal=True,
+                commander=Commander.objects.get_or_create(commander1=leader)[0],
+            )
+            CardInDeck.objects.create(deck=deck, card=leader, is_pdh_commander=True)
+            CardInDeck.objects.create(deck=deck, card=self.elf)
+            self.decks.append(deck)
+        CardInDeck.objects.create(deck=self.decks[3], card=self.fish)
+
+    def _run(self, *args):
+        call_command('compute-synergy', '--no-db', '--no-stdout', *args)
+
+    def _scores(self):
+        return set(SynergyScore.objects.values_list('commander_id', 'card_id', 'score'))
+
+
+class ComputeSynergyTestCase(SynergyDecksMixin, TestCase):
+    def test_changed_matches_full(self):
+        self._run()
+        self.assertFalse(CommanderCardCount.objects.changed().exists())
+        self.assertTrue(SynergyScore.objects.filter(card=self.fish).exists())
+
+        with track_legal_decks(d.id for d in self.decks):
+            CardInDeck.objects.filter(card=self.fish).delete()
+            CardInDeck.objects.create(deck=self.decks[6], card=self.fish)
+            Deck.objects.filter(id=self.decks[1].id).update(pdh_legal=False)
+
+        self._run('--changed')
+        self.assertFalse(CommanderCardCount.objects.changed().exists())
+        incremental = self._scores()
+
+        self._run()
+        self.assertEqual(incremental, self._scores())
+
+    def test_changed_total_refreshes_eligible_cards(self):
+        # the fish goes with the blue and Simic commanders
+        CardInDeck.objects.create(deck=self.decks[2], card=self.fish)
+        recount_all()
+        self._run()
+
+        # a new blue commander has no fish, but its decks move the fish's
+        # scores with the others all the same
+        leader = _card('New Blue Leader', 'u')
+        commander = Commander.objects.create(commander1=leader)
+        deck = Deck.objects.create(name='New', source=0, source_id='new')
+        with track_legal_decks([deck.id]):
+            CardInDeck.objects.create(deck=deck, card=leader, is_pdh_commander=True)
+            Deck.objects.filter(id=deck.id).update(pdh_legal=True, commander=commander)
+
+        self._run('--changed')
+        incremental = self._scores()
+
+        self._run()
+        self.assertEqual(incremental, self._scores())
+
+class PackedSynergyTestCase(SynergyDecksMixin, TestCase):
+    def _packed(self):
+        return {
+            (row.commander_id, card_id, decode_score(code))
+            for row in PackedSynergy.objects.all()
+            for card_id, code in row.unpack()
+        }
+
+    def test_matches_rows(self):
+        self._run()
+        rows = self._scores()
+        with override_settings(SYNERGY_STORAGE='packed'):
+            self._run()
+        self.assertTrue(rows)
+        self.assertEqual(self._packed(), rows)
+
+        for commander_id, card_id, score in rows:
+            commander = Commander.objects.get(id=commander_id)
+            card = Card.objects.get(id=card_id)
+            self.assertEqual(PackedSynergy.objects.score_for(commander, card), score)
+            with override_settings(SYNERGY_STORAGE='packed'):
+                in_99 = Commander.objects.for_card_in_99(card).get(id=commander_id)
+            self.assertEqual(in_99.synergy, score)
+
+        # the elf can't go in a mono-blue deck
+        blue = Commander.objects.get(commander1__name='Blue Leader')
+        self.assertIsNone(PackedSynergy.objects.score_for(blue, self.elf))
+
+    def test_full_run_in_commander_batches(self):
+        self._run()
+        rows = self._scores()
+        # a commander with no decks left loses its old row
+        gone = Commander.objects.create(commander1=_card('Gone Leader'))
+        PackedSynergy.objects.create(commander=gone, card_ids=b'', scores=b'')
+
+        with (
+            override_settings(SYNERGY_STORAGE='packed'),
+            mock.patch.object(PackedScoreWriter, 'COMMANDERS_PER_PASS', 1),
+        ):
+            self._run()
+        self.assertEqual(self._packed(), rows)
+        self.assertFalse(PackedSynergy.objects.filter(commander=gone).exists())
+
+    def test_ranked(self):
+        with override_settings(SYNERGY_STORAGE='packed'):
+            self._run()
+        row = PackedSynergy.objects.get(commander__commander1__name='Green Leader')
+        ranked = PackedSynergy.objects.ranked_for(row.commander)
+        scores = [score for _, _, score in ranked[:]]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertEqual([rank for rank, _, _ in ranked[:]][0], 1)
+
+    def test_changed_matches_full(self):
+        with override_settings(SYNERGY_STORAGE='packed'):
+            self._run()
+            with track_legal_decks(d.id for d in self.decks):
+                CardInDeck.objects.filter(card=self.fish).delete()
+                CardInDeck.objects.create(deck=self.decks[6], card=self.fish)
+                Deck.objects.filter(id=self.decks[1].id).update(pdh_legal=False)
+
+            self._run('--changed')
+            incremental = self._packed()
+            self._run()
+            self.assertEqual(incremental, self._packed())
+
+
+# worker processes can only see committed data
+class ParallelComputeSynergyTestCase(SynergyDecksMixin, TransactionTestCase):
+    def test_matches_serial(self):
+        self._run()
+        serial = self._scores()
+        SynergyScore.objects.all().delete()
+
+        self._run('--workers', '2', '--batch-size', '1')
+        self.assertTrue(serial)
+        self.assertEqual(self._scores(), serial)
+        self.assertFalse(CommanderCardCount.objects.changed().exists())
+
+
+class ScoreBatchWriterTestCase(TestCase):
+    def setUp(self):
+        self.cards = [make_card(f'Card {i}') for i in range(3)]
+        self.commanders = [
+            Commander.objects.create(commander1=make_card(f'Leader {i}'))
+            for i in range(3)
+        ]
+        self.names = {c.id: c.name for c in self.cards}
+        self.log = []
+
+    def _writer(self, batch_size=10):
+        return ScoreBatchWriter(batch_size, self.log.append, self.names)
+
+    def test_diffs_in_memory(self):
+        card = self.cards[0]
+        a, b, c = self.commanders
+        SynergyScore.objects.create(card=card, commander=a, score=0.5)
+        SynergyScore.objects.create(card=card, commander=b, score=float('nan'))
+        SynergyScore.objects.create(card=card, commander=c, score=0.1)
+
+        writer = self._writer()
+        writer.add(card.id, [(a.id, 0.502), (b.id, 0.25)])
+        writer.add(self.cards[1].id, [(a.id, 0.75)])
+        # one read, then create, update and delete in a transaction
+        with self.assertNumQueries(6):
+            writer.flush()
+
+        self.assertEqual(
+            (writer.created, writer.updated, writer.skipped, writer.deleted),
+            (1, 1, 1, 1),
+        )
+        self.assertEqual(
+            set(SynergyScore.objects.values_list('card__name', 'commander_id', 'score')),
+            {('Card 0', a.id, 0.5), ('Card 0', b.id, 0.25), ('Card 1', a.id, 0.75)},
+        )
+        self.assertIn('Card 1: 1 new scores, 0 updated scores, 0 skipped', self.log)
+
+    def test_nan_replaces_a_score(self):
+        card = self.cards[0]
+        a, b, c = self.commanders
+        SynergyScore.objects.create(card=card, commander=a, score=0.5)
+        SynergyScore.objects.create(card=card, commander=b, score=float('nan'))
+        SynergyScore.objects.create(card=card, commander=c, score=None)
+
+        writer = self._writer()
+        writer.add(card.id, [(a.id, float('nan')), (b.id, float('nan')), (c.id, float('nan'))])
+        writer.flush()
+
+        self.assertEqual((writer.updated, writer.skipped), (1, 2))
+        self.assertTrue(math.isnan(SynergyScore.objects.get(card=card, commander=a).score))
+
+    def test_flushes_full_batches(self):
+        writer = self._writer(batch_size=2)
+        for card in self.cards:
+            writer.add(card.id, [(self.commanders[0].id, 0.1)])
+        self.assertEqual(SynergyScore.objects.count(), 2)
+        writer.flush()
+        self.assertEqual(SynergyScore.objects.count(), 3)
@@ -0,0 +1,143 @@
+from django.core.management import call_command
+from django.test import TestCase
+
+from decklist.deck_counts import recount_all, track_legal_decks
+from decklist.models import Card, CardInDeck, CardTheme, Commander, CommanderTheme, Deck, Theme, ThemeResult
+from decklist.test_helpers import make_card
+from decklist.themes import refresh_theme
+
+
+def _card(name, type_line='Creature', keywords=()):
+    return make_card(name, type_line=type_line, keywords=keywords)
+
+
+class ComputeThemesTestCase(TestCase):
+    def setUp(self):
+        # migrations seed the real themes
+        Theme.objects.all().delete()
+        self.elves = Theme.objects.create(
+            display_name='Elves', filter_text='Elf', filter_type=Theme.Type.TYPAL,
+            slug='elves', card_threshold=2, deck_threshold=50,
+        )
+        self.flying = Theme.objects.create(
+            display_name='Flying', filter_text='Flying', filter_type=Theme.Type.KEYWORD,
+            slug='flying', card_threshold=1, deck_threshold=50,
+        )
+        # a keyword has to match whole
+        self.fly = Theme.objects.create(
+            display_name='Fly', filter_text='Fly', filter_type=Theme.Type.KEYWORD,
+            slug='fly', card_threshold=0, deck_threshold=0,
+        )
+
+        elf_leader = _card('Elf Leader', 'Legendary Creature — Elf')
+        bird_leader = _card('Bird Leader', 'Legendary Creature — Bird', ['Flying'])
+        other_leader = _card('Other Leader', 'Legendary Creature')
+        elves = [_card(f'Elf {i}', 'Creature — Elf Druid') for i in range(2)]
+        birds = [_card(f'Bird {i}', 'Creature — Bird', ['Flying']) for i in range(2)]
+        filler = _card('Filler')
+        CardTheme.objects.refresh_themes(Theme.objects.values_list('id', flat=True))
+
+        self.elf_cmdr = Commander.objects.create(commander1=elf_leader)
+        self.bird_cmdr = Commander.objects.create(commander1=bird_leader)
+        self.other_cmdr = Commander.objects.create(commander1=other_leader)
+
+        decks = [
+            # three elf decks out of four; the illegal one doesn't count
+            (self.elf_cmdr, True, elves),
+            (self.elf_cmdr, True, elves),
+            (self.elf_cmdr, True, elves + birds[:1]),
+            (self.elf_cmdr, True, [filler]),
+            (self.elf_cmdr, False, elves),
+            # two flying decks out of five isn't enough
+            (self.other_cmdr, True, birds),
+            (self.other_cmdr, True, birds),
+            (self.other_cmdr, True, [filler]),
+            (self.other_cmdr, True, [filler]),
+            (self.other_cmdr, True, [filler]),
+            # only one flying deck isn't enough either
+            (self.bird_cmdr, True, birds[:1]),
+            (self.bird_cmdr, True, [filler]),
+        ]
+        self.decks = []
+        for i, (commander, legal, cards) in enumerate(decks):
+            deck = Deck.objects.create(
+                name=f'Deck {i}', source=0, source_id=str(i),
+                pdh_legal=legal, commander=commander,
+            )
+            CardInDeck.objects.create(deck=deck, card=commander.commander1, is_pdh_commander=True)
+            for card in cards:
+                CardInDeck.objects.create(deck=deck, card=card)
+            self.decks.append(deck)
+        recount_all()
+
+    def _run(self, *args):
+        call_command('compute-themes', '--no-db', '--no-stdout', *args)
+
+    def _results(self):
+        return set(ThemeResult.objects.values_list(
+            'theme__slug', 'commander_id', 'theme_deck_count', 'total_deck_count',
+        ))
+
+    def test_thresholds(self):
+        ThemeResult.objects.create(
+            theme=self.elves, commander=self.elf_cmdr,
+            theme_deck_count=1, total_deck_count=1,
+        )
+        ThemeResult.objects.create(
+            theme=self.flying, commander=self.bird_cmdr,
+            theme_deck_count=1, total_deck_count=1,
+        )
+
+        self._run('--full')
+
+        self.assertEqual(self._results(), {
+            ('elves', self.elf_cmdr.id, 3, 4),
+        })
+
+    def test_changed_matches_full(self):
+        self._run('--full')
+        self.assertFalse(CommanderTheme.objects.changed().exists())
+
+        with track_legal_decks(d.id for d in self.decks):
+            # the other commander picks up a third flying deck...
+            for bird in Card.objects.filter(name__startswith='Bird '):
+                CardInDeck.objects.create(deck=self.decks[7], card=bird)
+            # ...and the elf commander loses one
+            Deck.objects.filter(id=self.decks[0].id).update(pdh_legal=False)
+
+        self.assertEqual(
+            set(CommanderTheme.objects.changed().values_list('commander_id', flat=True)),
+            {self.elf_cmdr.id, self.other_cmdr.id},
+        )
+        self._run()
+        self.assertFalse(CommanderTheme.objects.changed().exists())
+        incremental = self._results()
+        self.assertEqual(incremental, {
+            ('elves', self.elf_cmdr.id, 2, 3),
+            ('flying', self.other_cmdr.id, 3, 5),
+        })
+
+        self._run('--full')
+        self.assertEqual(self._results(), incremental)
+
+    def test_threshold_edit(self):
+        self._run('--full')
+        self.elves.deck_threshold = 100
+        self.elves.save()
+        refresh_theme(self.elves, matching_changed=False)
+        self.assertFalse(self.elves.results.exists())
+
+    def test_memberships(self):
+        self.assertFalse(self.fly.card_memberships.exists())
+        self.assertEqual(self.flying.card_memberships.count(), 3)
+
+        bird = Card.objects.get(name='Bird 0')
+        bird.type_line = 'Creature — Elf Bird'
+        bird.keywords = []
+        bird.save()
+        CardTheme.objects.refresh_cards([bird.id])
+        self.assertEqual(
+            set(bird.theme_memberships.values_list('theme__slug', flat=True)),
+            {'elves'},
+        )
+        self.assertEqual(self.flying.card_memberships.count(), 2)
@@ -0,0 +1,101 @@
+import datetime
+
+import httpx
+from django.test import TestCase
+
+from crawler.crawlers import ArchidektCrawler, ARCHIDEKT_API_BASE
+from crawler.models import DeckCrawlResult
+from decklist.models import Deck, DataSource
+
+
+def listing(deck_id, updated, name=None):
+    return {
+        'id': deck_id,
+        'updatedAt': updated,
+        'name': name or f'Deck {deck_id}',
+        'owner': {'username': 'someone'},
+    }
+
+
+class ProcessPageTestCase(TestCase):
+    def setUp(self):
+        self.existing = Deck.objects.create(
+            name='Old name',
+            source=DataSource.ARCHIDEKT,
+            source_id='1',
+            pdh_legal=True,
+        )
+        client = httpx.Client(base_url=ARCHIDEKT_API_BASE)
+        self.crawler = ArchidektCrawler(client, None, None, lambda _: None)
+
+    def test_page(self):
+        stop_after = datetime.datetime(2024, 11, 1, tzinfo=datetime.timezone.utc)
+        results = [
+            listing(2, '2024-11-30T10:00:00Z'),
+            listing(1, '2024-11-29T10:00:00Z', 'New name'),
+            listing(2, '2024-11-28T10:00:00Z', 'Stale copy'),
+            listing(3, '2024-10-01T10:00:00Z'),
+        ]
+
+        with self.assertNumQueries(6):
+            oldest = self.crawler._process_page(results, stop_after)
+
+        self.assertEqual(oldest.month, 10)
+        self.assertEqual(
+            sorted(Deck.objects.values_list('source_id', 'name')),
+            [('1', 'New name'), ('2', 'Deck 2')],
+        )
+        self.existing.refresh_from_db()
+        self.assertTrue(self.existing.pdh_legal)
+        self.assertFalse(Deck.objects.get(source_id='2').pdh_legal)
+        self.assertEqual(
+            sorted(DeckCrawlResult.objects.values_list('url', flat=True)),
+            ['https://archidekt.com/api/decks/1/', 'https://archidekt.com/api/decks/2/'],
+        )
+
+
+class PrefetchTestCase(TestCase):
+    def setUp(self):
+        self.fetched = []
+
+    def _serve(self, request):
+        page = int(request.url.params.get('page', 1))
+        self.fetched.append(page)
+        next = f'http://archidekt.com/api/decks/v3/?page={page + 1}' if page < 3 else None
+        return httpx.Response(200, json={
+            'count': 3,
+            'next': next,
+            'results': [listing(page, f'2024-11-{30 - page}T10:00:00Z')],
+        })
+
+    def _crawler(self, stop_after=None):
+        client = httpx.Client(base_url=ARCHIDEKT_API_BASE, transport=httpx.MockTransport(self._serve))
+        return ArchidektCrawler(client, None, stop_after, lambda _: None)
+
+    def test_all_pages(self):
+        crawler = self._crawler()
+        next_urls = []
+        for page in crawler.prefetched_pages():
+            next_urls.append(page.next_url)
+            if not crawler.process_page(page):
+                break
+
+        self.assertEqual(self.fetched, [1, 2, 3])
+        self.assertEqual(Deck.objects.count(), 3)
+        # Archidekt's http:// links get fixed up
+        self.assertEqual(next_urls[0], 'https://archidekt.com/api/decks/v3/?page=2')
+        self.assertIsNone(next_urls[-1])
+
+    def test_stop_early(self):
+        stop_after = datetime.datetime(2024, 11, 28, 12, tzinfo=datetime.timezone.utc)
+        crawler = self._crawler(stop_after)
+        pages = crawler.prefetched_pages()
+        for page in pages:
+            if not crawler.process_page(page):
+                break
+        pages.close()
+
+        # page 2 is too old, so we stop there; page 3 may have been
+        # fetched ahead, but nothing from it gets written
+        self.assertEqual(Deck.objects.count(), 1)
+        self.assertEqual(self.fetched[:2], [1, 2])
@@ -0,0 +1,54 @@
+import asyncio
+
+import httpx
+from django.test import SimpleTestCase
+
+from crawler.deck_fetching import ConcurrentFetcher
+from crawler.pacing import retry_after
+
+
+class ConcurrentFetcherTestCase(SimpleTestCase):
+    def setUp(self):
+        self.requests = []
+
+    def _serve(self, request):
+        self.requests.append(request)
+        # the first request to each host gets told to back off
+        if sum(1 for r in self.requests if r.url.host == request.url.host) == 1:
+            return httpx.Response(429, headers={'Retry-After': '0'})
+        return httpx.Response(200, json={'path': request.url.path})
+
+    async def _fetch(self, requests):
+        results = asyncio.Queue()
+        async with httpx.AsyncClient(transport=httpx.MockTransport(self._serve)) as client:
+            fetcher = ConcurrentFetcher(client, results, self._log, rate=1000, concurrency=2)
+            await fetcher.run(requests)
+        fetched = []
+        while not results.empty():
+            fetched.append(results.get_nowait())
+        return fetched
+
+    async def _log(self, message):
+        pass
+
+    def test_fetches_everything_and_retries(self):
+        requests = [
+            ('a1', 'https://archidekt.com/api/decks/1/', None),
+            ('a2', 'https://archidekt.com/api/decks/2/', None),
+            ('m1', 'https://api2.moxfield.com/v3/decks/all/x', {'User-agent': 'test'}),
+        ]
+        fetched = asyncio.run(self._fetch(requests))
+
+        self.assertEqual(sorted(item for item, _ in fetched), ['a1', 'a2', 'm1'])
+        self.assertTrue(all(response.status_code == 200 for _, response in fetched))
+        # one 429 per host, each retried
+        self.assertEqual(len(self.requests), 5)
+        self.assertEqual(
+            [r.headers['User-agent'] for r in self.requests if r.url.host == 'api2.moxfield.com'],
+            ['test', 'test'],
+        )
+
+    def test_retry_after(self):
+        self.assertEqual(retry_after(httpx.Response(429, headers={'Retry-After': '7'}), 30), 7)
+        self.assertEqual(retry_after(httpx.Response(429), 30), 30)
+        self.assertEqual(retry_after(httpx.Response(429, headers={'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}), 30), 0)
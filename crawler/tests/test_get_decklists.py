@@ -0,0 +1,114 @@
+import asyncio
+import importlib
+from unittest import mock
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.db import connections
+from django.test import TransactionTestCase
+
+from crawler.crawlers import ARCHIDEKT_API_BASE, ArchidektCrawler
+from crawler.models import DeckCrawlResult
+from crawler.tests.test_crawlers import listing
+from decklist.models import Card, CardInDeck, Commander, CommanderCardCount, DataSource, Deck, Rarity
+from decklist.test_helpers import make_card
+
+get_decklists = importlib.import_module('crawler.management.commands.get-decklists')
+RealAsyncClient = httpx.AsyncClient
+
+
+def archidekt_envelope(commander, cards):
+    def entry(card, categories):
+        printing = card.printings.first()
+        return {
+            'categories': categories,
+            'card': {
+                'uid': str(printing.id),
+                'oracleCard': {'name': card.name},
+                'edition': {'editioncode': printing.set_code},
+            },
+        }
+
+    return {
+        'cards': [entry(commander, ['Commander'])] + [entry(card, ['Creature']) for card in cards],
+        'categories': [
+            {'name': 'Commander', 'includedInDeck': True, 'isPremier': True},
+            {'name': 'Creature', 'includedInDeck': True, 'isPremier': False},
+        ],
+    }
+
+
+class GetDecklistsTestCase(TransactionTestCase):
+    # the command does its database work off the event loop's thread, so
+    # the test's data has to be committed for it to see
+
+    def setUp(self):
+        self.envelopes = {}
+
+    def tearDown(self):
+        # or the test database can't be dropped at the end
+        asyncio.run(sync_to_async(connections.close_all)())
+
+    def _deck(self, source_id, envelope):
+        deck = Deck.objects.create(
+            name=f'Deck {source_id}', source=DataSource.ARCHIDEKT, source_id=source_id,
+        )
+        url = f'https://archidekt.com/api/decks/{source_id}/'
+        DeckCrawlResult.objects.create(url=url, deck=deck, updated_time=deck.updated_time)
+        self.envelopes[url] = envelope
+        return deck
+
+    def _serve(self, request):
+        return httpx.Response(200, json=self.envelopes[str(request.url)])
+
+    def _client(self, *args, **kwargs):
+        return RealAsyncClient(*args, transport=httpx.MockTransport(self._serve), **kwargs)
+
+    def _run(self):
+        with (
+            mock.patch.object(get_decklists.httpx, 'AsyncClient', self._client),
+            # so a stuck consumer would stall the fetchers straight away
+            mock.patch.object(get_decklists, 'RESPONSE_QUEUE_SIZE', 1),
+        ):
+            call_command('get-decklists', '--no-db', '--no-stdout', '--rate', '1000')
+
+    def test_bad_deck_doesnt_stop_the_rest(self):
+        commander = make_card('Leader', 'g', 'Creature', rarities=[Rarity.UNCOMMON])
+        elf = make_card('Elf', 'g', 'Creature', rarities=[Rarity.COMMON])
+        good = [self._deck(str(i), archidekt_envelope(commander, [elf])) for i in range(3)]
+        bad = self._deck('99', {'cards': [{'card': {}}]})
+
+        self._run()
+
+        for deck in good:
+            self.assertEqual(
+                set(CardInDeck.objects.filter(deck=deck).values_list('card__name', flat=True)),
+                {'Leader', 'Elf'},
+            )
+        self.assertFalse(DeckCrawlResult.objects.filter(deck__in=good).exists())
+        self.assertFalse(DeckCrawlResult.objects.get(deck=bad).fetchable)
+
+    def test_recrawl_keeps_counts(self):
+        commander = make_card('Leader', 'g', 'Creature', rarities=[Rarity.UNCOMMON])
+        elf = make_card('Elf', 'g', 'Creature', rarities=[Rarity.COMMON])
+        self.envelopes['https://archidekt.com/api/decks/1/'] = archidekt_envelope(commander, [elf])
+        crawler = ArchidektCrawler(httpx.Client(base_url=ARCHIDEKT_API_BASE), None, None, lambda _: None)
+
+        def counts():
+            return (
+                list(Commander.objects.values_list('legal_deck_count', flat=True)),
+                list(Card.objects.order_by('name').values_list('legal_deck_count', flat=True)),
+                list(CommanderCardCount.objects.order_by('card__name').values_list('count', flat=True)),
+            )
+
+        crawler._process_page([listing(1, '2024-11-29T10:00:00Z')], None)
+        self._run()
+        call_command('compute-commanders', '--no-db', '--no-stdout')
+        self.assertEqual(counts(), ([1], [1, 1], [1, 1]))
+
+        # seen again after an edit
+        crawler._process_page([listing(1, '2024-11-30T10:00:00Z')], None)
+        self._run()
+        call_command('compute-commanders', '--no-db', '--no-stdout')
+        self.assertEqual(counts(), ([1], [1, 1], [1, 1]))
@@ -0,0 +1,94 @@
+import httpx
+from django.test import SimpleTestCase, TestCase
+
+from crawler.crawlers import ArchidektCrawler, CrawlerExit, ARCHIDEKT_API_BASE
+from crawler.models import DeckCrawlResult
+from crawler.pacing import AdaptivePacer, rate_limit_delay
+
+
+class AdaptivePacerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.pacer = AdaptivePacer(1.0, max_rate=2.0, patience=3, step=0.5, backoff_base=4.0)
+
+    def test_speeds_up_after_successes(self):
+        for _ in range(2):
+            self.pacer.succeeded(httpx.Response(200))
+        self.assertEqual(self.pacer.rate, 1.0)
+        self.pacer.succeeded(httpx.Response(200))
+        self.assertEqual(self.pacer.rate, 1.5)
+
+        for _ in range(9):
+            self.pacer.succeeded(httpx.Response(200))
+        self.assertEqual(self.pacer.rate, 2.0)
+
+    def test_backs_off(self):
+        self.assertTrue(self.pacer.should_retry(httpx.Response(503)))
+        self.assertFalse(self.pacer.should_retry(httpx.Response(404)))
+
+        delay = self.pacer.failed(httpx.Response(503))
+        self.assertEqual(self.pacer.rate, 0.5)
+        self.assertTrue(2.0 <= delay <= 4.0)
+
+        delay = self.pacer.failed(httpx.Response(429))
+        self.assertTrue(4.0 <= delay <= 8.0)
+
+        # the server's word beats our own guess
+        delay = self.pacer.failed(httpx.Response(429, headers={'Retry-After': '120'}))
+        self.assertEqual(delay, 120)
+
+    def test_gives_up(self):
+        pacer = AdaptivePacer(1.0, max_rate=2.0, max_retries=2, backoff_base=0)
+        self.assertIsNotNone(pacer.failed(httpx.Response(500)))
+        self.assertIsNotNone(pacer.failed(httpx.Response(500)))
+        self.assertIsNone(pacer.failed(httpx.Response(500)))
+
+        # a success resets the count
+        pacer.succeeded(httpx.Response(200))
+        self.assertIsNotNone(pacer.failed(httpx.Response(500)))
+
+    def test_rate_limit_headers(self):
+        self.assertIsNone(rate_limit_delay(httpx.Response(200)))
+        self.assertEqual(
+            rate_limit_delay(httpx.Response(200, headers={'X-RateLimit-Remaining': '10', 'X-RateLimit-Reset': '20'})),
+            2.0,
+        )
+
+        self.pacer.succeeded(httpx.Response(200, headers={'RateLimit-Remaining': '10', 'RateLimit-Reset': '20'}))
+        self.assertEqual(self.pacer.rate, 0.5)
+
+
+class CrawlerRetryTestCase(TestCase):
+    PAGE = {
+        'count': 1,
+        'next': None,
+        'results': [{
+            'id': 1234,
+            'updatedAt': '2024-11-30T10:00:00Z',
+            'name': 'Orb Control',
+            'owner': {'username': 'someone'},
+        }],
+    }
+
+    def _crawler(self, statuses, pacer):
+        responses = iter(statuses)
+        def serve(request):
+            status = next(responses)
+            return httpx.Response(status, json=self.PAGE if status == 200 else {})
+        client = httpx.Client(base_url=ARCHIDEKT_API_BASE, transport=httpx.MockTransport(serve))
+        return ArchidektCrawler(client, None, None, lambda _: None, pacer)
+
+    def test_retries_until_success(self):
+        pacer = AdaptivePacer(1000, max_rate=1000, backoff_base=0)
+        crawler = self._crawler([429, 503, 200], pacer)
+
+        self.assertFalse(crawler.get_next_page())
+        self.assertEqual(pacer.rate, 250)
+        self.assertEqual(DeckCrawlResult.objects.get().deck.source_id, '1234')
+
+    def test_gives_up(self):
+        pacer = AdaptivePacer(1000, max_rate=1000, backoff_base=0, max_retries=1)
+        crawler = self._crawler([503, 503], pacer)
+
+        with self.assertRaises(CrawlerExit) as cm:
+            crawler.get_next_page()
+        self.assertEqual(cm.exception.response.status_code, 503)
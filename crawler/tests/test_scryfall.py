@@ -0,0 +1,102 @@
+import io
+import json
+import tempfile
+
+import httpx
+from django.test import SimpleTestCase
+
+from crawler.scryfall import BulkFileCache, TOKENIZERS, NotLineOriented, load_bulk_cards
+
+
+BULK_BODY = b'[\n{"name":"Static Orb"}\n]\n'
+BULK_INFO = {
+    'updated_at': '2024-11-30T10:00:00.000+00:00',
+    'download_uri': 'https://data.scryfall.io/default-cards/default-cards.json',
+}
+
+
+class BulkFileCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.requests = []
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.cache = BulkFileCache(self.tempdir.name)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def _serve(self, request):
+        self.requests.append(request)
+        headers = {'ETag': '"abc"'}
+        if 'Range' in request.headers:
+            start = int(request.headers['Range'][len('bytes='):-1])
+            return httpx.Response(206, headers=headers, content=BULK_BODY[start:])
+        return httpx.Response(200, headers=headers, content=BULK_BODY)
+
+    def _client(self):
+        return httpx.Client(transport=httpx.MockTransport(self._serve))
+
+    def test_download_once(self):
+        with self._client() as client:
+            path = self.cache.download(client, BULK_INFO, lambda _: None)
+            self.cache.mark_ingested(BULK_INFO['updated_at'])
+            self.assertEqual(path.read_bytes(), BULK_BODY)
+
+            # same updated_at: no second request
+            self.cache.download(client, BULK_INFO, lambda _: None)
+        self.assertEqual(len(self.requests), 1)
+        self.assertTrue(self.cache.is_ingested(BULK_INFO['updated_at']))
+        self.assertFalse(self.cache.is_ingested('2024-12-01T10:00:00.000+00:00'))
+
+    def test_resume_partial_download(self):
+        with self._client() as client:
+            self.cache.download(client, BULK_INFO, lambda _: None)
+            # pretend the transfer died partway through
+            self.cache.path.rename(self.cache.partial_path)
+            with open(self.cache.partial_path, 'r+b') as f:
+                f.truncate(5)
+            meta = self.cache._read_meta()
+            meta['complete'] = False
+            self.cache._write_meta(meta)
+
+            path = self.cache.download(client, BULK_INFO, lambda _: None)
+
+        self.assertEqual(self.requests[-1].headers['Range'], 'bytes=5-')
+        self.assertEqual(self.requests[-1].headers['If-Range'], '"abc"')
+        self.assertEqual(path.read_bytes(), BULK_BODY)
+
+
+class LoadBulkCardsTestCase(SimpleTestCase):
+    SAMPLE = 'crawler/tests/default-cards-sample.json'
+
+    def test_tokenizers_agree(self):
+        with open(self.SAMPLE, encoding='utf-8') as f:
+            expected = json.load(f)
+
+        for tokenizer in TOKENIZERS:
+            with self.subTest(tokenizer=tokenizer):
+                with open(self.SAMPLE, encoding='utf-8') as f:
+                    cards = list(load_bulk_cards(f, tokenizer, plain=True))
+                self.assertEqual(cards, expected)
+
+    def test_lines_rejects_pretty_printed_file(self):
+        with open(self.SAMPLE, encoding='utf-8') as f:
+            pretty = json.dumps(json.load(f), indent=2)
+
+        with self.assertRaises(NotLineOriented):
+            list(load_bulk_cards(io.StringIO(pretty), 'lines'))
+
+    def test_lines_falls_back(self):
+        with open(self.SAMPLE, encoding='utf-8') as f:
+            expected = json.load(f)
+        # one card per line until partway through
+        mixed = (
+            '[\n'
+            + ''.join(json.dumps(card) + ',\n' for card in expected[:2])
+            + json.dumps(expected[2:], indent=2)[1:-1]
+            + '\n]\n'
+        )
+
+        for fallback in ('rust', 'python'):
+            with self.subTest(fallback=fallback):
+                cards = list(load_bulk_cards(io.StringIO(mixed), 'lines', plain=True, fallback=fallback))
+                self.assertEqual(cards, expected)
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from . import models
+from .themes import refresh_theme
 
 
 admin.site.site_header = 'SmallFormats admin'
@@ -20,6 +21,16 @@ class CardAdmin(admin.ModelAdmin):
     autocomplete_fields = [
         'editorial_printing',
     ]
+    # computed by the card importer
+    readonly_fields = [
+        'ever_common',
+        'ever_uncommon',
+        'is_creature',
+        'is_land',
+        'is_banned',
+        'identity_mask',
+        'legal_deck_count',
+    ]
 
 
 class PrintingAdmin(admin.ModelAdmin):
@@ -49,6 +60,15 @@ class CommanderAdmin(admin.ModelAdmin):
     list_display = ('commander1', 'commander2')
     list_display_links = ('commander1', 'commander2')
     autocomplete_fields = ('commander1', 'commander2')
+    # computed by compute-commanders and the legality passes
+    readonly_fields = [
+        'identity_mask',
+        'legal_deck_count',
+        'deck_rank',
+        'color_rank',
+        'partner_rank',
+        'background_rank',
+    ]
     search_fields = [
         'commander1__name',
         'commander2__name',
@@ -63,6 +83,13 @@ class ThemeAdmin(admin.ModelAdmin):
         'slug': ('display_name',),
     }
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        changed = set(form.changed_data)
+        matching_changed = not change or bool(changed & {'filter_text', 'filter_type'})
+        if matching_changed or changed & {'card_threshold', 'deck_threshold'}:
+            refresh_theme(obj, matching_changed)
+
 
 class SynergyAdmin(admin.ModelAdmin):
     autocomplete_fields = ('card', 'commander')
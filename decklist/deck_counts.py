@@ -0,0 +1,177 @@
+"""Keeps per-commander and per-card deck counts current as decks change.
+
+Wrap any code that changes decks' legality, commander or card list in
+`track_legal_decks`, naming the decks it might touch. What each legal deck
+counted toward is noted before and after, and only the difference is
+applied to:
+
+- `Commander.legal_deck_count` and `Card.legal_deck_count`,
+- `CommanderCardCount`, how many of each commander's legal decks each card
+  appears in. Pairs whose count or commander total moved are marked
+  changed, so `compute-synergy --changed` knows what to refresh. A card's
+  score also weighs it against the decks of every commander it could go
+  with, so a moved total also marks every pair of each card whose
+  identity fits within that commander's.
+- `CommanderTheme`, how many of each commander's legal decks have each
+  theme, by way of the decks' recounted `DeckTheme` rows. These are marked
+  changed the same way, for `compute-themes`.
+
+The wrapped code may save decks as it goes, so whatever it changed is
+applied even if it raises partway. `recount_all` rebuilds everything from
+scratch.
+"""
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db.models import F
+
+from decklist.models import Card, CardInDeck, Commander, CommanderCardCount, CommanderTheme, Deck, DeckTheme
+from decklist.models.card import identity_subsets
+
+
+def _counted_commanders(deck_ids):
+    return Counter(
+        Deck.objects
+        .filter(id__in=deck_ids, pdh_legal=True, commander__isnull=False)
+        .values_list('commander_id', flat=True)
+    )
+
+
+def _counted_card_decks(deck_ids):
+    return Counter(
+        card_id
+        for _, card_id in (
+            CardInDeck.objects
+            .filter(deck_id__in=deck_ids, deck__pdh_legal=True)
+            .values_list('deck_id', 'card_id')
+            .distinct()
+        )
+    )
+
+
+def _counted_cards(deck_ids):
+    return Counter(
+        (commander_id, card_id)
+        for _, commander_id, card_id in (
+            CardInDeck.objects
+            .filter(deck_id__in=deck_ids, deck__pdh_legal=True, deck__commander__isnull=False)
+            .values_list('deck_id', 'deck__commander_id', 'card_id')
+            .distinct()
+        )
+    )
+
+
+def _counted_themes(deck_ids):
+    return Counter(
+        DeckTheme.objects
+        .filter(
+            deck_id__in=deck_ids,
+            deck__pdh_legal=True,
+            deck__commander__isnull=False,
+            count__gt=F('theme__card_threshold'),
+        )
+        .values_list('deck__commander_id', 'theme_id')
+    )
+
+
+def _adjust_counts(model, field, deltas, moved_commanders):
+    """Apply (commander, `field`) count deltas to `model`'s rows, marking
+    them changed, along with every row of a commander whose total moved."""
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if deltas:
+        existing = {
+            (row.commander_id, getattr(row, f'{field}_id')): row
+            for row in model.objects.filter(**{
+                'commander__in': {commander_id for commander_id, _ in deltas},
+                f'{field}__in': {other_id for _, other_id in deltas},
+            })
+        }
+        new_rows = []
+        changed_rows = []
+        for (commander_id, other_id), delta in deltas.items():
+            if row := existing.get((commander_id, other_id)):
+                # a row which drifted below zero gets fixed by recount_all
+                row.count = max(row.count + delta, 0)
+                row.changed = True
+                changed_rows.append(row)
+            elif delta > 0:
+                new_rows.append(model(**{
+                    'commander_id': commander_id,
+                    f'{field}_id': other_id,
+                    'count': delta,
+                }))
+        model.objects.bulk_create(new_rows)
+        model.objects.bulk_update(changed_rows, ['count', 'changed'])
+
+    # a commander's deck total feeds every one of its rows
+    if moved_commanders:
+        (
+            model.objects
+            .filter(commander__in=moved_commanders, changed=False)
+            .update(changed=True)
+        )
+
+
+def _mark_eligible_cards(moved_commanders):
+    "Mark changed every pair of each card which could go with a moved commander."
+    masks = set()
+    for mask in (
+        Commander.objects
+        .filter(id__in=moved_commanders)
+        .values_list('identity_mask', flat=True)
+        .distinct()
+    ):
+        masks.update(identity_subsets(mask))
+    if masks:
+        (
+            CommanderCardCount.objects
+            .filter(card__identity_mask__in=masks, changed=False)
+            .update(changed=True)
+        )
+
+
+@contextmanager
+def track_legal_decks(deck_ids):
+    deck_ids = list(deck_ids)
+    commanders_before = _counted_commanders(deck_ids)
+    card_decks_before = _counted_card_decks(deck_ids)
+    cards_before = _counted_cards(deck_ids)
+    themes_before = _counted_themes(deck_ids)
+    try:
+        yield
+    finally:
+        DeckTheme.objects.rebuild(deck_ids=deck_ids)
+        commanders_after = _counted_commanders(deck_ids)
+        card_decks_after = _counted_card_decks(deck_ids)
+        cards_after = _counted_cards(deck_ids)
+        themes_after = _counted_themes(deck_ids)
+
+        commander_deltas = Counter(commanders_after)
+        commander_deltas.subtract(commanders_before)
+        Commander.objects.adjust_deck_counts(commander_deltas)
+
+        card_deck_deltas = Counter(card_decks_after)
+        card_deck_deltas.subtract(card_decks_before)
+        Card.objects.adjust_deck_counts(card_deck_deltas)
+
+        moved_commanders = [
+            commander_id for commander_id, delta in commander_deltas.items() if delta
+        ]
+
+        card_deltas = Counter(cards_after)
+        card_deltas.subtract(cards_before)
+        _adjust_counts(CommanderCardCount, 'card', card_deltas, moved_commanders)
+        _mark_eligible_cards(moved_commanders)
+
+        theme_deltas = Counter(themes_after)
+        theme_deltas.subtract(themes_before)
+        _adjust_counts(CommanderTheme, 'theme', theme_deltas, moved_commanders)
+
+
+def recount_all():
+    "Recount all of the above from scratch."
+    Commander.objects.recount()
+    Card.objects.recount()
+    CommanderCardCount.objects.rebuild()
+    DeckTheme.objects.rebuild()
+    CommanderTheme.objects.rebuild()
@@ -0,0 +1,171 @@
+"""Checks PDH legality for many decks at once.
+
+`Deck.check_deck_legality` asks the database a handful of questions per
+deck. Here, two queries answer those questions for a whole batch of decks,
+reading the per-card facts stored on `Card`, and the same rules are
+applied to the answers in Python. The results, reason text included,
+match `check_deck_legality` exactly.
+"""
+from collections import defaultdict
+from typing import NamedTuple
+
+from django.db.models import Count, Q
+
+from decklist.models import CardInDeck, PartnerType
+
+
+ALL_COLORS = 0b11111
+
+BATCH_SIZE = 1000
+
+COMPATIBLE_PARTNERS = {
+    (PartnerType.PARTNER, PartnerType.PARTNER),
+    (PartnerType.CHOOSE_A_BACKGROUND, PartnerType.BACKGROUND),
+    (PartnerType.BACKGROUND, PartnerType.CHOOSE_A_BACKGROUND),
+}
+# compatible partnerships, as long as they're different cards
+PARTNER_WITH_TYPES = {
+    PartnerType.PARTNER_WITH_BLARING,
+    PartnerType.PARTNER_WITH_CHAKRAM,
+    PartnerType.PARTNER_WITH_PROTEGE,
+    PartnerType.PARTNER_WITH_SOULBLADE,
+    PartnerType.PARTNER_WITH_WEAVER,
+}
+
+
+class CommanderFacts(NamedTuple):
+    id: object
+    name: str
+    is_creature: bool
+    partner_type: int
+    identity: int
+    ever_uncommon: bool
+
+    def __str__(self):
+        return self.name
+
+
+class DeckFacts:
+    def __init__(self):
+        self.card_count = 0
+        self.banned_count = 0
+        self.noncommon_count = 0
+        # how many of the deck's cards have each color identity (as a mask)
+        self.identities = defaultdict(int)
+        self.commanders = []
+
+
+def _gather(deck_ids):
+    facts = defaultdict(DeckFacts)
+
+    # one row per deck per color identity
+    card_rows = (
+        CardInDeck.objects
+        .filter(deck_id__in=deck_ids)
+        .values('deck_id', 'card__identity_mask')
+        .annotate(
+            cards=Count('id'),
+            banned=Count('id', filter=Q(card__is_banned=True)),
+            noncommon=Count(
+                'id',
+                filter=Q(is_pdh_commander=False, card__ever_common=False),
+            ),
+        )
+        .order_by()
+    )
+    for row in card_rows:
+        deck = facts[row['deck_id']]
+        deck.card_count += row['cards']
+        deck.banned_count += row['banned']
+        deck.noncommon_count += row['noncommon']
+        deck.identities[row['card__identity_mask']] += row['cards']
+
+    commander_rows = (
+        CardInDeck.objects
+        .filter(deck_id__in=deck_ids, is_pdh_commander=True)
+        .order_by('deck_id', 'id')
+        .values_list(
+            'deck_id',
+            'card_id',
+            'card__name',
+            'card__is_creature',
+            'card__partner_type',
+            'card__identity_mask',
+            'card__ever_uncommon',
+        )
+    )
+    for deck_id, *commander in commander_rows:
+        facts[deck_id].commanders.append(CommanderFacts(*commander))
+
+    return facts
+
+
+def _check_commanders(commanders):
+    match commanders:
+        case (commander1,):
+            if not commander1.ever_uncommon:
+                return f"commander {commander1.name} not printed at uncommon"
+            if not commander1.is_creature:
+                return f"commander {commander1.name} is not a creature"
+
+        case (commander1, commander2):
+            if not commander1.ever_uncommon:
+                return f"commander {commander1.name} not printed at uncommon"
+            if not commander2.ever_uncommon:
+                return f"commander {commander2.name} not printed at uncommon"
+            if not (commander1.is_creature or commander2.is_creature):
+                return f"at least one commander must be a creature"
+
+            pair = (commander1.partner_type, commander2.partner_type)
+            if pair in COMPATIBLE_PARTNERS:
+                pass
+            elif pair[0] == pair[1] and pair[0] in PARTNER_WITH_TYPES:
+                if commander1.id == commander2.id:
+                    return f'invalid partnership: two copies of "{commander1}"'
+            else:
+                return f'invalid partnership: "{commander1}" and "{commander2}"'
+
+        case (commander1, commander2, *_):
+            return f"{len(commanders)} is too many commanders"
+
+        case _:
+            return "no commander"
+
+    return None
+
+
+def _check(deck):
+    if deck.card_count == 0:
+        return False, "no cards in deck"
+
+    if deck.banned_count > 0:
+        return False, "contains banned card"
+
+    if reason := _check_commanders(deck.commanders):
+        return False, reason
+
+    identity = 0
+    for commander in deck.commanders:
+        identity |= commander.identity
+    # 5-color decks exclude no cards
+    if identity != ALL_COLORS:
+        illegal_card_count = sum(
+            count for card_identity, count in deck.identities.items()
+            if card_identity & ~identity
+        )
+        if illegal_card_count > 0:
+            return False, f"{illegal_card_count} cards out of color identity"
+
+    if deck.noncommon_count > 0:
+        return False, "non-commander not printed at common"
+
+    return True, None
+
+
+def check_decks(deck_ids):
+    """Yields (deck_id, is_legal, reason) for each deck ID, just as
+    `Deck.check_deck_legality` would have answered."""
+    facts = _gather(deck_ids)
+    for deck_id in deck_ids:
+        yield (deck_id, *_check(facts[deck_id]))
+
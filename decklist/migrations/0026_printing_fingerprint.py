@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-17 17:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('decklist', '0025_alter_theme_filter_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='printing',
+            name='fingerprint',
+            field=models.CharField(blank=True, max_length=40),
+        ),
+    ]
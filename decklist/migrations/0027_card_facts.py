@@ -0,0 +1,72 @@
+# Generated by Django 5.1.15 on 2026-10-17 17:46
+
+from django.db import migrations, models
+
+
+# Mirrors CardQuerySet.refresh_facts() as of this migration; after this,
+# the card importer keeps the facts current.
+BACKFILL_SQL = """
+UPDATE decklist_card SET
+  ever_common = EXISTS (
+    SELECT 1 FROM decklist_printing
+    WHERE decklist_printing.card_id = decklist_card.id
+      AND decklist_printing.rarity = 'C'
+  ),
+  ever_uncommon = EXISTS (
+    SELECT 1 FROM decklist_printing
+    WHERE decklist_printing.card_id = decklist_card.id
+      AND decklist_printing.rarity = 'U'
+  ),
+  is_creature = type_line LIKE '%Creature%',
+  is_banned = name IN (
+    'Mystic Remora',
+    'Rhystic Study',
+    'Dryad Arbor',
+    'Pradesh Gypsies',
+    'Stone-Throwing Devils'
+  ),
+  identity_mask = (
+    identity_w::int * 1
+    + identity_u::int * 2
+    + identity_b::int * 4
+    + identity_r::int * 8
+    + identity_g::int * 16
+  )
+;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('decklist', '0026_printing_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='ever_common',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='ever_uncommon',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='identity_mask',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='is_banned',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='is_creature',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.15 on 2026-10-17 17:49
+
+from django.db import migrations, models
+
+
+# Mirrors CommanderQuerySet.refresh_identity() as of this migration.
+BACKFILL_SQL = """
+UPDATE decklist_commander SET identity_mask = (
+  SELECT c1.identity_mask | COALESCE(c2.identity_mask, 0)
+  FROM decklist_card c1
+  LEFT OUTER JOIN decklist_card c2 ON c2.id = decklist_commander.commander2_id
+  WHERE c1.id = decklist_commander.commander1_id
+);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('decklist', '0027_card_facts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commander',
+            name='identity_mask',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['identity_mask'], name='decklist_ca_identit_44fdfe_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commander',
+            index=models.Index(fields=['identity_mask'], name='decklist_co_identit_9d2ff8_idx'),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
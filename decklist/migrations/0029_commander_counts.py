@@ -0,0 +1,102 @@
+# Generated by Django 5.1.15 on 2026-10-17 17:52
+
+from django.db import migrations, models
+
+
+# Mirrors CommanderQuerySet.recount() as of this migration.
+BACKFILL_SQL = """
+UPDATE decklist_commander AS c
+SET legal_deck_count = (
+    SELECT COUNT(*) FROM decklist_deck AS d
+    WHERE d.commander_id = c.id AND d.pdh_legal
+);
+
+UPDATE decklist_commander AS cmdr
+SET deck_rank = ranked.deck_rank,
+    color_rank = ranked.color_rank,
+    partner_rank = ranked.partner_rank,
+    background_rank = ranked.background_rank
+FROM (
+    SELECT
+        id,
+        CASE WHEN counted THEN RANK() OVER (
+            ORDER BY legal_deck_count DESC
+        ) END AS deck_rank,
+        CASE WHEN counted THEN RANK() OVER (
+            PARTITION BY identity_mask ORDER BY legal_deck_count DESC
+        ) END AS color_rank,
+        CASE WHEN counted AND is_partner THEN RANK() OVER (
+            PARTITION BY is_partner ORDER BY legal_deck_count DESC
+        ) END AS partner_rank,
+        CASE WHEN counted AND is_background THEN RANK() OVER (
+            PARTITION BY is_background ORDER BY legal_deck_count DESC
+        ) END AS background_rank
+    FROM (
+        SELECT
+            c.id,
+            c.identity_mask,
+            c.legal_deck_count,
+            c.legal_deck_count > 0 AS counted,
+            (card1.partner_type IN (1, 100, 101, 102, 103, 104)
+                OR COALESCE(card2.partner_type IN (1, 100, 101, 102, 103, 104), FALSE)) AS is_partner,
+            (card1.partner_type = 11
+                OR COALESCE(card2.partner_type = 11, FALSE)) AS is_background
+        FROM decklist_commander AS c
+        JOIN decklist_card AS card1 ON card1.id = c.commander1_id
+        LEFT JOIN decklist_card AS card2 ON card2.id = c.commander2_id
+    ) AS facts
+) AS ranked
+WHERE cmdr.id = ranked.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('decklist', '0028_identity_masks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commander',
+            name='background_rank',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='commander',
+            name='color_rank',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='commander',
+            name='deck_rank',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='commander',
+            name='legal_deck_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='commander',
+            name='partner_rank',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='commander',
+            index=models.Index(fields=['deck_rank', 'id'], name='decklist_co_deck_ra_d74988_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commander',
+            index=models.Index(fields=['identity_mask', 'color_rank', 'id'], name='decklist_co_identit_9d1f03_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commander',
+            index=models.Index(fields=['partner_rank', 'id'], name='decklist_co_partner_b6f652_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commander',
+            index=models.Index(fields=['background_rank', 'id'], name='decklist_co_backgro_2bcdea_idx'),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
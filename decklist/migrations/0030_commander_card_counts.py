@@ -0,0 +1,40 @@
+# Generated by Django 5.1.15 on 2026-10-17 17:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Mirrors CommanderCardCountQuerySet.rebuild() as of this migration.
+BACKFILL_SQL = """
+INSERT INTO decklist_commandercardcount (commander_id, card_id, count, changed)
+SELECT deck.commander_id, card_in_deck.card_id, COUNT(DISTINCT deck.id), TRUE
+FROM decklist_cardindeck AS card_in_deck
+JOIN decklist_deck AS deck ON deck.id = card_in_deck.deck_id
+WHERE deck.pdh_legal AND deck.commander_id IS NOT NULL
+GROUP BY deck.commander_id, card_in_deck.card_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('decklist', '0029_commander_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommanderCardCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('changed', models.BooleanField(default=True)),
+                ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='commander_counts', to='decklist.card')),
+                ('commander', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='card_counts', to='decklist.commander')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('changed', True)), fields=['card'], name='commandercardcount_changed')],
+                'constraints': [models.UniqueConstraint(fields=('commander', 'card'), name='one_count_per_commander_card')],
+            },
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.15 on 2026-10-17 18:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('decklist', '0030_commander_card_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PackedSynergy',
+            fields=[
+                ('commander', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='packed_synergy', serialize=False, to='decklist.commander')),
+                ('card_ids', models.BinaryField()),
+                ('scores', models.BinaryField()),
+            ],
+        ),
+    ]
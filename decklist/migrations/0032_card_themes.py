@@ -0,0 +1,38 @@
+# Generated by Django 5.1.15 on 2026-10-17 18:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Mirrors CardThemeQuerySet's refresh as of this migration.
+BACKFILL_SQL = """
+INSERT INTO decklist_cardtheme (card_id, theme_id)
+SELECT card.id, theme.id
+FROM decklist_card AS card
+JOIN decklist_theme AS theme ON (
+    (theme.filter_type = 'T' AND STRPOS(card.type_line, theme.filter_text) > 0)
+    OR (theme.filter_type = 'K' AND card.keywords @> TO_JSONB(theme.filter_text))
+);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('decklist', '0031_packed_synergy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardTheme',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('card', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='theme_memberships', to='decklist.card')),
+                ('theme', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='card_memberships', to='decklist.theme')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('card', 'theme'), name='one_membership_per_card_theme')],
+            },
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
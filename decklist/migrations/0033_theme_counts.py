@@ -0,0 +1,62 @@
+# Generated by Django 5.1.15 on 2026-10-17 18:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Mirrors DeckThemeQuerySet.rebuild() and CommanderThemeQuerySet.rebuild()
+# as of this migration. Every commander is left marked changed, so the
+# next compute-themes rewrites all results from these counts.
+BACKFILL_SQL = """
+INSERT INTO decklist_decktheme (deck_id, theme_id, count)
+SELECT card_in_deck.deck_id, card_theme.theme_id, COUNT(*)
+FROM decklist_cardindeck AS card_in_deck
+JOIN decklist_cardtheme AS card_theme ON card_theme.card_id = card_in_deck.card_id
+GROUP BY card_in_deck.deck_id, card_theme.theme_id;
+
+INSERT INTO decklist_commandertheme (commander_id, theme_id, count, changed)
+SELECT deck.commander_id, deck_theme.theme_id, COUNT(*), TRUE
+FROM decklist_decktheme AS deck_theme
+JOIN decklist_deck AS deck ON deck.id = deck_theme.deck_id
+JOIN decklist_theme AS theme ON theme.id = deck_theme.theme_id
+WHERE deck.pdh_legal AND deck.commander_id IS NOT NULL
+    AND deck_theme.count > theme.card_threshold
+GROUP BY deck.commander_id, deck_theme.theme_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('decklist', '0032_card_themes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommanderTheme',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('changed', models.BooleanField(default=True)),
+                ('commander', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='theme_counts', to='decklist.commander')),
+                ('theme', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='commander_counts', to='decklist.theme')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('changed', True)), fields=['commander'], name='commandertheme_changed')],
+                'constraints': [models.UniqueConstraint(fields=('commander', 'theme'), name='one_count_per_commander_theme')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DeckTheme',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('deck', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='theme_counts', to='decklist.deck')),
+                ('theme', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deck_counts', to='decklist.theme')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('deck', 'theme'), name='one_count_per_deck_theme')],
+            },
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+    ]
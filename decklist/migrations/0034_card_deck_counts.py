@@ -0,0 +1,91 @@
+# Generated by Django 5.1.15 on 2026-10-17 18:11
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+
+top_card_views = import_module('decklist.migrations.0023_top_card_materialized_views')
+
+# Mirrors CardQuerySet.refresh_facts() and recount() as of this migration.
+BACKFILL_SQL = """
+UPDATE decklist_card SET is_land = type_line LIKE '%Land%';
+UPDATE decklist_card AS card
+SET legal_deck_count = counts.count
+FROM (
+    SELECT card_in_deck.card_id, COUNT(DISTINCT deck.id) AS count
+    FROM decklist_cardindeck AS card_in_deck
+    JOIN decklist_deck AS deck ON deck.id = card_in_deck.deck_id
+    WHERE deck.pdh_legal
+    GROUP BY card_in_deck.card_id
+) AS counts
+WHERE card.id = counts.card_id;
+"""
+
+DROP_SQL = """
+DROP MATERIALIZED VIEW decklist_topcardview;
+DROP MATERIALIZED VIEW decklist_toplandcardview;
+DROP MATERIALIZED VIEW decklist_topnonlandcardview;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('decklist', '0033_theme_counts'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            DROP_SQL,
+            [
+                top_card_views.TOP_CARDS_SQL,
+                top_card_views.TOP_LAND_CARDS_SQL,
+                top_card_views.TOP_NON_LAND_CARDS_SQL,
+            ],
+        ),
+        migrations.RemoveField(
+            model_name='topcardview',
+            name='card',
+        ),
+        migrations.RemoveField(
+            model_name='toplandcardview',
+            name='card',
+        ),
+        migrations.RemoveField(
+            model_name='topnonlandcardview',
+            name='card',
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='is_land',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='legal_deck_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['legal_deck_count'], name='decklist_ca_legal_d_c0646c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['is_land', 'legal_deck_count'], name='decklist_ca_is_land_4d7913_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['identity_mask', 'is_land', 'legal_deck_count'], name='decklist_ca_identit_b384fd_idx'),
+        ),
+        migrations.DeleteModel(
+            name='TopCardView',
+        ),
+        migrations.DeleteModel(
+            name='TopLandCardView',
+        ),
+        migrations.DeleteModel(
+            name='TopNonLandCardView',
+        ),
+    ]
@@ -8,12 +8,17 @@ class User(AbstractUser):
 from .datasource import DataSource
 from .partnertype import PartnerType
 from .deck import Deck
-from .card import Card, TopCardView, TopLandCardView, TopNonLandCardView
+from .card import Card
 from .printing import Printing
 from .cardindeck import CardInDeck
 from .sitestat import SiteStat
 from .commander import Commander
 from .theme import Theme
 from .themeresult import ThemeResult
+from .cardtheme import CardTheme
+from .decktheme import DeckTheme
+from .commandertheme import CommanderTheme
 from .synergyscore import SynergyScore
+from .commandercardcount import CommanderCardCount
+from .packedsynergy import PackedSynergy
 from .rarity import Rarity
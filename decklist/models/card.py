@@ -1,45 +1,81 @@
 from django.db import models
-from django.db.models import Count, F, Q, Window
+from django.db.models import (
+    BooleanField, Count, Exists, ExpressionWrapper, F, IntegerField,
+    OuterRef, Q, Subquery, Window,
+)
+from django.db.models.functions import Cast, Coalesce
 from django.db.models.functions import Rank
 from django.contrib.postgres.search import SearchVector
 from .partnertype import PartnerType
 from .rarity import Rarity
 
-import logging
-logger = logging.getLogger('decklist.models.card')
+
+BANNED_CARDS = (
+    # PDH ban list
+    'Mystic Remora',
+    'Rhystic Study',
+    # not strictly banned, but not allowed as commander
+    # and never printed at common
+    'Dryad Arbor',
+    # WotC inclusiveness bans ever printed at C or U
+    'Pradesh Gypsies',
+    'Stone-Throwing Devils',
+)
+
+# bits of Card.identity_mask (and Commander's)
+IDENTITY_BITS = {
+    'w': 1,
+    'u': 2,
+    'b': 4,
+    'r': 8,
+    'g': 16,
+}
+
+
+def identity_mask(w, u, b, r, g):
+    "Pack five color flags into an identity mask"
+    return sum(
+        bit for flag, bit in zip((w, u, b, r, g), IDENTITY_BITS.values())
+        if flag
+    )
+
+
+def identity_supersets(mask):
+    """Every identity mask with at least the colors in `mask`. Filtering
+    on `identity_mask__in` these can use an index where `mask & X = X`
+    can't."""
+    return [m for m in range(32) if m & mask == mask]
+
+
+def identity_subsets(mask):
+    "Every identity mask with no colors outside of `mask`"
+    return [m for m in range(32) if m | mask == mask]
 
 
 class CardQuerySet(models.QuerySet):
     def top_lands(self):
-        logger.warn("Called slow path: CardQuerySet::top_lands (use TopLandCardView instead)")
         return (
             self
-            .filter(type_line__contains='Land')
+            .filter(is_land=True)
             ._count_and_rank_decks()
         )
     
     def top_nonlands(self):
-        logger.warn("Called slow path: CardQuerySet::top_nonlands (use TopNonLandCardView instead)")
         return (
             self
-            .exclude(type_line__contains='Land')
+            .filter(is_land=False)
             ._count_and_rank_decks()
         )
     
     def top(self):
-        logger.warn("Called slow path: CardQuerySet::top (use TopCardView instead)")
         return self._count_and_rank_decks()
     
     def ranked_lands_of_color(self, w: bool, u: bool, b: bool, r: bool, g: bool):
         return (
             self
             .filter(
-                type_line__contains='Land',
-                identity_w=w,
-                identity_u=u,
-                identity_b=b,
-                identity_r=r,
-                identity_g=g,
+                is_land=True,
+                identity_mask=identity_mask(w, u, b, r, g),
             )
             ._count_and_rank_decks()
         )
@@ -47,31 +83,80 @@ class CardQuerySet(models.QuerySet):
     def ranked_cards_of_color(self, w: bool, u: bool, b: bool, r: bool, g: bool):
         return (
             self
-            .filter(
-                identity_w=w,
-                identity_u=u,
-                identity_b=b,
-                identity_r=r,
-                identity_g=g,
-            )
+            .filter(identity_mask=identity_mask(w, u, b, r, g))
             ._count_and_rank_decks()
         )
 
     def _count_and_rank_decks(self):
         return (
             self
-            .annotate(num_decks=Count(
-                'deck_list',
-                distinct=True,
-                filter=Q(deck_list__deck__pdh_legal=True),
-            ))
-            .filter(num_decks__gt=0)
-            .annotate(rank=Window(
-                expression=Rank(),
-                order_by=F('num_decks').desc(),
-            ))
+            .filter(legal_deck_count__gt=0)
+            .annotate(
+                num_decks=F('legal_deck_count'),
+                rank=Window(
+                    expression=Rank(),
+                    order_by=F('legal_deck_count').desc(),
+                ),
+            )
+            .order_by('-legal_deck_count', 'name')
         )
-    
+
+    def recount(self):
+        "Recompute `legal_deck_count` from scratch."
+        from .cardindeck import CardInDeck
+
+        legal_decks = (
+            CardInDeck.objects
+            .filter(card=OuterRef('pk'), deck__pdh_legal=True)
+            .order_by()
+            .values('card')
+            .annotate(count=Count('deck', distinct=True))
+            .values('count')
+        )
+        self.update(legal_deck_count=Coalesce(Subquery(legal_decks), 0))
+
+    def adjust_deck_counts(self, deltas):
+        "Apply a {card_id: change} mapping to `legal_deck_count`."
+        by_delta = {}
+        for card_id, delta in deltas.items():
+            if delta:
+                by_delta.setdefault(delta, []).append(card_id)
+        for delta, card_ids in by_delta.items():
+            (
+                self
+                .filter(id__in=card_ids)
+                .update(legal_deck_count=F('legal_deck_count') + delta)
+            )
+
+    def refresh_facts(self):
+        """Recompute the stored per-card facts (`ever_common` and friends)
+        from each card's printings and other fields."""
+        from .printing import Printing
+
+        def printed_at(rarity):
+            return Exists(Printing.objects.filter(card=OuterRef('pk'), rarity=rarity))
+
+        return self.update(
+            ever_common=printed_at(Rarity.COMMON),
+            ever_uncommon=printed_at(Rarity.UNCOMMON),
+            is_creature=ExpressionWrapper(
+                Q(type_line__contains='Creature'),
+                output_field=BooleanField(),
+            ),
+            is_land=ExpressionWrapper(
+                Q(type_line__contains='Land'),
+                output_field=BooleanField(),
+            ),
+            is_banned=ExpressionWrapper(
+                Q(name__in=BANNED_CARDS),
+                output_field=BooleanField(),
+            ),
+            identity_mask=sum(
+                Cast(f'identity_{c}', IntegerField()) * bit
+                for c, bit in IDENTITY_BITS.items()
+            ),
+        )
+
     def search(self, query):
         return (
             self
@@ -134,26 +219,35 @@ class Card(models.Model):
         default=PartnerType.NONE,
     )
 
+    # these fields are computed, not canonical data; the card importer
+    # keeps them current with CardQuerySet.refresh_facts()
+    ever_common = models.BooleanField(default=False)
+    ever_uncommon = models.BooleanField(default=False)
+    is_creature = models.BooleanField(default=False)
+    is_land = models.BooleanField(default=False)
+    is_banned = models.BooleanField(default=False)
+    # see IDENTITY_BITS
+    identity_mask = models.PositiveSmallIntegerField(default=0)
+    # how many legal decks the card is in; decklist.deck_counts keeps it
+    # current as decks change
+    legal_deck_count = models.PositiveIntegerField(default=0)
+
     def __str__(self):
         return self.name
+
+    class Meta:
+        indexes = (
+            models.Index(fields=('identity_mask',)),
+            models.Index(fields=('legal_deck_count',)),
+            models.Index(fields=('is_land', 'legal_deck_count')),
+            models.Index(fields=('identity_mask', 'is_land', 'legal_deck_count')),
+        )
     
     @property
     def color_identity(self):
         identity = [x for x in "wubrg" if getattr(self, f"identity_{x}")]
         return ''.join(identity).upper() if identity else 'C'
     
-    @property
-    def ever_common(self):
-        return self.printings.filter(
-            rarity=Rarity.COMMON
-        ).count() > 0
-    
-    @property
-    def ever_uncommon(self):
-        return self.printings.filter(
-            rarity=Rarity.UNCOMMON
-        ).count() > 0
-    
     @property
     def default_printing(self):
         if self.editorial_printing:
@@ -185,30 +279,3 @@ class Card(models.Model):
             )
             .count()
         )
-
-
-class CardView(models.Model):
-    card = models.OneToOneField(
-        Card,
-        on_delete=models.DO_NOTHING,
-        related_name='+',
-        primary_key=True,
-    )
-    num_decks = models.IntegerField()
-    rank = models.IntegerField()
-
-    class Meta:
-        managed = False
-        abstract = True
-        ordering = ['rank',]
-    
-    def __getattr__(self, name):
-        return getattr(self.card, name)
-
-    def __str__(self):
-        return f"{self.card.name} #{self.rank}"    
-
-
-class TopCardView(CardView): pass
-class TopLandCardView(CardView): pass
-class TopNonLandCardView(CardView): pass
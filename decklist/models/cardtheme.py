@@ -0,0 +1,73 @@
+from django.db import connection, models, transaction
+from .card import Card
+from .theme import Theme
+
+
+# Mirrors how themes have always matched cards: typal themes by substring
+# of the type line, keyword themes by one whole keyword.
+REFRESH_SQL = """
+DELETE FROM {card_theme} WHERE {column} = ANY(%(ids)s);
+INSERT INTO {card_theme} (card_id, theme_id)
+SELECT card.id, theme.id
+FROM {card} AS card
+JOIN {theme} AS theme ON (
+    (theme.filter_type = 'T' AND STRPOS(card.type_line, theme.filter_text) > 0)
+    OR (theme.filter_type = 'K' AND card.keywords @> TO_JSONB(theme.filter_text))
+)
+WHERE {source} = ANY(%(ids)s);
+"""
+
+
+class CardThemeQuerySet(models.QuerySet):
+    def refresh_cards(self, card_ids):
+        "Re-match these cards against every theme."
+        self._refresh('card_id', 'card.id', list(card_ids))
+
+    def refresh_themes(self, theme_ids):
+        "Re-match every card against these themes."
+        self._refresh('theme_id', 'theme.id', list(theme_ids))
+
+    def _refresh(self, column, source, ids):
+        if not ids:
+            return
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                REFRESH_SQL.format(
+                    card_theme=CardTheme._meta.db_table,
+                    card=Card._meta.db_table,
+                    theme=Theme._meta.db_table,
+                    column=column,
+                    source=source,
+                ),
+                {'ids': ids},
+            )
+
+
+class CardTheme(models.Model):
+    """A card which counts toward a theme.
+
+    Kept current by `fetch-cards` as cards change and by the admin as
+    themes do, so nothing else has to match type lines or keywords."""
+    objects = CardThemeQuerySet.as_manager()
+
+    card = models.ForeignKey(
+        Card,
+        on_delete=models.CASCADE,
+        related_name='theme_memberships',
+    )
+    theme = models.ForeignKey(
+        Theme,
+        on_delete=models.CASCADE,
+        related_name='card_memberships',
+    )
+
+    def __str__(self):
+        return f"{self.card} in {self.theme}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['card', 'theme'],
+                name='one_membership_per_card_theme',
+            ),
+        ]
@@ -1,14 +1,70 @@
 import uuid
-import functools
-import operator
-from django.db import models
-from django.db.models import Q, F, Count, Window, Subquery, OuterRef
-from django.db.models.functions import Rank
-from .card import Card
+from django.conf import settings
+from django.db import connection, models
+from django.db.models import Q, F, Count, Sum, Subquery, OuterRef
+from django.db.models.functions import Coalesce
+from .card import Card, IDENTITY_BITS, identity_mask, identity_supersets
 from .partnertype import PartnerType
+from .packedsynergy import PackedSynergy, PackedScoreOf
 from .synergyscore import SynergyScore
 
 
+PARTNER_TYPES = (
+    PartnerType.PARTNER,
+    PartnerType.PARTNER_WITH_BLARING,
+    PartnerType.PARTNER_WITH_CHAKRAM,
+    PartnerType.PARTNER_WITH_PROTEGE,
+    PartnerType.PARTNER_WITH_SOULBLADE,
+    PartnerType.PARTNER_WITH_WEAVER,
+)
+
+# Ranks are a RANK() over `legal_deck_count` in each slice the listing pages
+# show. Commanders without legal decks get no rank. Only rows whose ranks
+# moved are written.
+RERANK_SQL = """
+UPDATE {commander} AS cmdr
+SET deck_rank = ranked.deck_rank,
+    color_rank = ranked.color_rank,
+    partner_rank = ranked.partner_rank,
+    background_rank = ranked.background_rank
+FROM (
+    SELECT
+        id,
+        CASE WHEN counted THEN RANK() OVER (
+            ORDER BY legal_deck_count DESC
+        ) END AS deck_rank,
+        CASE WHEN counted THEN RANK() OVER (
+            PARTITION BY identity_mask ORDER BY legal_deck_count DESC
+        ) END AS color_rank,
+        CASE WHEN counted AND is_partner THEN RANK() OVER (
+            PARTITION BY is_partner ORDER BY legal_deck_count DESC
+        ) END AS partner_rank,
+        CASE WHEN counted AND is_background THEN RANK() OVER (
+            PARTITION BY is_background ORDER BY legal_deck_count DESC
+        ) END AS background_rank
+    FROM (
+        SELECT
+            c.id,
+            c.identity_mask,
+            c.legal_deck_count,
+            c.legal_deck_count > 0 AS counted,
+            (card1.partner_type = ANY(%(partner)s)
+                OR COALESCE(card2.partner_type = ANY(%(partner)s), FALSE)) AS is_partner,
+            (card1.partner_type = %(background)s
+                OR COALESCE(card2.partner_type = %(background)s, FALSE)) AS is_background
+        FROM {commander} AS c
+        JOIN {card} AS card1 ON card1.id = c.commander1_id
+        LEFT JOIN {card} AS card2 ON card2.id = c.commander2_id
+    ) AS facts
+) AS ranked
+WHERE cmdr.id = ranked.id
+    AND (cmdr.deck_rank IS DISTINCT FROM ranked.deck_rank
+        OR cmdr.color_rank IS DISTINCT FROM ranked.color_rank
+        OR cmdr.partner_rank IS DISTINCT FROM ranked.partner_rank
+        OR cmdr.background_rank IS DISTINCT FROM ranked.background_rank)
+"""
+
+
 class CommanderQuerySet(models.QuerySet):
     def legal_decks(self):
         return self.filter(decks__pdh_legal=True)
@@ -30,13 +86,20 @@ class CommanderQuerySet(models.QuerySet):
         )
     
     def for_card_in_99(self, card: Card):
-        synergy = (
-            SynergyScore.objects
-            .filter(
-                commander=OuterRef('pk'),
-                card=card,
+        if settings.SYNERGY_STORAGE == 'packed':
+            synergy = (
+                PackedSynergy.objects
+                .filter(commander=OuterRef('pk'))
+                .annotate(score=PackedScoreOf(card.id))
+            )
+        else:
+            synergy = (
+                SynergyScore.objects
+                .filter(
+                    commander=OuterRef('pk'),
+                    card=card,
+                )
             )
-        )
         return (
             Commander.objects
             .filter(
@@ -49,40 +112,30 @@ class CommanderQuerySet(models.QuerySet):
         )
     
     def top(self):
+        return self._ranked_by('deck_rank')
+
+    def ranked_of_color(self, w, u, b, r, g):
         return (
             self
-            .legal_decks()
-            .count_and_rank_decks()
+            .of_exact_color(w, u, b, r, g)
+            ._ranked_by('color_rank')
         )
 
+    def of_exact_color(self, w, u, b, r, g):
+        return self.filter(identity_mask=identity_mask(w, u, b, r, g))
+
+    def of_at_least_color(self, w, u, b, r, g):
+        return self.filter(identity_mask__in=identity_supersets(identity_mask(w, u, b, r, g)))
+
+    def legal_deck_total(self):
+        "How many legal decks these commanders lead, without joining to `Deck`."
+        return self.aggregate(total=Coalesce(Sum('legal_deck_count'), 0))['total']
+
     def decks_of_exact_color(self, w, u, b, r, g):
-        wubrg = {
-            'w': w,
-            'u': u,
-            'b': b,
-            'r': r,
-            'g': g,
-        }
-        filters = []
-        # for each color...
-        for c in 'wubrg':
-            cmdr1 = f'commander1__identity_{c}'
-            cmdr2 = f'commander2__identity_{c}'
-            # ... if we want the color, either partner can bring it
-            if wubrg[c]:
-                filters.append(Q(**dict([(cmdr1,True),])) | Q(**dict([(cmdr2,True),])))
-            # ... if we don't want the color, neither partner can bring it
-            # ... or else partner2 can be empty
-            else:
-                filters.append(
-                    Q(**dict([(cmdr1,False),])) & 
-                    (Q(commander2__isnull=True) | Q(**dict([(cmdr2,False),])))
-                )
-        
         return (
             self
             .legal_decks()
-            .filter(*filters)
+            .filter(identity_mask=identity_mask(w, u, b, r, g))
         )
 
     def decks_of_at_least_color(self, w, u, b, r, g):
@@ -90,77 +143,85 @@ class CommanderQuerySet(models.QuerySet):
         if not any([w, u, b, r, g]):
             return self.legal_decks()
 
-        # build up a filter for the aggregation
-        # that has a Q object set to True for each color we
-        # care about and nothing for the colors which we don't
-        wubrg = {
-            'w': w,
-            'u': u,
-            'b': b,
-            'r': r,
-            'g': g,
-        }
-        filters = []
-        for c in 'wubrg':
-            if wubrg[c]:
-                cmdr1 = f'commander1__identity_{c}'
-                cmdr2 = f'commander2__identity_{c}'
-                filters.append(Q(**dict([(cmdr1,True),])) | Q(**dict([(cmdr2,True),])))
-        filters = functools.reduce(operator.and_, filters)
-
         return (
             self
             .legal_decks()
-            .filter(filters)
-        )
-    
-    def count_and_rank_decks(self):
-        return (
-            self
-            .annotate(num_decks=Count('decks'))
-            .annotate(rank=Window(
-                expression=Rank(),
-                order_by=F('num_decks').desc(),
-            ))
+            .filter(identity_mask__in=identity_supersets(identity_mask(w, u, b, r, g)))
         )
 
-    def partner_pairs(self):
-        all_parters = [
-            PartnerType.PARTNER,
-            PartnerType.PARTNER_WITH_BLARING,
-            PartnerType.PARTNER_WITH_CHAKRAM,
-            PartnerType.PARTNER_WITH_PROTEGE,
-            PartnerType.PARTNER_WITH_SOULBLADE,
-            PartnerType.PARTNER_WITH_WEAVER,
-        ]
+    def refresh_identity(self):
+        """Recompute `identity_mask` from the commanders' cards, returning
+        how many changed."""
+        def card_mask(slot):
+            return Subquery(
+                Card.objects
+                .filter(pk=OuterRef(slot))
+                .values('identity_mask')
+            )
 
         return (
             self
-            .legal_decks()
-            .filter(
-                Q(commander1__partner_type__in=all_parters)
-                | Q(commander2__partner_type__in=all_parters)
-            )
-            .annotate(num_decks=Count('decks'))
-            .annotate(rank=Window(
-                expression=Rank(),
-                order_by=F('num_decks').desc(),
-            ))
+            .alias(fresh_mask=card_mask('commander1').bitor(Coalesce(card_mask('commander2'), 0)))
+            .exclude(identity_mask=F('fresh_mask'))
+            .update(identity_mask=F('fresh_mask'))
         )
     
+    def recount(self):
+        "Recompute `legal_deck_count` from scratch, then rerank."
+        from .deck import Deck
+
+        legal_decks = (
+            Deck.objects
+            .filter(commander=OuterRef('pk'), pdh_legal=True)
+            .order_by()
+            .values('commander')
+            .annotate(count=Count('id'))
+            .values('count')
+        )
+        self.update(legal_deck_count=Coalesce(Subquery(legal_decks), 0))
+        self.rerank()
+
+    def adjust_deck_counts(self, deltas):
+        "Apply a {commander_id: change} mapping to `legal_deck_count`, then rerank."
+        by_delta = {}
+        for commander_id, delta in deltas.items():
+            if delta:
+                by_delta.setdefault(delta, []).append(commander_id)
+        for delta, commander_ids in by_delta.items():
+            (
+                self
+                .filter(id__in=commander_ids)
+                .update(legal_deck_count=F('legal_deck_count') + delta)
+            )
+        if by_delta:
+            self.rerank()
+
+    def rerank(self):
+        "Recompute the stored ranks for every commander."
+        with connection.cursor() as cursor:
+            cursor.execute(
+                RERANK_SQL.format(
+                    commander=Commander._meta.db_table,
+                    card=Card._meta.db_table,
+                ),
+                {
+                    'partner': list(PARTNER_TYPES),
+                    'background': PartnerType.BACKGROUND,
+                },
+            )
+
+    def partner_pairs(self):
+        return self._ranked_by('partner_rank')
+
     def background_pairs(self):
+        return self._ranked_by('background_rank')
+
+    def _ranked_by(self, rank_field):
         return (
             self
-            .legal_decks()
-            .filter(
-                Q(commander1__partner_type=PartnerType.BACKGROUND)
-                | Q(commander2__partner_type=PartnerType.BACKGROUND)
-            )
-            .annotate(num_decks=Count('decks'))
-            .annotate(rank=Window(
-                expression=Rank(),
-                order_by=F('num_decks').desc(),
-            ))
+            .filter(**{f'{rank_field}__isnull': False})
+            .annotate(rank=F(rank_field), num_decks=F('legal_deck_count'))
+            .order_by(rank_field, 'id')
         )
 
 
@@ -181,8 +242,24 @@ class Commander(models.Model):
     )
     # sfid = SmallFormats identifier
     sfid = models.UUIDField(unique=True, verbose_name='SmallFormats ID')
+    # computed from the commanders' cards (see IDENTITY_BITS)
+    identity_mask = models.PositiveSmallIntegerField(default=0)
+    # kept current by compute-commanders and the legality passes (see
+    # decklist.deck_counts); ranks are set by CommanderQuerySet.rerank()
+    legal_deck_count = models.PositiveIntegerField(default=0)
+    deck_rank = models.PositiveIntegerField(null=True, blank=True)
+    color_rank = models.PositiveIntegerField(null=True, blank=True)
+    partner_rank = models.PositiveIntegerField(null=True, blank=True)
+    background_rank = models.PositiveIntegerField(null=True, blank=True)
 
     class Meta:
+        indexes = (
+            models.Index(fields=('identity_mask',)),
+            models.Index(fields=('deck_rank', 'id')),
+            models.Index(fields=('identity_mask', 'color_rank', 'id')),
+            models.Index(fields=('partner_rank', 'id')),
+            models.Index(fields=('background_rank', 'id')),
+        )
         constraints = [
             models.UniqueConstraint(
                 fields=['commander1', 'commander2'],
@@ -217,6 +294,7 @@ class Commander(models.Model):
     def save(self, *args, **kwargs):
         if not self.sfid:
             self.sfid = self._compute_sfid()
+        self.identity_mask = self._compute_identity_mask()
         super().save(*args, **kwargs)
 
     def clean(self):
@@ -226,15 +304,28 @@ class Commander(models.Model):
         # compute the SFID
         self.sfid = self._compute_sfid()
 
+    def _compute_identity_mask(self):
+        cards = [self.commander1, self.commander2] if self.commander2 else [self.commander1]
+        return identity_mask(*(
+            any(getattr(card, f"identity_{x}") for card in cards)
+            for x in "wubrg"
+        ))
+
     def _compute_sfid(self):
-        namespace = self.commander1.id
-        name = str(self.commander2.id) if self.commander2 else ''
-        return uuid.uuid5(namespace, name)
+        return self.sfid_for(
+            self.commander1.id,
+            self.commander2.id if self.commander2 else None,
+        )
+
+    @staticmethod
+    def sfid_for(commander1_id, commander2_id=None):
+        name = str(commander2_id) if commander2_id else ''
+        return uuid.uuid5(commander1_id, name)
 
     @property
     def color_identity(self):
         identity = [
-            x for x in "wubrg"
-            if getattr(self.commander1, f"identity_{x}") or (self.commander2 and getattr(self.commander2, f"identity_{x}"))
+            x for x, bit in IDENTITY_BITS.items()
+            if self.identity_mask & bit
         ]
         return ''.join(identity).upper() if identity else 'C'
@@ -0,0 +1,72 @@
+from django.db import connection, models
+from django.db.models import Q
+from .card import Card
+from .cardindeck import CardInDeck
+from .commander import Commander
+from .deck import Deck
+
+
+# Mirrors what decklist.deck_counts keeps up to date, one deck at a time.
+REBUILD_SQL = """
+DELETE FROM {counts};
+INSERT INTO {counts} (commander_id, card_id, count, changed)
+SELECT deck.commander_id, card_in_deck.card_id, COUNT(DISTINCT deck.id), TRUE
+FROM {card_in_deck} AS card_in_deck
+JOIN {deck} AS deck ON deck.id = card_in_deck.deck_id
+WHERE deck.pdh_legal AND deck.commander_id IS NOT NULL
+GROUP BY deck.commander_id, card_in_deck.card_id;
+"""
+
+
+class CommanderCardCountQuerySet(models.QuerySet):
+    def rebuild(self):
+        "Recount every (commander, card) pair from scratch, marking all as changed."
+        with connection.cursor() as cursor:
+            cursor.execute(REBUILD_SQL.format(
+                counts=CommanderCardCount._meta.db_table,
+                card_in_deck=CardInDeck._meta.db_table,
+                deck=Deck._meta.db_table,
+            ))
+
+    def changed(self):
+        return self.filter(changed=True)
+
+
+class CommanderCardCount(models.Model):
+    """How many of a commander's legal decks a card appears in.
+
+    `changed` marks pairs whose synergy score may be stale, either because
+    the count moved or because the commander's deck total did.
+    """
+    objects = CommanderCardCountQuerySet.as_manager()
+
+    commander = models.ForeignKey(
+        Commander,
+        on_delete=models.CASCADE,
+        related_name='card_counts',
+    )
+    card = models.ForeignKey(
+        Card,
+        on_delete=models.CASCADE,
+        related_name='commander_counts',
+    )
+    count = models.PositiveIntegerField(default=0)
+    changed = models.BooleanField(default=True)
+
+    def __str__(self):
+        return f"{self.card} in {self.count} {self.commander} decks"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['commander', 'card'],
+                name='one_count_per_commander_card',
+            ),
+        ]
+        indexes = (
+            models.Index(
+                fields=('card',),
+                condition=Q(changed=True),
+                name='commandercardcount_changed',
+            ),
+        )
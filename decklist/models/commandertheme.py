@@ -0,0 +1,90 @@
+from django.db import connection, models, transaction
+from django.db.models import Q
+from .commander import Commander
+from .deck import Deck
+from .decktheme import DeckTheme
+from .theme import Theme
+
+
+# Mirrors what decklist.deck_counts keeps up to date, one deck at a time.
+REBUILD_SQL = """
+DELETE FROM {counts} WHERE {scope};
+INSERT INTO {counts} (commander_id, theme_id, count, changed)
+SELECT deck.commander_id, deck_theme.theme_id, COUNT(*), TRUE
+FROM {deck_theme} AS deck_theme
+JOIN {deck} AS deck ON deck.id = deck_theme.deck_id
+JOIN {theme} AS theme ON theme.id = deck_theme.theme_id
+WHERE deck.pdh_legal AND deck.commander_id IS NOT NULL
+    AND deck_theme.count > theme.card_threshold
+    AND {source_scope}
+GROUP BY deck.commander_id, deck_theme.theme_id;
+"""
+
+
+class CommanderThemeQuerySet(models.QuerySet):
+    def rebuild(self, theme_ids=None):
+        """Recount every commander's themed decks from `DeckTheme`, limited
+        to `theme_ids` if given, marking all as changed."""
+        scope = 'TRUE'
+        source_scope = 'TRUE'
+        if theme_ids is not None:
+            theme_ids = list(theme_ids)
+            scope = 'theme_id = ANY(%(theme_ids)s)'
+            source_scope = 'deck_theme.theme_id = ANY(%(theme_ids)s)'
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                REBUILD_SQL.format(
+                    counts=CommanderTheme._meta.db_table,
+                    deck_theme=DeckTheme._meta.db_table,
+                    deck=Deck._meta.db_table,
+                    theme=Theme._meta.db_table,
+                    scope=scope,
+                    source_scope=source_scope,
+                ),
+                {'theme_ids': theme_ids},
+            )
+
+    def changed(self):
+        return self.filter(changed=True)
+
+
+class CommanderTheme(models.Model):
+    """How many of a commander's legal decks have a theme: more than the
+    theme's `card_threshold` of their cards belong to it.
+
+    `changed` marks commanders whose `ThemeResult`s may be stale, either
+    because the count moved or because the commander's deck total did.
+    """
+    objects = CommanderThemeQuerySet.as_manager()
+
+    commander = models.ForeignKey(
+        Commander,
+        on_delete=models.CASCADE,
+        related_name='theme_counts',
+    )
+    theme = models.ForeignKey(
+        Theme,
+        on_delete=models.CASCADE,
+        related_name='commander_counts',
+    )
+    count = models.PositiveIntegerField(default=0)
+    changed = models.BooleanField(default=True)
+
+    def __str__(self):
+        return f"{self.theme} in {self.count} {self.commander} decks"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['commander', 'theme'],
+                name='one_count_per_commander_theme',
+            ),
+        ]
+        indexes = (
+            models.Index(
+                fields=('commander',),
+                condition=Q(changed=True),
+                name='commandertheme_changed',
+            ),
+        )
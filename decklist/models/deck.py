@@ -1,11 +1,14 @@
-import operator
-import functools
+from django.contrib.postgres.aggregates import BitOr
 from django.db import models
-from django.db.models import Q, Count
+from django.db.models import Q
+from django.db.models.functions import Coalesce
 from django.utils import timezone
+from .card import IDENTITY_BITS, identity_subsets
 from .datasource import DataSource
 from .partnertype import PartnerType
-from .rarity import Rarity
+
+
+ALL_COLORS = sum(IDENTITY_BITS.values())
 
 
 class DeckQuerySet(models.QuerySet):
@@ -55,68 +58,35 @@ class Deck(models.Model):
             .select_related('card')
         )
     
-    def identity(self):
-        cmdr_identities = (
+    def commander_identity_mask(self):
+        "Color identity of the deck's commander cards, as a mask"
+        return (
             self.card_list
             .filter(is_pdh_commander=True)
-            .select_related('card')
-            .aggregate(
-                white=models.Count('card', filter=Q(card__identity_w=True)),
-                blue= models.Count('card', filter=Q(card__identity_u=True)),
-                black=models.Count('card', filter=Q(card__identity_b=True)),
-                red=  models.Count('card', filter=Q(card__identity_r=True)),
-                green=models.Count('card', filter=Q(card__identity_g=True)),
-            )
-        )
+            .aggregate(mask=Coalesce(BitOr('card__identity_mask'), 0))
+        )['mask']
 
+    def identity(self):
+        mask = self.commander_identity_mask()
         return {
-            k: v > 0 for k, v in cmdr_identities.items()
+            name: bool(mask & IDENTITY_BITS[c])
+            for c, name in zip('wubrg', ('white', 'blue', 'black', 'red', 'green'))
         }
     
     def identity_w(self):
-        return (
-            self.card_list
-            .select_related('card')
-            .filter(is_pdh_commander=True)
-            .filter(card__identity_w=True)
-            .count() > 0
-        )
+        return bool(self.commander_identity_mask() & IDENTITY_BITS['w'])
     
     def identity_u(self):
-        return (
-            self.card_list
-            .select_related('card')
-            .filter(is_pdh_commander=True)
-            .filter(card__identity_u=True)
-            .count() > 0
-        )
+        return bool(self.commander_identity_mask() & IDENTITY_BITS['u'])
     
     def identity_b(self):
-        return (
-            self.card_list
-            .select_related('card')
-            .filter(is_pdh_commander=True)
-            .filter(card__identity_b=True)
-            .count() > 0
-        )
+        return bool(self.commander_identity_mask() & IDENTITY_BITS['b'])
     
     def identity_r(self):
-        return (
-            self.card_list
-            .select_related('card')
-            .filter(is_pdh_commander=True)
-            .filter(card__identity_r=True)
-            .count() > 0
-        )
+        return bool(self.commander_identity_mask() & IDENTITY_BITS['r'])
     
     def identity_g(self):
-        return (
-            self.card_list
-            .select_related('card')
-            .filter(is_pdh_commander=True)
-            .filter(card__identity_g=True)
-            .count() > 0
-        )
+        return bool(self.commander_identity_mask() & IDENTITY_BITS['g'])
     
     def check_deck_legality(self):
         # deck has cards at all
@@ -127,17 +97,7 @@ class Deck(models.Model):
         # check the ban list
         if (
             self.card_list
-            .filter(
-                # PDH ban list
-                Q(card__name='Mystic Remora')
-                | Q(card__name='Rhystic Study')
-                # not strictly banned, but not allowed as commander
-                # and never printed at common
-                | Q(card__name='Dryad Arbor')
-                # WotC inclusiveness bans ever printed at C or U
-                | Q(card__name='Pradesh Gypsies')
-                | Q(card__name='Stone-Throwing Devils')
-            )
+            .filter(card__is_banned=True)
             .count()
         ) > 0:
             return False, "contains banned card"
@@ -148,7 +108,7 @@ class Deck(models.Model):
             case (commander1,):
                 if not commander1.card.ever_uncommon:
                     return False, f"commander {commander1.card.name} not printed at uncommon"
-                if not 'Creature' in commander1.card.type_line:
+                if not commander1.card.is_creature:
                     return False, f"commander {commander1.card.name} is not a creature"
             
             case (commander1, commander2):
@@ -156,7 +116,7 @@ class Deck(models.Model):
                     return False, f"commander {commander1.card.name} not printed at uncommon"
                 if not commander2.card.ever_uncommon:
                     return False, f"commander {commander2.card.name} not printed at uncommon"
-                if not ('Creature' in commander1.card.type_line or 'Creature' in commander2.card.type_line):
+                if not (commander1.card.is_creature or commander2.card.is_creature):
                     return False, f"at least one commander must be a creature"
                 
                 match (commander1.card.partner_type, commander2.card.partner_type):
@@ -185,28 +145,15 @@ class Deck(models.Model):
                 return False, "no commander"
 
         # all cards in correct identity
-        q_filters = []
-        identity = self.identity()
+        identity = self.commander_identity_mask()
 
-        if all([val for _, val in identity.items()]):
+        if identity == ALL_COLORS:
             # 5-color decks exclude no cards
             pass
         else:
-            if not identity['white']:
-                q_filters.append(Q(card__identity_w=True))
-            if not identity['blue']:
-                q_filters.append(Q(card__identity_u=True))
-            if not identity['black']:
-                q_filters.append(Q(card__identity_b=True))
-            if not identity['red']:
-                q_filters.append(Q(card__identity_r=True))
-            if not identity['green']:
-                q_filters.append(Q(card__identity_g=True))
-            filterset = functools.reduce(operator.or_, q_filters)
-
             illegal_card_count = (
                 self.card_list
-                .filter(filterset)
+                .exclude(card__identity_mask__in=identity_subsets(identity))
                 .count()
             )
             if illegal_card_count > 0:
@@ -215,13 +162,7 @@ class Deck(models.Model):
         # all other cards printed at common
         noncommon_count = (
             self.card_list
-            .select_related('card')
-            .filter(is_pdh_commander=False)
-            .annotate(common_count=Count(
-                'card__printings',
-                filter=Q(card__printings__rarity=Rarity.COMMON)
-            ))
-            .filter(common_count=0)
+            .filter(is_pdh_commander=False, card__ever_common=False)
             .count()
         )
         if noncommon_count > 0:
@@ -0,0 +1,72 @@
+from django.db import connection, models, transaction
+from .cardindeck import CardInDeck
+from .cardtheme import CardTheme
+from .deck import Deck
+from .theme import Theme
+
+
+REBUILD_SQL = """
+DELETE FROM {deck_theme} WHERE {scope};
+INSERT INTO {deck_theme} (deck_id, theme_id, count)
+SELECT card_in_deck.deck_id, card_theme.theme_id, COUNT(*)
+FROM {card_in_deck} AS card_in_deck
+JOIN {card_theme} AS card_theme ON card_theme.card_id = card_in_deck.card_id
+WHERE {source_scope}
+GROUP BY card_in_deck.deck_id, card_theme.theme_id;
+"""
+
+
+class DeckThemeQuerySet(models.QuerySet):
+    def rebuild(self, deck_ids=None, theme_ids=None):
+        """Recount how many of each deck's cards belong to each theme,
+        limited to `deck_ids` and/or `theme_ids` if given."""
+        scope = ['TRUE']
+        source_scope = ['TRUE']
+        if deck_ids is not None:
+            deck_ids = list(deck_ids)
+            scope.append('deck_id = ANY(%(deck_ids)s)')
+            source_scope.append('card_in_deck.deck_id = ANY(%(deck_ids)s)')
+        if theme_ids is not None:
+            theme_ids = list(theme_ids)
+            scope.append('theme_id = ANY(%(theme_ids)s)')
+            source_scope.append('card_theme.theme_id = ANY(%(theme_ids)s)')
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                REBUILD_SQL.format(
+                    deck_theme=DeckTheme._meta.db_table,
+                    card_in_deck=CardInDeck._meta.db_table,
+                    card_theme=CardTheme._meta.db_table,
+                    scope=' AND '.join(scope),
+                    source_scope=' AND '.join(source_scope),
+                ),
+                {'deck_ids': deck_ids, 'theme_ids': theme_ids},
+            )
+
+
+class DeckTheme(models.Model):
+    "How many of a deck's cards belong to a theme, for themes it has any of."
+    objects = DeckThemeQuerySet.as_manager()
+
+    deck = models.ForeignKey(
+        Deck,
+        on_delete=models.CASCADE,
+        related_name='theme_counts',
+    )
+    theme = models.ForeignKey(
+        Theme,
+        on_delete=models.CASCADE,
+        related_name='deck_counts',
+    )
+    count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.count} {self.theme} cards in {self.deck}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['deck', 'theme'],
+                name='one_count_per_deck_theme',
+            ),
+        ]
@@ -0,0 +1,168 @@
+import math
+from array import array
+from collections.abc import Sequence
+from typing import NamedTuple
+from uuid import UUID
+
+from django.db import models
+from django.db.models import F, Func, Value
+from .card import Card
+
+
+# Synergy scores are rounded to two places and fall in [-1, 1], so a
+# signed byte holds them exactly once scaled up.
+SCORE_SCALE = 100
+NAN_SCORE = -128
+CARD_ID_SIZE = 16
+
+
+def encode_score(score):
+    if math.isnan(score):
+        return NAN_SCORE
+    return round(score * SCORE_SCALE)
+
+
+def decode_score(code):
+    if code == NAN_SCORE:
+        return float('nan')
+    return code / SCORE_SCALE
+
+
+def _rank_key(item):
+    card_id, code = item
+    # best first, with NaN at the top the way Postgres sorts it
+    return (code != NAN_SCORE, -code, card_id.bytes)
+
+
+def pack_scores(codes):
+    "Pack a {card_id: encoded score} mapping into (card_ids, scores) bytes, best first."
+    ordered = sorted(codes.items(), key=_rank_key)
+    return (
+        b''.join(card_id.bytes for card_id, _ in ordered),
+        array('b', (code for _, code in ordered)).tobytes(),
+    )
+
+
+def unpack_scores(card_ids, scores):
+    "The (card_id, encoded score) pairs in a packed row, best first."
+    card_ids = bytes(card_ids)
+    codes = array('b')
+    codes.frombytes(bytes(scores))
+    return [
+        (UUID(bytes=card_ids[i * CARD_ID_SIZE:(i + 1) * CARD_ID_SIZE]), code)
+        for i, code in enumerate(codes)
+    ]
+
+
+class RankedScore(NamedTuple):
+    rank: int
+    card: Card
+    score: float
+
+
+class RankedScores(Sequence):
+    """A commander's packed scores as a list `Paginator` can page through.
+    Cards are only loaded for the slice being shown."""
+
+    def __init__(self, pairs):
+        self._pairs = pairs
+        self._ranks = []
+        for i, (_, code) in enumerate(pairs):
+            if i > 0 and code == pairs[i - 1][1]:
+                self._ranks.append(self._ranks[-1])
+            else:
+                self._ranks.append(i + 1)
+
+    def __len__(self):
+        return len(self._pairs)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1 or None][0]
+
+        pairs = self._pairs[index]
+        ranks = self._ranks[index]
+        cards = Card.objects.in_bulk([card_id for card_id, _ in pairs])
+        return [
+            RankedScore(rank, cards[card_id], decode_score(code))
+            for rank, (card_id, code) in zip(ranks, pairs)
+        ]
+
+
+class PackedScoreOf(Func):
+    """The score a packed row holds for one card, or NULL.
+
+    A 16-byte match which doesn't start on a card boundary can't be one of
+    our IDs, and is treated as not found."""
+    output_field = models.FloatField()
+
+    def __init__(self, card_id):
+        super().__init__(
+            Value(card_id.bytes, output_field=models.BinaryField()),
+            F('card_ids'),
+            F('scores'),
+        )
+
+    def as_sql(self, compiler, connection, **extra_context):
+        (needle, needle_params), (card_ids, card_params), (scores, score_params) = (
+            compiler.compile(expression)
+            for expression in self.get_source_expressions()
+        )
+        sql = f"""(
+            SELECT CASE
+                WHEN found.code IS NULL THEN NULL
+                WHEN found.code = 128 THEN 'NaN'::float8
+                WHEN found.code > 127 THEN (found.code - 256)::float8 / {SCORE_SCALE}
+                ELSE found.code::float8 / {SCORE_SCALE}
+            END
+            FROM (
+                SELECT CASE WHEN pos.n > 0 AND MOD(pos.n - 1, {CARD_ID_SIZE}) = 0
+                    THEN GET_BYTE({scores}, (pos.n - 1) / {CARD_ID_SIZE})
+                END AS code
+                FROM (SELECT POSITION({needle} IN {card_ids}) AS n) AS pos
+            ) AS found
+        )"""
+        return sql, (*score_params, *needle_params, *card_params)
+
+
+class PackedSynergyQuerySet(models.QuerySet):
+    def ranked_for(self, commander):
+        try:
+            row = self.get(commander=commander)
+        except PackedSynergy.DoesNotExist:
+            return RankedScores([])
+        return RankedScores(row.unpack())
+
+    def score_for(self, commander, card):
+        return (
+            self
+            .filter(commander=commander)
+            .annotate(score=PackedScoreOf(card.id))
+            .values_list('score', flat=True)
+            .first()
+        )
+
+
+class PackedSynergy(models.Model):
+    """All of a commander's synergy scores in one row: `card_ids` holds
+    16-byte card IDs back to back, and `scores` one signed byte per card
+    (see SCORE_SCALE), ordered best first.
+
+    Used instead of `SynergyScore` when settings.SYNERGY_STORAGE is
+    'packed'."""
+    objects = PackedSynergyQuerySet.as_manager()
+
+    commander = models.OneToOneField(
+        'Commander',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='packed_synergy',
+    )
+    card_ids = models.BinaryField()
+    scores = models.BinaryField()
+
+    def __str__(self):
+        return f"{len(self.scores)} scores for {self.commander}"
+
+    def unpack(self):
+        return unpack_scores(self.card_ids, self.scores)
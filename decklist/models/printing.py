@@ -19,6 +19,9 @@ class Printing(models.Model):
     is_highres = models.BooleanField(default=True)
     is_paper = models.BooleanField(default=False)
     release_date = models.DateField(default=datetime.date(1993, 8, 5))
+    # hash of the Scryfall data this printing was built from, so the
+    # card importer can skip printings which haven't changed
+    fingerprint = models.CharField(max_length=40, blank=True)
 
     def __str__(self):
         return f"{self.card.name} ({self.set_code})"
@@ -1,8 +1,24 @@
-from django.db import models
+from django.db import connection, models, transaction
 from django.db.models import F, Window
 from django.db.models.functions import Rank
 from .theme import Theme
 from .commander import Commander
+from .commandertheme import CommanderTheme
+
+
+# A commander has a theme when more than one of its legal decks do, and at
+# least `deck_threshold` percent of them.
+REFRESH_SQL = """
+DELETE FROM {results} WHERE {scope};
+INSERT INTO {results} (theme_id, commander_id, theme_deck_count, total_deck_count)
+SELECT counts.theme_id, counts.commander_id, counts.count, commander.legal_deck_count
+FROM {counts} AS counts
+JOIN {commander} AS commander ON commander.id = counts.commander_id
+JOIN {theme} AS theme ON theme.id = counts.theme_id
+WHERE counts.count > 1
+    AND counts.count >= commander.legal_deck_count * (theme.deck_threshold / 100.0)
+    AND {source_scope};
+"""
 
 
 class ThemeResultQuerySet(models.QuerySet):
@@ -15,6 +31,33 @@ class ThemeResultQuerySet(models.QuerySet):
             ))
         )
 
+    def refresh(self, commander_ids=None, theme_ids=None):
+        """Rewrite results from the `CommanderTheme` counts, limited to
+        `commander_ids` and/or `theme_ids` if given."""
+        scope = ['TRUE']
+        source_scope = ['TRUE']
+        if commander_ids is not None:
+            commander_ids = list(commander_ids)
+            scope.append('commander_id = ANY(%(commander_ids)s)')
+            source_scope.append('counts.commander_id = ANY(%(commander_ids)s)')
+        if theme_ids is not None:
+            theme_ids = list(theme_ids)
+            scope.append('theme_id = ANY(%(theme_ids)s)')
+            source_scope.append('counts.theme_id = ANY(%(theme_ids)s)')
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                REFRESH_SQL.format(
+                    results=ThemeResult._meta.db_table,
+                    counts=CommanderTheme._meta.db_table,
+                    commander=Commander._meta.db_table,
+                    theme=Theme._meta.db_table,
+                    scope=' AND '.join(scope),
+                    source_scope=' AND '.join(source_scope),
+                ),
+                {'commander_ids': commander_ids, 'theme_ids': theme_ids},
+            )
+
 
 class ThemeResult(models.Model):
     objects = ThemeResultQuerySet.as_manager()
@@ -1,4 +1,7 @@
-from decklist.models import Commander, Card, Deck
+from collections import defaultdict
+from itertools import groupby
+from decklist.models import Commander, CommanderCardCount, Card, Deck
+from decklist.models.card import identity_supersets
 from django.db.models import Count, Q, FloatField
 from django.db.models.functions import Cast
 
@@ -119,3 +122,82 @@ def compute_synergy_bulk(card: Card) -> list[tuple[Commander, float]]:
         ))
         for cmdr in with_each_commander
     ]
+
+
+def compute_synergy_all(cards=None, commander_ids=None):
+    """Compute what `compute_synergy_bulk` would for every card at once.
+
+    Rather than two aggregate queries per card, this reads the maintained
+    counts: how many of each commander's legal decks every card appears in
+    (`CommanderCardCount`) and each commander's legal deck total. The rest
+    is arithmetic.
+
+    Yields (card_id, [(commander_id, score), ...]) ordered by card, limited
+    to `cards` (a Card queryset) and scores for `commander_ids` if given.
+    """
+    if commander_ids is not None:
+        commander_ids = set(commander_ids)
+
+    commanders = {}
+    totals_by_mask = defaultdict(int)
+    # commanders led by each card, whose decks don't count against it
+    led_by = defaultdict(list)
+    for cmdr_id, commander1, commander2, mask, total in (
+        Commander.objects
+        .filter(legal_deck_count__gt=0)
+        .values_list('id', 'commander1_id', 'commander2_id', 'identity_mask', 'legal_deck_count')
+    ):
+        commanders[cmdr_id] = (mask, total)
+        totals_by_mask[mask] += total
+        led_by[commander1].append(cmdr_id)
+        if commander2:
+            led_by[commander2].append(cmdr_id)
+
+    appearances = (
+        CommanderCardCount.objects
+        .filter(count__gt=0, commander__legal_deck_count__gt=0)
+        .order_by('card_id')
+        .values_list('card_id', 'card__identity_mask', 'commander_id', 'count')
+    )
+    if cards is not None:
+        appearances = appearances.filter(card__in=cards)
+
+    for card_id, rows in groupby(appearances.iterator(), key=lambda row: row[0]):
+        rows = list(rows)
+        card_mask = rows[0][1]
+        eligible = set(identity_supersets(card_mask))
+        excluded = set(led_by[card_id])
+
+        with_each_commander = [
+            (cmdr_id, appears)
+            for _, _, cmdr_id, appears in rows
+            if cmdr_id not in excluded and commanders[cmdr_id][0] in eligible
+        ]
+        if not with_each_commander:
+            continue
+
+        appears = float(sum(a for _, a in with_each_commander))
+        total = float(
+            sum(totals_by_mask[mask] for mask in eligible)
+            - sum(
+                commanders[cmdr_id][1] for cmdr_id in excluded
+                if commanders.get(cmdr_id, (None,))[0] in eligible
+            )
+        )
+
+        scores = []
+        for cmdr_id, cmdr_appears in with_each_commander:
+            # every commander's decks still count toward the card's total
+            if commander_ids is not None and cmdr_id not in commander_ids:
+                continue
+            cmdr_total = commanders[cmdr_id][1]
+            others = total - cmdr_total
+            # same formula as compute_synergy_bulk; where that one would
+            # divide by zero, call the score nonsense instead
+            scores.append((cmdr_id, round(
+                (cmdr_appears / cmdr_total) - ((appears - cmdr_appears) / others),
+                ndigits=2,
+            ) if others else float('nan')))
+
+        if scores:
+            yield card_id, scores
@@ -0,0 +1,31 @@
+from uuid import uuid4
+
+from decklist.models import Card, PartnerType, Printing
+
+
+def make_card(
+    name,
+    colors='',
+    type_line='Legendary Creature',
+    partner_type=PartnerType.NONE,
+    keywords=(),
+    rarities=(),
+):
+    """Create a card for tests, with a printing at each of `rarities` and
+    its stored facts (`identity_mask` and friends) already refreshed.
+
+    `colors` is a string of color letters, like 'ug'."""
+    card = Card.objects.create(
+        id=uuid4(),
+        name=name,
+        type_line=type_line,
+        partner_type=partner_type,
+        keywords=list(keywords),
+        scryfall_uri='https://example.com/',
+        **{f'identity_{color}': True for color in colors},
+    )
+    for rarity in rarities:
+        Printing.objects.create(id=uuid4(), card=card, set_code='tst', rarity=rarity)
+    Card.objects.filter(id=card.id).refresh_facts()
+    card.refresh_from_db()
+    return card
@@ -1,9 +1,15 @@
-from uuid import UUID, uuid4
+import random
+from uuid import UUID
 from warnings import filterwarnings
 from django.core.paginator import UnorderedObjectListWarning
 from django.test import TestCase, Client
-from .models import SynergyScore, Card, Commander, Deck, CardInDeck
-import logging
+from .models import SynergyScore, Card, Commander, CommanderCardCount, Deck, CardInDeck, PackedSynergy, PartnerType, Rarity
+from .legality import check_decks
+from .deck_counts import recount_all, track_legal_decks
+from .synergy import compute_synergy_all, compute_synergy_bulk
+from .models.card import identity_supersets
+from .models.packedsynergy import encode_score, pack_scores
+from .test_helpers import make_card
 
 
 class SynergyForCommanderTestCase(TestCase):
@@ -87,72 +93,392 @@ class SynergyForCommanderTestCase(TestCase):
         self.assertEqual(len(scores), 1)
         self.assertEqual(scores[0].card.id, SynergyForCommanderTestCase.ATLAS_CARD)
 
+    def test_commander_synergy_packed(self):
+        for commander in Commander.objects.all():
+            card_ids, scores = pack_scores({
+                s.card_id: encode_score(s.score)
+                for s in SynergyScore.objects.filter(commander=commander)
+            })
+            PackedSynergy.objects.create(commander=commander, card_ids=card_ids, scores=scores)
 
-# We have several materialized views which are only used on Postgres.
-# Since they have to be updated manually, we should watch for changes
-# to the query they're generated from.
-class EnsureTopCardViewsMatchQueryTestCase(TestCase):
+        c = Client()
+        with self.settings(SYNERGY_STORAGE='packed'):
+            response = c.get(f'/cmdr/{SynergyForCommanderTestCase.TATYOVA_CMDR}/synergy')
+        scores = response.context['scores']
+        self.assertEqual(len(scores), 2)
+        self.assertEqual(scores[0].card.id, SynergyForCommanderTestCase.LLANOWAR_CARD)
+        self.assertEqual(scores[0].score, 1.0)
+        self.assertEqual(scores[1].card.id, SynergyForCommanderTestCase.ATLAS_CARD)
+
+
+class TopCardCountsTestCase(TestCase):
+    def setUp(self):
+        self.artifact = make_card('Some Card', type_line='Artifact')
+        self.land = make_card('Some Other Card', type_line='Land')
+        self.creature = make_card('Some Creature', type_line='Artifact Creature')
+
+        self.decks = []
+        for i, (legal, cards) in enumerate([
+            (True, [self.artifact, self.land]),
+            (True, [self.artifact]),
+            (False, [self.artifact, self.creature]),
+        ]):
+            deck = Deck.objects.create(name=f'Deck {i}', source=0, source_id=str(i), pdh_legal=legal)
+            for c in cards:
+                CardInDeck.objects.create(card=c, deck=deck)
+            self.decks.append(deck)
+        Card.objects.recount()
+
+    def _ranks(self, qs):
+        return [(c.name, c.num_decks, c.rank) for c in qs]
+
+    def test_ranked(self):
+        self.assertEqual(self._ranks(Card.objects.top()), [
+            ('Some Card', 2, 1),
+            ('Some Other Card', 1, 2),
+        ])
+        self.assertEqual(self._ranks(Card.objects.top_lands()), [
+            ('Some Other Card', 1, 1),
+        ])
+        self.assertEqual(self._ranks(Card.objects.top_nonlands()), [
+            ('Some Card', 2, 1),
+        ])
+        self.assertEqual(self._ranks(Card.objects.ranked_cards_of_color(False, False, False, False, False)), [
+            ('Some Card', 2, 1),
+            ('Some Other Card', 1, 2),
+        ])
+
+    def test_tracked_matches_recount(self):
+        with track_legal_decks(d.id for d in self.decks):
+            Deck.objects.filter(id=self.decks[2].id).update(pdh_legal=True)
+            Deck.objects.filter(id=self.decks[1].id).update(pdh_legal=False)
+            CardInDeck.objects.create(card=self.land, deck=self.decks[1])
+            CardInDeck.objects.create(card=self.creature, deck=self.decks[0])
+
+        tracked = dict(Card.objects.values_list('name', 'legal_deck_count'))
+        self.assertEqual(tracked, {
+            'Some Card': 2,
+            'Some Other Card': 1,
+            'Some Creature': 2,
+        })
+        Card.objects.recount()
+        self.assertEqual(dict(Card.objects.values_list('name', 'legal_deck_count')), tracked)
+
+
+class LegalityEngineTestCase(TestCase):
     @classmethod
-    def setUpTestData(self):
-        card1 = Card.objects.create(
-            id=uuid4(),
-            name='Some Card',
-            type_line='Artifact',
-            scryfall_uri='https://example.com/',
-        )
-        card2 = Card.objects.create(
-            id=uuid4(),
-            name='Some Other Card',
-            type_line='Land',
-            scryfall_uri='https://example.com/',
-        )
-        deck = Deck.objects.create(
-            name='A Deck',
-            source=0, # unknown/other
-            pdh_legal=True,
-        )
-        CardInDeck.objects.create(
-            card=card1,
-            deck=deck,
-        )
-        CardInDeck.objects.create(
-            card=card2,
-            deck=deck,
-        )
-
-    def _test_qs(self, qs):
-        with self.assertLogs('decklist.models.card', logging.WARNING):
-            # we expect to get a logging message about the "slow path"
-            values = qs().values()[0]
-
-        # now we're going to walk the fields of Card, popping them out
-        missing = object()
-        for f in iter(Card._meta.concrete_fields):
-            trial = values.pop(f.name, missing)
-            if trial is not missing:
-                continue
-
-            # might be a relational key, check for _id version before bailing
-            trial = values.pop(f"{f.name}_id")
-            self.assertIsNot(trial, missing, f"missing required field {f.name}")
-        
-        # now we check the annotations that queries like Card.objects.top()
-        # are known to add to ensure they're here
-        for extra in ['num_decks', 'rank']:
-            self.assertIn(extra, values, f"missing required field {extra}")
-            values.pop(extra)
-        
-        # finally, the dictionary should be empty by this point
-        self.assertDictEqual({}, values, "query has additional keys left")
-
-    def test_top_card_qs(self):
-        # SELECT "decklist_card"."id", "decklist_card"."name", "decklist_card"."identity_w", "decklist_card"."identity_u", "decklist_card"."identity_b", "decklist_card"."identity_r", "decklist_card"."identity_g", "decklist_card"."type_line", "decklist_card"."keywords", "decklist_card"."scryfall_uri", "decklist_card"."editorial_printing_id", "decklist_card"."partner_type", COUNT(DISTINCT "decklist_cardindeck"."id") FILTER (WHERE "decklist_deck"."pdh_legal") AS "num_decks", RANK() OVER (ORDER BY COUNT(DISTINCT "decklist_cardindeck"."id") FILTER (WHERE "decklist_deck"."pdh_legal") DESC) AS "rank" FROM "decklist_card" LEFT OUTER JOIN "decklist_cardindeck" ON ("decklist_card"."id" = "decklist_cardindeck"."card_id") LEFT OUTER JOIN "decklist_deck" ON ("decklist_cardindeck"."deck_id" = "decklist_deck"."id") GROUP BY "decklist_card"."id" HAVING COUNT(DISTINCT "decklist_cardindeck"."id") FILTER (WHERE ("decklist_deck"."pdh_legal")) > 0
-        self._test_qs(Card.objects.top)
-
-    def test_top_land_card_qs(self):
-        # SELECT "decklist_card"."id", "decklist_card"."name", "decklist_card"."identity_w", "decklist_card"."identity_u", "decklist_card"."identity_b", "decklist_card"."identity_r", "decklist_card"."identity_g", "decklist_card"."type_line", "decklist_card"."keywords", "decklist_card"."scryfall_uri", "decklist_card"."editorial_printing_id", "decklist_card"."partner_type", COUNT(DISTINCT "decklist_cardindeck"."id") FILTER (WHERE "decklist_deck"."pdh_legal") AS "num_decks", RANK() OVER (ORDER BY COUNT(DISTINCT "decklist_cardindeck"."id") FILTER (WHERE "decklist_deck"."pdh_legal") DESC) AS "rank" FROM "decklist_card" LEFT OUTER JOIN "decklist_cardindeck" ON ("decklist_card"."id" = "decklist_cardindeck"."card_id") LEFT OUTER JOIN "decklist_deck" ON ("decklist_cardindeck"."deck_id" = "decklist_deck"."id") WHERE "decklist_card"."type_line"::text LIKE %Land% GROUP BY "decklist_card"."id" HAVING COUNT(DISTINCT "decklist_cardindeck"."id") FILTER (WHERE ("decklist_deck"."pdh_legal")) > 0
-        self._test_qs(Card.objects.top_lands)
-
-    def test_top_nonland_card_qs(self):
-        # SELECT "decklist_card"."id", "decklist_card"."name", "decklist_card"."identity_w", "decklist_card"."identity_u", "decklist_card"."identity_b", "decklist_card"."identity_r", "decklist_card"."identity_g", "decklist_card"."type_line", "decklist_card"."keywords", "decklist_card"."scryfall_uri", "decklist_card"."editorial_printing_id", "decklist_card"."partner_type", COUNT(DISTINCT "decklist_cardindeck"."id") FILTER (WHERE "decklist_deck"."pdh_legal") AS "num_decks", RANK() OVER (ORDER BY COUNT(DISTINCT "decklist_cardindeck"."id") FILTER (WHERE "decklist_deck"."pdh_legal") DESC) AS "rank" FROM "decklist_card" LEFT OUTER JOIN "decklist_cardindeck" ON ("decklist_card"."id" = "decklist_cardindeck"."card_id") LEFT OUTER JOIN "decklist_deck" ON ("decklist_cardindeck"."deck_id" = "decklist_deck"."id") WHERE NOT ("decklist_card"."type_line"::text LIKE %Land%) GROUP BY "decklist_card"."id" HAVING COUNT(DISTINCT "decklist_cardindeck"."id") FILTER (WHERE ("decklist_deck"."pdh_legal")) > 0
-        self._test_qs(Card.objects.top_nonlands)
+    def setUpTestData(cls):
+        def card(name, rarities, type_line='Creature', **kwargs):
+            return make_card(name, type_line=type_line, rarities=rarities, **kwargs)
+
+        C, U, R = Rarity.COMMON, Rarity.UNCOMMON, Rarity.RARE
+        elf = card('Elf', [C, U], colors='g')
+        commander = card('Elf Lord', [U], 'Legendary Creature', colors='g')
+        rare_commander = card('Elf King', [R], 'Legendary Creature', colors='g')
+        rare = card('Rare Thing', [R], 'Artifact')
+        bird = card('Bird', [C], colors='u')
+        banned = card('Rhystic Study', [C], 'Enchantment', colors='u')
+        partner_w = card('Partner W', [U], partner_type=PartnerType.PARTNER, colors='w')
+        partner_u = card('Partner U', [U], partner_type=PartnerType.PARTNER, colors='u')
+        weaver = card('Ley Weaver', [U], partner_type=PartnerType.PARTNER_WITH_WEAVER, colors='g')
+        chooser = card('Chooser', [U], partner_type=PartnerType.CHOOSE_A_BACKGROUND, colors='b')
+        background = card('Background', [U], 'Enchantment', partner_type=PartnerType.BACKGROUND, colors='r')
+        sorcery = card('Big Spell', [U], 'Sorcery', colors='g')
+
+        decks = [
+            [],
+            [(commander, True), (elf, False)],
+            [(commander, True), (elf, False), (banned, False)],
+            [(rare_commander, True), (elf, False)],
+            [(sorcery, True), (elf, False)],
+            [(commander, True), (elf, False), (bird, False), (bird, False)],
+            [(commander, True), (rare, False)],
+            [(partner_w, True), (partner_u, True), (bird, False), (elf, False)],
+            [(partner_w, True), (partner_u, True), (bird, False)],
+            [(commander, True), (partner_w, True), (elf, False)],
+            [(partner_w, True), (partner_u, True), (commander, True)],
+            [(elf, False)],
+            [(weaver, True), (weaver, True)],
+            [(chooser, True), (background, True), (elf, False)],
+            [(background, True), (chooser, True)],
+            [(background, True), (sorcery, True)],
+        ]
+        cls.decks = []
+        for i, cards in enumerate(decks):
+            deck = Deck.objects.create(name=f'Deck {i}', source=0, source_id=str(i))
+            for c, is_commander in cards:
+                CardInDeck.objects.create(deck=deck, card=c, is_pdh_commander=is_commander)
+            cls.decks.append(deck)
+
+    def test_matches_check_deck_legality(self):
+        expected = [(deck.id, *deck.check_deck_legality()) for deck in self.decks]
+
+        with self.assertNumQueries(2):
+            actual = list(check_decks([deck.id for deck in self.decks]))
+
+        self.assertEqual(actual, expected)
+        # make sure the fixtures actually exercise the rules
+        self.assertGreater(len({reason for _, _, reason in expected}), 10)
+
+
+class IdentityMaskTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.simic = make_card('Simic Guy', 'ug')
+        cls.red = make_card('Red Guy', 'r')
+        cls.white = make_card('White Guy', 'w')
+
+        cls.commanders = {}
+        for i, cards in enumerate([(cls.simic,), (cls.red,), (cls.red, cls.white)]):
+            cards = sorted(cards, key=lambda c: c.id)
+            cmdr = Commander.objects.create(
+                commander1=cards[0],
+                commander2=cards[1] if len(cards) > 1 else None,
+            )
+            deck = Deck.objects.create(name=f'Deck {i}', source=0, source_id=str(i), pdh_legal=True, commander=cmdr)
+            for c in cards:
+                CardInDeck.objects.create(deck=deck, card=c, is_pdh_commander=True)
+            cls.commanders[cmdr.color_identity] = cmdr
+
+    def test_commander_masks(self):
+        self.assertEqual(set(self.commanders), {'UG', 'R', 'WR'})
+        self.assertEqual(self.commanders['UG'].identity_mask, 2 | 16)
+
+        # saved masks survive a refresh from the cards
+        Commander.objects.update(identity_mask=0)
+        Commander.objects.refresh_identity()
+        self.assertEqual(
+            sorted(Commander.objects.values_list('identity_mask', flat=True)),
+            [8, 1 | 8, 2 | 16],
+        )
+
+    def test_color_filters(self):
+        def names(qs):
+            return sorted(str(c) for c in qs)
+
+        self.assertEqual(names(Commander.objects.decks_of_exact_color(False, False, False, True, False)), ['Red Guy'])
+        self.assertEqual(len(Commander.objects.decks_of_at_least_color(False, False, False, True, False)), 2)
+        self.assertEqual(len(Commander.objects.decks_of_at_least_color(False, False, False, False, False)), 3)
+        self.assertEqual(names(Card.objects.filter(identity_mask__in=identity_supersets(16))), ['Simic Guy'])
+
+    def test_deck_identity(self):
+        deck = Deck.objects.get(commander=self.commanders['WR'])
+        self.assertEqual(deck.identity(), {'white': True, 'blue': False, 'black': False, 'red': True, 'green': False})
+
+
+class CommanderCountsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        def commander(*cards):
+            cards = sorted(cards, key=lambda c: c.id)
+            return Commander.objects.create(
+                commander1=cards[0],
+                commander2=cards[1] if len(cards) > 1 else None,
+            )
+
+        cls.red = commander(make_card('Red Guy', 'r'))
+        cls.blue = commander(make_card('Blue Guy', 'u'))
+        cls.partners = commander(
+            make_card('Partner One', 'u', partner_type=PartnerType.PARTNER),
+            make_card('Partner Two', 'r', partner_type=PartnerType.PARTNER),
+        )
+        cls.background = commander(
+            make_card('Chooser', 'r', partner_type=PartnerType.CHOOSE_A_BACKGROUND),
+            make_card('Background', 'b', partner_type=PartnerType.BACKGROUND),
+        )
+
+        cls.decks = {}
+        for cmdr, legal, illegal in (
+            (cls.red, 3, 0),
+            (cls.blue, 1, 1),
+            (cls.partners, 3, 0),
+            (cls.background, 1, 0),
+        ):
+            cls.decks[cmdr.id] = [
+                Deck.objects.create(
+                    name=f'{cmdr} {i}',
+                    source=0,
+                    source_id=f'{cmdr.id}-{i}',
+                    pdh_legal=i < legal,
+                    commander=cmdr,
+                )
+                for i in range(legal + illegal)
+            ]
+
+    def setUp(self):
+        Commander.objects.recount()
+
+    def _ranks(self, qs):
+        return [(c.id, c.rank, c.num_decks) for c in qs]
+
+    def test_top(self):
+        ranks = self._ranks(Commander.objects.top())
+        # ties come out in ID order
+        self.assertEqual(ranks, sorted(ranks, key=lambda r: (r[1], r[0])))
+        self.assertEqual(
+            sorted(ranks),
+            sorted([
+                (self.red.id, 1, 3),
+                (self.partners.id, 1, 3),
+                (self.blue.id, 3, 1),
+                (self.background.id, 3, 1),
+            ]),
+        )
+        self.assertEqual(Commander.objects.legal_deck_total(), 8)
+
+    def test_slices(self):
+        self.assertEqual(
+            self._ranks(Commander.objects.ranked_of_color(False, True, False, True, False)),
+            [(self.partners.id, 1, 3)],
+        )
+        self.assertEqual(
+            self._ranks(Commander.objects.partner_pairs()),
+            [(self.partners.id, 1, 3)],
+        )
+        self.assertEqual(
+            self._ranks(Commander.objects.background_pairs()),
+            [(self.background.id, 1, 1)],
+        )
+        self.assertEqual(
+            Commander.objects.of_at_least_color(False, False, False, True, False).legal_deck_total(),
+            7,
+        )
+
+    def test_tracks_legality_changes(self):
+        blue_decks = self.decks[self.blue.id]
+        red_decks = self.decks[self.red.id]
+        with track_legal_decks(d.id for d in blue_decks + red_decks):
+            Deck.objects.filter(id=blue_decks[1].id).update(pdh_legal=True)
+            Deck.objects.filter(id__in=[d.id for d in red_decks[:2]]).update(pdh_legal=False)
+
+        counted = {c.id: c for c in Commander.objects.all()}
+        self.assertEqual(counted[self.blue.id].legal_deck_count, 2)
+        self.assertEqual(counted[self.blue.id].deck_rank, 2)
+        self.assertEqual(counted[self.red.id].legal_deck_count, 1)
+        self.assertEqual(counted[self.red.id].deck_rank, 3)
+        self.assertEqual(counted[self.red.id].color_rank, 1)
+
+        # the incremental counts agree with a full recount
+        Commander.objects.recount()
+        self.assertEqual(
+            {c.id: (c.legal_deck_count, c.deck_rank) for c in Commander.objects.all()},
+            {c.id: (c.legal_deck_count, c.deck_rank) for c in counted.values()},
+        )
+
+    def test_tracks_changes_before_a_failure(self):
+        red_decks = self.decks[self.red.id]
+        with self.assertRaises(RuntimeError):
+            with track_legal_decks(d.id for d in red_decks):
+                Deck.objects.filter(id=red_decks[0].id).update(pdh_legal=False)
+                raise RuntimeError('deck 2 was bad')
+
+        self.red.refresh_from_db()
+        self.assertEqual(self.red.legal_deck_count, 2)
+
+    def test_uncounted_commanders_are_unranked(self):
+        Deck.objects.filter(commander=self.background).update(pdh_legal=False)
+        Commander.objects.recount()
+        self.background.refresh_from_db()
+        self.assertEqual(self.background.legal_deck_count, 0)
+        self.assertIsNone(self.background.deck_rank)
+        self.assertIsNone(self.background.background_rank)
+        self.assertNotIn(self.background, Commander.objects.top())
+
+
+class SynergyEngineTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(1234)
+
+        leaders = [make_card(f'Leader {colors}', colors) for colors in ('g', 'ug', 'r', 'wubrg', '', 'w', 'wu', 'ugr')]
+        cls.cards = [
+            make_card(f'Card {i}', rng.choice(['', 'g', 'u', 'r', 'ug', 'w']))
+            for i in range(20)
+        ]
+
+        for leader in leaders:
+            Commander.objects.create(commander1=leader)
+        Commander.objects.refresh_identity()
+        commanders = list(Commander.objects.order_by('commander1__name'))
+        # a black card slips into the mono-green commander's decks
+        cls.off_color = make_card('Off Color', 'b')
+        cls.green = next(cmdr for cmdr in commanders if cmdr.commander1.name == 'Leader g')
+        for i in range(80):
+            cmdr = commanders[i % len(commanders)]
+            deck = Deck.objects.create(
+                name=f'Deck {i}',
+                source=0,
+                source_id=str(i),
+                # an illegal deck should count for nothing
+                pdh_legal=i % 10 != 0,
+                commander=cmdr,
+            )
+            CardInDeck.objects.create(deck=deck, card=cmdr.commander1, is_pdh_commander=True)
+            # some commanders show up in other commanders' decks, too
+            for c in rng.sample(cls.cards + leaders[:3], 10):
+                if c.identity_mask & ~cmdr.identity_mask == 0:
+                    CardInDeck.objects.create(deck=deck, card=c)
+            if cmdr == cls.green:
+                CardInDeck.objects.create(deck=deck, card=cls.off_color)
+        recount_all()
+
+    def _scores(self):
+        return {
+            (cmdr_id, card_id): score
+            for card_id, scores in compute_synergy_all()
+            for cmdr_id, score in scores
+        }
+
+    def _counts(self):
+        return set(
+            CommanderCardCount.objects
+            .filter(count__gt=0)
+            .values_list('commander_id', 'card_id', 'count')
+        )
+
+    def test_matches_bulk(self):
+        expected = {}
+        for card in Card.objects.all():
+            for cmdr, score in compute_synergy_bulk(card):
+                expected[(cmdr.id, card.id)] = score
+
+        with self.assertNumQueries(2):
+            actual = self._scores()
+
+        self.assertTrue(expected)
+        self.assertEqual(actual, expected)
+        # counted, but never scored
+        self.assertTrue(CommanderCardCount.objects.filter(commander=self.green, card=self.off_color).exists())
+        self.assertNotIn((self.green.id, self.off_color.id), actual)
+
+    def test_tracked_changes_match_recount(self):
+        CommanderCardCount.objects.update(changed=False)
+        decks = list(Deck.objects.filter(pdh_legal=True).order_by('id')[:6])
+        new_card = self.cards[0]
+        with track_legal_decks(d.id for d in decks):
+            # a new card, a dropped card, a legality flip and a new commander
+            CardInDeck.objects.create(deck=decks[0], card=new_card)
+            CardInDeck.objects.filter(deck=decks[1], is_pdh_commander=False).first().delete()
+            Deck.objects.filter(id=decks[2].id).update(pdh_legal=not decks[2].pdh_legal)
+            Deck.objects.filter(id=decks[3].id).update(commander=decks[4].commander)
+
+        changed = set(
+            CommanderCardCount.objects.changed().values_list('commander_id', flat=True)
+        )
+        self.assertLessEqual(
+            {decks[0].commander_id, decks[2].commander_id, decks[3].commander_id, decks[4].commander_id},
+            changed,
+        )
+        tracked_counts = self._counts()
+        tracked_scores = self._scores()
+
+        recount_all()
+        self.assertEqual(tracked_counts, self._counts())
+        self.assertEqual(tracked_scores, self._scores())
+
+    def test_limited_to_cards(self):
+        some = Card.objects.filter(id__in=[c.id for c in self.cards[:5]])
+        self.assertLessEqual(
+            {card_id for card_id, _ in compute_synergy_all(some)},
+            {c.id for c in self.cards[:5]},
+        )
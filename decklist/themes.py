@@ -0,0 +1,38 @@
+"""Keeps theme results current.
+
+How many of each deck's cards belong to each theme (`DeckTheme`) and how
+many of each commander's legal decks have each theme (`CommanderTheme`)
+are maintained as decks change by `decklist.deck_counts`. `ThemeResult`
+is derived from those counts.
+"""
+from decklist.models import CardTheme, CommanderTheme, DeckTheme, ThemeResult
+
+
+def refresh_theme(theme, matching_changed):
+    """Bring a theme's counts and results up to date after it was added or
+    edited. If which cards it matches may have changed, those are
+    rematched and every deck recounted; otherwise only the thresholds
+    need applying again."""
+    if matching_changed:
+        CardTheme.objects.refresh_themes([theme.id])
+        DeckTheme.objects.rebuild(theme_ids=[theme.id])
+    CommanderTheme.objects.rebuild(theme_ids=[theme.id])
+    ThemeResult.objects.refresh(theme_ids=[theme.id])
+
+
+def refresh_changed():
+    "Refresh results for commanders whose theme counts changed, returning how many."
+    changed = CommanderTheme.objects.changed()
+    commander_ids = set(changed.values_list('commander_id', flat=True))
+    ThemeResult.objects.refresh(commander_ids=commander_ids)
+    changed.filter(count=0).delete()
+    changed.update(changed=False)
+    return len(commander_ids)
+
+
+def rebuild_all():
+    "Recount every deck and commander's themes and rewrite every result."
+    DeckTheme.objects.rebuild()
+    CommanderTheme.objects.rebuild()
+    ThemeResult.objects.refresh()
+    CommanderTheme.objects.changed().update(changed=False)
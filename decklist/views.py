@@ -9,7 +9,7 @@ from django.views.decorators.http import require_POST
 from django import VERSION as django_version
 from django.utils import timezone
 from django.conf import settings
-from decklist.models import Card, TopCardView, TopLandCardView, TopNonLandCardView, Deck, Printing, CardInDeck, SiteStat, Commander, Theme, ThemeResult, SynergyScore
+from decklist.models import Card, Deck, Printing, CardInDeck, SiteStat, Commander, Theme, ThemeResult, SynergyScore, PackedSynergy
 from .wubrg_utils import COLORS, filter_to_name, name_to_symbol
 from .synergy import compute_synergy
 from django_htmx.http import trigger_client_event, HttpResponseClientRefresh
@@ -147,19 +147,15 @@ def _partner_boilerplate(request, heading, partner_queryset):
 
 
 def commanders_by_color(request, w=False, u=False, b=False, r=False, g=False):
-    cmdrs = (
-        Commander.objects
-        .decks_of_exact_color(w, u, b, r, g)
-        .count_and_rank_decks()
-    )
+    cmdrs = Commander.objects.ranked_of_color(w, u, b, r, g)
     paginator = Paginator(cmdrs, 25, orphans=3)
     page_number = request.GET.get('page')
     cmdrs_page = paginator.get_page(page_number)
 
     deck_count = (
         Commander.objects
-        .decks_of_exact_color(w, u, b, r, g)
-        .count()
+        .of_exact_color(w, u, b, r, g)
+        .legal_deck_total()
     )
 
     return render(
@@ -192,7 +188,7 @@ def land_index(request):
 
 
 def top_lands(request):
-    land_cards = TopLandCardView.objects.all()
+    land_cards = Card.objects.top_lands()
     deck_count = Deck.objects.legal().count()
 
     paginator = Paginator(land_cards, 25, orphans=3)
@@ -221,8 +217,8 @@ def lands_by_color(request, w=False, u=False, b=False, r=False, g=False):
 
     deck_count = (
         Commander.objects
-        .decks_of_at_least_color(w, u, b, r, g)
-        .count()
+        .of_at_least_color(w, u, b, r, g)
+        .legal_deck_total()
     )
 
     return render(
@@ -256,9 +252,9 @@ def card_index(request):
 
 def top_cards(request, include_land=True):
     if include_land:
-        cards = TopCardView.objects.all()
+        cards = Card.objects.top()
     else:
-        cards = TopNonLandCardView.objects.all()
+        cards = Card.objects.top_nonlands()
 
     paginator = Paginator(cards, 25, orphans=3)
     page_number = request.GET.get('page')
@@ -290,8 +286,8 @@ def cards_by_color(request, w=False, u=False, b=False, r=False, g=False):
 
     deck_count = (
         Commander.objects
-        .decks_of_at_least_color(w, u, b, r, g)
-        .count()
+        .of_at_least_color(w, u, b, r, g)
+        .legal_deck_total()
     )
 
     return render(
@@ -347,14 +343,14 @@ def single_card(request, card_id, sort_by_synergy=False):
 
     could_be_in = (
         Commander.objects
-        .decks_of_at_least_color(
+        .of_at_least_color(
             card.identity_w,
             card.identity_u,
             card.identity_b,
             card.identity_r,
             card.identity_g,
         )
-        .count()
+        .legal_deck_total()
     )
 
     solo_commander = Commander.objects.solo_card(card)
@@ -430,8 +426,8 @@ def single_cmdr(request, cmdr_id):
 
     could_be_in = (
         Commander.objects
-        .decks_of_at_least_color(**identity)
-        .count()
+        .of_at_least_color(**identity)
+        .legal_deck_total()
     )
 
     commands = cmdr.decks.order_by('-updated_time')
@@ -488,7 +484,10 @@ def single_cmdr_decklist(request, cmdr_id):
 def single_cmdr_synergy(request, cmdr_id):
     commander = get_object_or_404(Commander, sfid=cmdr_id)
 
-    scores = SynergyScore.objects.for_commander(commander).ranked()
+    if settings.SYNERGY_STORAGE == 'packed':
+        scores = PackedSynergy.objects.ranked_for(commander)
+    else:
+        scores = SynergyScore.objects.for_commander(commander).ranked()
 
     paginator = Paginator(scores, 25, orphans=3)
     page_number = request.GET.get('page')
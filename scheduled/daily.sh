@@ -8,7 +8,8 @@ set +e
 ./manage crawl-archidekt --no-stdout
 ./manage crawl-moxfield --no-stdout
 ./manage get-decklists --no-stdout
+./manage recheck-deck-legality --changed
 ./manage compute-commanders --no-stdout
+./manage compute-synergy --changed --no-stdout
 ./manage compute-themes --no-stdout
-./manage compute-top-cards --no-stdout
 ./manage update-site-stats
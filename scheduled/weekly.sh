@@ -1,5 +1,6 @@
 #!/bin/bash
 
 cd /app
-./manage compute-synergy --no-stdout
+./manage compute-synergy --workers "$(nproc)" --no-stdout
+./manage compute-themes --full --no-stdout
 ./manage update-site-stats
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 import dj_database_url
 import django_cache_url
 from django.urls import reverse_lazy
@@ -31,6 +32,16 @@ SMALLFORMATS_NAME = os.getenv("SMALLFORMATS_NAME", "Nameless Knockoff")
 # SECURITY WARNING: don't leak this
 MOXFIELD_API_KEY = os.environ.get('SMALLFORMATS_MOXFIELD_USERAGENT')
 
+# where fetch-cards keeps its copy of Scryfall's bulk file between runs
+SCRYFALL_CACHE_DIR = Path(os.getenv(
+    "SMALLFORMATS_SCRYFALL_CACHE",
+    Path(tempfile.gettempdir()) / "smallformats-scryfall",
+))
+
+# how synergy scores are kept: 'rows' (a SynergyScore per commander and
+# card) or 'packed' (one PackedSynergy row per commander)
+SYNERGY_STORAGE = os.getenv("SMALLFORMATS_SYNERGY_STORAGE", "rows")
+
 ALLOWED_HOSTS = [
     '.localhost',
     '127.0.0.1',